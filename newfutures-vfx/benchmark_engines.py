@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+🧮 NewFutures VFX 引擎微基准测试
+在固定种子的场景上按几种规模运行各模拟和渲染内核，统计吞吐量、峰值RSS和内存分配，
+输出图像与黄金参考图比较：提速的同时改变了像素也会被发现
+"""
+
+import io
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent
+SRC_DIR = ROOT / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+GOLDEN_DIR = ROOT / "benchmarks" / "golden"
+DEFAULT_BASELINE = ROOT / "benchmarks" / "engine_baseline.json"
+
+# 模拟内核的输出尺寸和推进的帧数
+IMAGE_SIZE = (128, 128)
+FRAMES = 24
+FPS = 24
+
+# 每个用例重复测量的次数，吞吐量取最好的一次，减少机器抖动的影响
+REPEATS = 3
+
+# 统计内存分配时只推进的帧数（tracemalloc会显著拖慢执行，单独跑一小段）
+ALLOCATION_FRAMES = 2
+
+# 内核 -> 规模 -> 参数；raytracing的参数为渲染配置，其余为模拟特效参数
+KERNELS: Dict[str, Dict[str, Dict[str, Any]]] = {
+    "particles": {
+        "small": {"count": 10000},
+        "medium": {"count": 100000},
+        "large": {"count": 400000},
+    },
+    "fluid": {
+        "small": {"resolution": 64},
+        "medium": {"resolution": 128},
+        "large": {"resolution": 256},
+    },
+    "physics": {
+        "small": {"count": 200},
+        "medium": {"count": 1000},
+        "large": {"count": 4000},
+    },
+    "volumetric": {
+        "small": {"resolution": 64},
+        "medium": {"resolution": 128},
+        "large": {"resolution": 192},
+    },
+    "raytracing": {
+        "small": {"resolution": "64x64", "samples": 4},
+        "medium": {"resolution": "128x128", "samples": 8},
+        "large": {"resolution": "256x256", "samples": 8},
+    },
+}
+
+# 这些模拟器的 step 只推进相机和光源的时间，计算都在 render 里，不统计步进速度
+RENDER_ONLY = {"volumetric"}
+
+# 吞吐量指标越小越差，内存指标越大越差
+THROUGHPUT_METRICS = ("steps_per_second", "frames_per_second", "rays_per_second", "samples_per_second")
+MEMORY_METRICS = ("peak_rss_mb", "peak_alloc_mb")
+
+# 与黄金图比较：8位像素的平均绝对误差，以及误差超过 PIXEL_THRESHOLD 的像素比例
+PIXEL_THRESHOLD = 4
+
+
+def _run_simulation(effect: str, parameters: Dict[str, Any]) -> Tuple[Dict[str, float], Any]:
+    import numpy as np
+
+    from services.render_tasks import FRAME_EFFECTS, SIMULATIONS
+
+    create, _ = {**SIMULATIONS, **FRAME_EFFECTS}[effect]
+    width, height = IMAGE_SIZE
+    dt = 1.0 / FPS
+
+    simulation = create(parameters, 0)
+    step_seconds = render_seconds = 0.0
+    samples = 0
+    for _ in range(FRAMES):
+        start = time.perf_counter()
+        simulation.step(dt)
+        step_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        pixels = simulation.render(width, height)
+        render_seconds += time.perf_counter() - start
+        samples += getattr(simulation, "last_samples", 0)
+
+    metrics = {"frames_per_second": FRAMES / (step_seconds + render_seconds)}
+    if effect not in RENDER_ONLY:
+        metrics["steps_per_second"] = FRAMES / step_seconds
+    if samples:
+        metrics["samples_per_second"] = samples / render_seconds
+    return metrics, np.asarray(pixels)
+
+
+def _trace_allocations_simulation(effect: str, parameters: Dict[str, Any]) -> int:
+    import tracemalloc
+
+    from services.render_tasks import FRAME_EFFECTS, SIMULATIONS
+
+    create, _ = {**SIMULATIONS, **FRAME_EFFECTS}[effect]
+    simulation = create(parameters, 0)
+    tracemalloc.start()
+    try:
+        for _ in range(ALLOCATION_FRAMES):
+            simulation.step(1.0 / FPS)
+            simulation.render(*IMAGE_SIZE)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _run_raytracing(config: Dict[str, Any]) -> Tuple[Dict[str, float], Any]:
+    import numpy as np
+
+    from services.render_tasks import parse_resolution, plan_tiles, render_tile
+
+    config = dict(config, engine="Cycles")
+    width, height = parse_resolution(config["resolution"])
+    tiles = plan_tiles(config)
+    image = np.zeros((height, width, 3), dtype=np.float32)
+    # 第一个tile包含场景解析，先渲染一次不计时
+    render_tile(config, 1, tiles[0])
+    samples = 0
+    start = time.perf_counter()
+    for tile in tiles:
+        x0, y0, x1, y1 = tile
+        image[y0:y1, x0:x1], spent = render_tile(config, 1, tile)
+        samples += spent
+    seconds = time.perf_counter() - start
+    return {"rays_per_second": samples / seconds}, image
+
+
+def _trace_allocations_raytracing(config: Dict[str, Any]) -> int:
+    import tracemalloc
+
+    from services.render_tasks import plan_tiles, render_tile
+
+    config = dict(config, engine="Cycles")
+    tile = plan_tiles(config)[0]
+    render_tile(config, 1, tile)
+    tracemalloc.start()
+    try:
+        render_tile(config, 1, tile)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(kernel: str, size: str, repeats: int = REPEATS) -> Tuple[Dict[str, float], bytes]:
+    """
+    在独立的子进程中运行一个用例，返回 (指标, 色调映射后的PNG)
+
+    每个用例一个新进程，峰值RSS只包含这个用例；单个计算线程，与渲染进程池一致。
+    """
+    from services.render_tasks import init_worker
+
+    init_worker()
+
+    import resource
+
+    from PIL import Image
+
+    from effects.path_tracer import tone_map
+
+    parameters = KERNELS[kernel][size]
+    metrics: Dict[str, float] = {}
+    start = time.perf_counter()
+    for _ in range(max(1, repeats)):
+        if kernel == "raytracing":
+            run, pixels = _run_raytracing(parameters)
+        else:
+            run, pixels = _run_simulation(kernel, parameters)
+        for name, value in run.items():
+            metrics[name] = max(value, metrics.get(name, 0.0))
+    metrics["seconds"] = time.perf_counter() - start
+    metrics["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    if kernel == "raytracing":
+        allocated = _trace_allocations_raytracing(parameters)
+    else:
+        allocated = _trace_allocations_simulation(kernel, parameters)
+    metrics["peak_alloc_mb"] = allocated / (1024 * 1024)
+
+    out = io.BytesIO()
+    Image.fromarray(tone_map(pixels)).save(out, "PNG")
+    return {name: round(value, 3) for name, value in metrics.items()}, out.getvalue()
+
+
+def compare_image(image: bytes, golden: Path) -> Dict[str, float]:
+    """与黄金图逐像素比较"""
+    import numpy as np
+    from PIL import Image
+
+    actual = np.asarray(Image.open(io.BytesIO(image)).convert("RGB"), dtype=np.int16)
+    expected = np.asarray(Image.open(golden).convert("RGB"), dtype=np.int16)
+    if actual.shape != expected.shape:
+        return {"mean_error": float("inf"), "bad_pixels": 1.0}
+    error = np.abs(actual - expected)
+    return {
+        "mean_error": round(float(error.mean()), 4),
+        "bad_pixels": round(float((error.max(axis=2) > PIXEL_THRESHOLD).mean()), 5),
+    }
+
+
+def compare_baseline(
+    results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float
+) -> List[str]:
+    """与速度基线比较，返回退化项的说明"""
+    regressions = []
+    for case, result in results.items():
+        reference = baseline.get(case, {})
+        for metric in THROUGHPUT_METRICS:
+            if metric in result and metric in reference:
+                if result[metric] < reference[metric] * (1 - tolerance):
+                    regressions.append(
+                        f"{case} {metric}: {result[metric]:.1f} < 基线 {reference[metric]:.1f}"
+                    )
+        for metric in MEMORY_METRICS:
+            if metric in result and metric in reference:
+                if result[metric] > reference[metric] * (1 + tolerance):
+                    regressions.append(
+                        f"{case} {metric}: {result[metric]:.1f} > 基线 {reference[metric]:.1f}"
+                    )
+    return regressions
+
+
+def _format_metrics(metrics: Dict[str, float]) -> str:
+    parts = [f"{metric}={metrics[metric]:,.1f}" for metric in THROUGHPUT_METRICS if metric in metrics]
+    parts.append(f"RSS {metrics['peak_rss_mb']:.0f}MB")
+    parts.append(f"分配 {metrics['peak_alloc_mb']:.1f}MB")
+    return ", ".join(parts)
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NewFutures VFX 引擎微基准测试")
+    parser.add_argument("--kernels", default=",".join(KERNELS), help="逗号分隔的内核列表")
+    parser.add_argument("--sizes", default="small,medium", help="逗号分隔的规模（small, medium, large）")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="每个用例的重复次数")
+    parser.add_argument("--update-golden", action="store_true", help="用本次输出更新黄金参考图")
+    parser.add_argument("--max-mean-error", type=float, default=0.5, help="允许的平均像素误差（8位）")
+    parser.add_argument("--max-bad-pixels", type=float, default=0.001,
+                        help=f"允许误差超过{PIXEL_THRESHOLD}的像素比例")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="速度基线JSON文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为速度基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的速度/内存退化比例")
+    args = parser.parse_args()
+
+    kernels = [name.strip() for name in args.kernels.split(",") if name.strip()]
+    sizes = [name.strip() for name in args.sizes.split(",") if name.strip()]
+    unknown = [name for name in kernels if name not in KERNELS]
+    unknown += [name for name in sizes if name not in KERNELS["particles"]]
+    if unknown:
+        raise SystemExit(f"❌ 未知的内核或规模: {', '.join(unknown)}")
+
+    print("🧮 NewFutures VFX 引擎微基准测试")
+    print("=" * 60)
+
+    results: Dict[str, Dict[str, float]] = {}
+    failures: List[str] = []
+    context = get_context("spawn")
+    for kernel in kernels:
+        for size in sizes:
+            case = f"{kernel}-{size}"
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                metrics, image = pool.submit(run_case, kernel, size, args.repeats).result()
+            results[case] = metrics
+
+            golden = GOLDEN_DIR / f"{case}.png"
+            if args.update_golden:
+                golden.parent.mkdir(parents=True, exist_ok=True)
+                golden.write_bytes(image)
+                status = "💾 已更新黄金图"
+            elif not golden.exists():
+                status = "⚠️  没有黄金图"
+            else:
+                diff = compare_image(image, golden)
+                metrics.update(diff)
+                if diff["mean_error"] > args.max_mean_error or diff["bad_pixels"] > args.max_bad_pixels:
+                    status = f"❌ 图像不一致 (平均误差 {diff['mean_error']}, 异常像素 {diff['bad_pixels']:.2%})"
+                    failures.append(f"{case}: 输出与黄金图不一致")
+                else:
+                    status = "✅ 图像一致"
+            print(f"{case:<20} {metrics['seconds']:>7.2f}s  {_format_metrics(metrics)}  {status}")
+
+    print("=" * 60)
+    if args.save_baseline:
+        baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        baseline.update(results)
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(baseline, indent=2, ensure_ascii=False) + "\n")
+        print(f"💾 速度基线已保存: {args.baseline}")
+    elif args.baseline.exists():
+        failures += compare_baseline(results, json.loads(args.baseline.read_text()), args.tolerance)
+
+    if failures:
+        print("❌ 失败:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("🎉 所有内核通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+📈 NewFutures VFX 负载与延迟基准测试
+以固定速率（开环）向各接口发送请求，统计p50/p95/p99/max延迟和吞吐量，
+结果保存为JSON基线，与基线相比退化超出容差时失败
+"""
+
+import asyncio
+import json
+import math
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "benchmarks" / "load_baseline.json"
+
+# 与基线比较的指标：延迟越大越差，吞吐量越小越差
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+# 延迟差值小于此值（毫秒）时不算退化，避免亚毫秒级的抖动被按比例放大
+MIN_LATENCY_DELTA_MS = 1.0
+
+# 上传场景每次追加的数据量
+UPLOAD_CHUNK = 64 * 1024
+
+# 渲染提交场景使用的配置：帧命中渲染缓存后，测量的是API本身的开销
+RENDER_CONFIG = {
+    "resolution": "64x64", "quality": "draft", "output_format": "png",
+    "engine": "Cycles", "samples": 1, "frames": [1],
+}
+
+
+def _check(response: httpx.Response):
+    """HTTP错误和 {"error": ...} 响应都算失败"""
+    response.raise_for_status()
+    if response.headers.get("content-type", "").startswith("application/json"):
+        data = response.json()
+        if isinstance(data, dict) and data.get("error"):
+            raise RuntimeError(data["error"])
+
+
+async def _health(client: httpx.AsyncClient, context: Dict[str, Any]):
+    _check(await client.get("/health"))
+
+
+async def _catalog(client: httpx.AsyncClient, context: Dict[str, Any]):
+    _check(await client.get("/api/v1/vfx/effects"))
+
+
+async def _render_submit(client: httpx.AsyncClient, context: Dict[str, Any]):
+    _check(await client.post("/api/v1/render/start", json=RENDER_CONFIG))
+
+
+async def _progress(client: httpx.AsyncClient, context: Dict[str, Any]):
+    _check(await client.get(f"/api/v1/render/progress/{context['task_id']}"))
+
+
+async def _upload(client: httpx.AsyncClient, context: Dict[str, Any]):
+    """创建会话、追加一块数据、取消（不在磁盘上留下文件）"""
+    response = await client.post(
+        "/api/v1/upload", json={"filename": "benchmark.wav", "size": 2 * UPLOAD_CHUNK}
+    )
+    _check(response)
+    upload_id = response.json()["upload_id"]
+    try:
+        _check(await client.patch(
+            f"/api/v1/upload/{upload_id}", content=context["chunk"], headers={"Upload-Offset": "0"}
+        ))
+    finally:
+        await client.delete(f"/api/v1/upload/{upload_id}")
+
+
+async def _prepare_progress(client: httpx.AsyncClient, context: Dict[str, Any]):
+    response = await client.post("/api/v1/render/start", json=RENDER_CONFIG)
+    _check(response)
+    context["task_id"] = response.json()["task_id"]
+
+
+async def _prepare_upload(client: httpx.AsyncClient, context: Dict[str, Any]):
+    # 上传会校验文件头，数据以WAV头开始
+    header = b"RIFF" + (2 * UPLOAD_CHUNK - 8).to_bytes(4, "little") + b"WAVE"
+    context["chunk"] = header + bytes(UPLOAD_CHUNK - len(header))
+
+
+@dataclass
+class Scenario:
+    """一个负载场景：每次操作执行 request，rate 为每秒发起的操作数"""
+
+    name: str
+    request: Callable[[httpx.AsyncClient, Dict[str, Any]], Awaitable[None]]
+    rate: float
+    prepare: Optional[Callable[[httpx.AsyncClient, Dict[str, Any]], Awaitable[None]]] = None
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "health": Scenario("health", _health, rate=100),
+    "catalog": Scenario("catalog", _catalog, rate=200),
+    "render_submit": Scenario("render_submit", _render_submit, rate=20, prepare=_prepare_progress),
+    "progress": Scenario("progress", _progress, rate=100, prepare=_prepare_progress),
+    "upload": Scenario("upload", _upload, rate=10, prepare=_prepare_upload),
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩百分位数（values已排序）"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, scenario: Scenario, duration: float, rate: Optional[float] = None
+) -> Dict[str, float]:
+    """
+    按固定间隔发起操作，不等待前一个完成（开环）
+
+    延迟从计划发起时刻算起：服务端变慢导致排队时，排队时间也计入延迟，
+    不会因为发得少了而掩盖尾延迟。
+    """
+    context: Dict[str, Any] = {}
+    if scenario.prepare is not None:
+        await scenario.prepare(client, context)
+
+    rate = rate or scenario.rate
+    interval = 1.0 / rate
+    latencies: List[float] = []
+    errors = 0
+
+    async def operation(scheduled: float):
+        nonlocal errors
+        try:
+            await scenario.request(client, context)
+        except Exception:
+            errors += 1
+            return
+        latencies.append(time.perf_counter() - scheduled)
+
+    tasks = []
+    start = time.perf_counter()
+    for i in range(max(1, int(duration * rate))):
+        scheduled = start + i * interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(operation(scheduled)))
+    await asyncio.gather(*tasks)
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run_load(
+    base_url: str, names: List[str], duration: float, rates: Optional[Dict[str, float]] = None
+) -> Dict[str, Dict[str, float]]:
+    """依次运行各场景，返回 场景名 -> 统计结果"""
+    rates = rates or {}
+    limits = httpx.Limits(max_connections=256, max_keepalive_connections=256)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        for name in names:
+            results[name] = await run_scenario(client, SCENARIOS[name], duration, rates.get(name))
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float
+) -> List[str]:
+    """与基线比较，返回退化项的说明"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for metric in LATENCY_METRICS:
+            limit = max(reference[metric] * (1 + tolerance), reference[metric] + MIN_LATENCY_DELTA_MS)
+            if result[metric] > limit:
+                regressions.append(
+                    f"{name} {metric}: {result[metric]:.2f} > 基线 {reference[metric]:.2f}"
+                )
+        if result["throughput_rps"] < reference["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name} throughput_rps: {result['throughput_rps']:.1f} < 基线 {reference['throughput_rps']:.1f}"
+            )
+        if result["errors"] > reference["errors"]:
+            regressions.append(f"{name} errors: {result['errors']} > 基线 {reference['errors']}")
+    return regressions
+
+
+def _parse_rates(values: List[str]) -> Dict[str, float]:
+    rates = {}
+    for value in values:
+        name, _, rate = value.partition("=")
+        if name not in SCENARIOS or not rate:
+            raise SystemExit(f"❌ 无效的速率设置: {value}（格式: 场景=每秒请求数）")
+        rates[name] = float(rate)
+    return rates
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NewFutures VFX 负载与延迟基准测试")
+    parser.add_argument("--url", default="http://localhost:8000", help="服务器URL")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔的场景列表")
+    parser.add_argument("--duration", type=float, default=10.0, help="每个场景的持续时间（秒）")
+    parser.add_argument("--rate", action="append", default=[], help="场景速率，如 catalog=500，可重复")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="基线JSON文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"❌ 未知场景: {', '.join(unknown)}（可选: {', '.join(SCENARIOS)}）")
+    rates = _parse_rates(args.rate)
+
+    print("📈 NewFutures VFX 负载与延迟基准测试")
+    print("=" * 60)
+    print(f"🌐 测试目标: {args.url}，每个场景 {args.duration:.0f}秒")
+    results = asyncio.run(run_load(args.url, names, args.duration, rates))
+
+    print(f"{'scenario':<16}{'requests':>9}{'errors':>7}{'rps':>10}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'maxms':>9}")
+    for name, result in results.items():
+        print(
+            f"{name:<16}{result['requests']:>9}{result['errors']:>7}{result['throughput_rps']:>10.1f}"
+            f"{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['max_ms']:>9.2f}"
+        )
+    print("=" * 60)
+
+    if args.save_baseline:
+        baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        baseline.update(results)
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(baseline, indent=2, ensure_ascii=False) + "\n")
+        print(f"💾 基线已保存: {args.baseline}")
+        sys.exit(0)
+
+    if not args.baseline.exists():
+        print(f"⚠️  没有基线文件 {args.baseline}，用 --save-baseline 生成")
+        sys.exit(0)
+
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+    if regressions:
+        print(f"❌ 超出容差 {args.tolerance:.0%} 的退化:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        sys.exit(1)
+    print(f"🎉 与基线相比没有超出 {args.tolerance:.0%} 的退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+⏱️ NewFutures VFX 冷启动基准测试
+在全新的解释器中导入应用并执行启动流程，测量到服务就绪的耗时，超出预算时失败
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent / "src"
+
+# 启动路径上不应导入的重型模块（应在首次使用时加载）
+HEAVY_MODULES = [
+    "numpy", "torch", "transformers", "diffusers", "cv2", "librosa", "PIL", "sqlalchemy",
+]
+
+# 子进程：导入应用、执行lifespan启动部分，就绪后输出一行JSON
+PROBE = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+heavy = [name for name in {heavy!r} if name in sys.modules]
+
+async def probe():
+    async with main.lifespan(main.app):
+        ready = time.perf_counter()
+        print("READY " + json.dumps({{
+            "import": imported - start, "lifespan": ready - imported, "heavy": heavy,
+        }}), flush=True)
+
+asyncio.run(probe())
+"""
+
+
+def run_once(env):
+    """启动一个全新的解释器，返回 (到就绪的总耗时, 子进程报告的分项)"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", PROBE.format(heavy=HEAVY_MODULES)],
+        cwd=SRC_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    report = None
+    for line in process.stdout:
+        if line.startswith("READY "):
+            total = time.perf_counter() - started
+            report = json.loads(line[len("READY "):])
+            break
+    process.stdout.close()
+    process.wait()
+    if report is None:
+        raise RuntimeError(f"应用启动失败 (退出码 {process.returncode})")
+    return total, report
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NewFutures VFX 冷启动基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数")
+    parser.add_argument("--budget", type=float, default=0.75, help="就绪耗时预算（秒，中位数）")
+    parser.add_argument("--use-env", action="store_true", help="使用当前环境的Redis配置（默认用进程内存储）")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=str(SRC_DIR))
+    if not args.use_env:
+        # 默认不依赖外部Redis，只测量应用自身的启动开销
+        env["REDIS_URL"] = "memory://"
+
+    print("⏱️  NewFutures VFX 冷启动基准测试")
+    print("=" * 60)
+
+    # 预热：首次启动会跑硬件基准、构建静态资源，结果缓存后不计入
+    run_once(env)
+
+    totals = []
+    for i in range(args.runs):
+        total, report = run_once(env)
+        totals.append(total)
+        print(
+            f"#{i + 1}: 就绪 {total:.3f}s (导入 {report['import']:.3f}s, "
+            f"启动流程 {report['lifespan']:.3f}s)"
+        )
+
+    median = statistics.median(totals)
+    print("=" * 60)
+    print(f"📊 中位数 {median:.3f}s, 最大 {max(totals):.3f}s, 预算 {args.budget:.3f}s")
+
+    success = median <= args.budget
+    if report["heavy"]:
+        print(f"❌ 启动路径上导入了重型模块: {', '.join(report['heavy'])}")
+        success = False
+    print("🎉 冷启动在预算内" if success else "⚠️  冷启动超出预算")
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
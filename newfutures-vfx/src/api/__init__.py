@@ -6,6 +6,7 @@ from fastapi import APIRouter
 
 from .vfx import router as vfx_router
 from .render import router as render_router
+from .upload import router as upload_router
 
 # 创建主路由器
 router = APIRouter()
@@ -13,6 +14,7 @@ router = APIRouter()
 # 包含子路由
 router.include_router(vfx_router, prefix="/vfx", tags=["VFX"])
 router.include_router(render_router, prefix="/render", tags=["Render"])
+router.include_router(upload_router, prefix="/upload", tags=["Upload"])
 
 @router.get("/")
 async def api_root():
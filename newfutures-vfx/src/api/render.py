@@ -2,66 +2,217 @@
 渲染相关API
 """
 
-from fastapi import APIRouter
-from typing import Dict, Any, Optional
+import asyncio
+import time
+from pathlib import Path
+
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
+from typing import Dict, Any, List, Optional
+from loguru import logger
+
+from core.config import settings
+from services.catalog import catalog
+from services.hardware import GIB, hardware_profile, render_workers, simulation_budget
+from services.progress import KEEPALIVE_INTERVAL, ProgressEvent, progress_broker
+from services.render_cache import render_cache
+from services.job_state import load_job_state
+from services.render_history import list_history
+from services.render_queue import RenderJob, render_queue
+from services.render_tasks import (
+    ENGINE_FALLBACKS, OUTPUT_FORMATS, frame_extension, output_format, plan_tiles, preview_frame,
+    resolve_engine, resolve_simulation, sampling_settings, simulation_memory
+)
+from utils.file_response import file_response
 
 router = APIRouter()
 
-@router.get("/capabilities")
-async def get_render_capabilities():
-    """获取渲染器能力"""
+# 渲染预设，按档位从快到慢排列；列表顺序同时也是任务调度优先级
+# 预设都使用自适应采样：samples 是每个像素的采样上限，噪声低于 noise_threshold 的像素提前停止
+RENDER_PRESETS: List[Dict[str, Any]] = [
+    {
+        "name": "快速预览",
+        "quality": "low",
+        "resolution": "1280x720",
+        "samples": 64,
+        "adaptive_sampling": True,
+        "noise_threshold": 0.05,
+        "engine": "Eevee"
+    },
+    {
+        "name": "标准质量",
+        "quality": "medium",
+        "resolution": "1920x1080",
+        "samples": 128,
+        "adaptive_sampling": True,
+        "noise_threshold": 0.02,
+        "engine": "Cycles"
+    },
+    {
+        "name": "高质量",
+        "quality": "high",
+        "resolution": "2560x1440",
+        "samples": 256,
+        "adaptive_sampling": True,
+        "noise_threshold": 0.01,
+        "engine": "Cycles"
+    },
+    {
+        "name": "电影质量",
+        "quality": "ultra",
+        "resolution": "3840x2160",
+        "samples": 512,
+        "adaptive_sampling": True,
+        "noise_threshold": 0.005,
+        "engine": "OptiX"
+    }
+]
+
+
+def _render_capabilities() -> Dict[str, Any]:
+    """渲染器能力，内存、核数和吞吐量均为本机实测值"""
+    profile = hardware_profile()
+    workers = render_workers()
+    benchmark = profile.benchmark or {}
+    samples_per_second = benchmark.get("path_samples_per_second")
     return {
-        "gpu_available": True,
+        "gpu_available": bool(profile.gpus),
         "max_resolution": "8192x8192",
-        "supported_formats": ["mp4", "avi", "mov", "png", "jpg", "exr"],
+        "supported_formats": sorted(OUTPUT_FORMATS),
         "render_engines": [
             {"name": "Cycles", "type": "raytracing", "available": True},
             {"name": "Eevee", "type": "rasterization", "available": True},
-            {"name": "OptiX", "type": "gpu_raytracing", "available": True}
+            {"name": "OptiX", "type": "gpu_raytracing", "available": False,
+             "fallback": ENGINE_FALLBACKS["OptiX"]}
         ],
         "memory_info": {
-            "total_gb": 32,
-            "available_gb": 24,
-            "gpu_memory_gb": 12
-        }
+            "total_gb": round(profile.memory_total / GIB, 2),
+            "available_gb": round(profile.memory_available / GIB, 2),
+            "gpu_memory_gb": round(profile.gpu_memory / GIB, 2)
+        },
+        "cpu_info": {
+            "model": profile.cpu_model,
+            "logical_cores": profile.logical_cores,
+            "physical_cores": profile.physical_cores,
+            "usable_cores": profile.usable_cores,
+            "numa_nodes": [
+                {
+                    "node": node.node,
+                    "cpus": len(node.cpus),
+                    "memory_total_gb": round(node.memory_total / GIB, 2),
+                    "memory_free_gb": round(node.memory_free / GIB, 2)
+                }
+                for node in profile.numa_nodes
+            ]
+        },
+        "gpus": [
+            {"name": gpu["name"], "memory_gb": round(gpu["memory_total"] / GIB, 2)}
+            for gpu in profile.gpus
+        ],
+        "render_workers": workers,
+        "simulation_memory_budget_gb": round(simulation_budget() / GIB, 2),
+        "benchmark": {
+            **benchmark,
+            "estimated_samples_per_second": samples_per_second and samples_per_second * workers
+        } if benchmark else None
     }
 
-@router.get("/presets")
-async def get_render_presets():
-    """获取渲染预设"""
+
+catalog.register_builder("render/capabilities", _render_capabilities)
+catalog.register("render/presets", {"presets": RENDER_PRESETS})
+
+# 允许下载的渲染输出格式；队列状态、帧缓冲和模拟检查点不对外提供
+OUTPUT_EXTENSIONS = {".png", ".jpg", ".jpeg", ".exr", ".mp4", ".avi", ".mov", ".mkv", ".webm"}
+
+
+def _output_root() -> Path:
+    return (settings.BASE_DIR / settings.RENDER_OUTPUT_DIR).resolve()
+
+
+def _output_path(name: str) -> Path:
+    """把下载路径解析到渲染输出目录下，拒绝目录穿越和非输出文件"""
+    root = _output_root()
+    path = (root / name).resolve()
+    if root not in path.parents or path.suffix.lower() not in OUTPUT_EXTENSIONS:
+        raise ValueError(f"Invalid render output path: {name}")
+    if not path.is_file():
+        raise FileNotFoundError(f"Render output not found: {name}")
+    return path
+
+
+def _output_url(output_file: str) -> str:
+    """输出文件 -> 下载地址"""
+    relative = Path(output_file).resolve().relative_to(_output_root())
+    return f"/api/v1/render/output/{relative.as_posix()}"
+
+
+def _match_preset(render_config: Dict[str, Any]) -> Optional[int]:
+    """按预设名或质量档位找到对应的预设序号"""
+    for index, preset in enumerate(RENDER_PRESETS):
+        if render_config.get("preset") == preset["name"]:
+            return index
+    for index, preset in enumerate(RENDER_PRESETS):
+        if render_config.get("quality") == preset["quality"]:
+            return index
+    return None
+
+
+def _frame_range(render_config: Dict[str, Any]) -> List[int]:
+    """解析需要渲染的帧范围"""
+    if "frame_start" in render_config or "frame_end" in render_config:
+        start = int(render_config.get("frame_start", 1))
+        end = int(render_config.get("frame_end", start))
+    elif "duration" in render_config and "fps" in render_config:
+        start = 1
+        end = max(1, round(float(render_config["duration"]) * float(render_config["fps"])))
+    else:
+        start = end = 1
+    if end < start:
+        raise ValueError(f"frame_end ({end}) must not be less than frame_start ({start})")
+    return list(range(start, end + 1))
+
+
+def _mirrored_progress(task_id: str, state: Dict[str, str]) -> Dict[str, Any]:
+    """其他API实例上的任务：按Redis中的状态镜像（services.job_state）组装进度，字段同本地任务"""
+
+    def number(name: str, cast=float):
+        value = state.get(name)
+        return cast(float(value)) if value else None
+
     return {
-        "presets": [
-            {
-                "name": "快速预览",
-                "quality": "low",
-                "resolution": "1280x720",
-                "samples": 64,
-                "engine": "Eevee"
-            },
-            {
-                "name": "标准质量",
-                "quality": "medium",
-                "resolution": "1920x1080",
-                "samples": 128,
-                "engine": "Cycles"
-            },
-            {
-                "name": "高质量",
-                "quality": "high",
-                "resolution": "2560x1440",
-                "samples": 256,
-                "engine": "Cycles"
-            },
-            {
-                "name": "电影质量",
-                "quality": "ultra",
-                "resolution": "3840x2160",
-                "samples": 512,
-                "engine": "OptiX"
-            }
-        ]
+        "task_id": task_id,
+        "progress": number("progress") or 0.0,
+        "status": state.get("status"),
+        "current_frame": number("completed_frames", int) or 0,
+        "total_frames": number("total_frames", int) or 0,
+        "elapsed_time": f"{number('elapsed_seconds') or 0.0:.1f} seconds",
+        "queue_position": None,
+        "cached_frames": number("cached_frames", int) or 0,
+        "average_samples": number("average_samples"),
+        "output_files": [],
+        "output_urls": [],
+        "error": state.get("error") or None,
     }
 
+
+def _subscribe_progress(job: RenderJob):
+    """订阅任务进度：当前状态快照 + 后续推送"""
+
+    def snapshot():
+        return ProgressEvent("status", job.progress_data(error=job.error)), not job.is_active
+
+    return progress_broker.subscribe(job.task_id, snapshot, keepalive=KEEPALIVE_INTERVAL)
+
+@router.get("/capabilities")
+async def get_render_capabilities(request: Request):
+    """获取渲染器能力"""
+    return catalog.response(request, "render/capabilities")
+
+@router.get("/presets")
+async def get_render_presets(request: Request):
+    """获取渲染预设"""
+    return catalog.response(request, "render/presets")
+
 @router.post("/start")
 async def start_render(render_config: Dict[str, Any]):
     """开始渲染"""
@@ -70,66 +221,205 @@ async def start_render(render_config: Dict[str, Any]):
     for field in required_fields:
         if field not in render_config:
             return {"error": f"Missing required field: {field}"}
-    
-    # 创建渲染任务
-    task_id = f"render_task_{hash(str(render_config)) % 100000}"
-    
+
+    try:
+        frames = _frame_range(render_config)
+    except (TypeError, ValueError) as e:
+        return {"error": f"Invalid frame range: {e}"}
+
+    # 未指定的引擎和采样设置沿用匹配到的预设，未匹配的排在所有预设之后
+    preset_index = _match_preset(render_config)
+    if preset_index is None:
+        priority = len(RENDER_PRESETS)
+    else:
+        priority = preset_index
+        preset = RENDER_PRESETS[preset_index]
+        render_config.setdefault("engine", preset["engine"])
+        render_config.setdefault("samples", preset["samples"])
+        render_config.setdefault("adaptive_sampling", preset["adaptive_sampling"])
+        render_config.setdefault("noise_threshold", preset["noise_threshold"])
+
+    required_memory = 0
+    try:
+        resolve_engine(render_config.get("engine", "Cycles"))
+        output_format(render_config)
+        plan_tiles(render_config)
+        sampling_settings(render_config)
+        if "effect" in render_config:
+            resolve_simulation(render_config["effect"])
+            required_memory = simulation_memory(render_config)
+    except (TypeError, ValueError) as e:
+        return {"error": f"Invalid render config: {e}"}
+    # 模拟状态常驻在单个工作进程里，超出本机内存预算的任务直接拒绝
+    budget = simulation_budget()
+    if required_memory > budget:
+        return {
+            "error": f"Simulation needs {required_memory / GIB:.2f} GB, "
+                     f"exceeding the {budget / GIB:.2f} GB worker budget"
+        }
+
+    # 计算内容哈希会读取场景资源文件，放到线程里
+    try:
+        cache_key = await asyncio.to_thread(render_cache.job_key, render_config)
+    except (OSError, ValueError, KeyError) as e:
+        return {"error": f"Invalid scene assets: {e}"}
+
+    # 相同配置的任务正在进行时直接复用
+    job = render_queue.find_active(cache_key, frames)
+    deduplicated = job is not None
+    if job is None:
+        job = render_queue.submit(render_config, priority=priority, frames=frames, cache_key=cache_key)
+    task_id = job.task_id
+
     return {
-        "status": "started",
+        "status": job.status.value,
+        "deduplicated": deduplicated,
+        "cached_frames": job.cached_frames,
         "task_id": task_id,
         "config": render_config,
-        "estimated_time": "5-10 minutes",
-        "progress_url": f"/api/v1/render/progress/{task_id}"
+        "priority": priority,
+        "total_frames": len(frames),
+        "queue_position": render_queue.queue_position(task_id),
+        "progress_url": f"/api/v1/render/progress/{task_id}",
+        "stream_url": f"/api/v1/render/progress/{task_id}/stream",
+        "websocket_url": f"/api/v1/render/progress/{task_id}/ws"
     }
 
 @router.get("/progress/{task_id}")
 async def get_render_progress(task_id: str):
-    """获取渲染进度"""
-    # 模拟渲染进度
-    import random
-    progress = random.randint(0, 100)
-    
+    """获取渲染进度；不在本实例队列中的任务读取Redis中的状态镜像"""
+    job = render_queue.get(task_id)
+    if job is None:
+        try:
+            state = await load_job_state(task_id)
+        except Exception as e:
+            logger.warning(f"⚠️  读取渲染任务 {task_id} 的状态镜像失败: {e}")
+            state = {}
+        if state.get("status"):
+            return _mirrored_progress(task_id, state)
+        return {"error": f"Render task {task_id} not found"}
+
+    elapsed = 0.0
+    if job.started_at is not None:
+        elapsed = (job.finished_at or time.time()) - job.started_at
+
     return {
         "task_id": task_id,
-        "progress": progress,
-        "status": "rendering" if progress < 100 else "completed",
-        "current_frame": min(progress, 100),
-        "total_frames": 100,
-        "elapsed_time": f"{progress * 2} seconds",
-        "estimated_remaining": f"{(100 - progress) * 2} seconds" if progress < 100 else "0 seconds"
+        "progress": job.progress,
+        "status": job.status.value,
+        "current_frame": len(job.completed_frames),
+        "total_frames": len(job.frames),
+        "elapsed_time": f"{elapsed:.1f} seconds",
+        "queue_position": render_queue.queue_position(task_id),
+        "cached_frames": job.cached_frames,
+        "average_samples": job.average_samples,
+        "output_files": job.output_files,
+        "output_urls": [_output_url(path) for path in job.output_files],
+        "error": job.error
     }
 
+@router.get("/progress/{task_id}/stream")
+async def stream_render_progress(task_id: str):
+    """以Server-Sent Events推送渲染进度（tile/帧完成、吞吐量、预计剩余时间）"""
+    job = render_queue.get(task_id)
+    if job is None:
+        return {"error": f"Render task {task_id} not found"}
+
+    async def event_stream():
+        async for event in _subscribe_progress(job):
+            yield b": keepalive\n\n" if event is None else event.sse
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/progress/{task_id}/ws")
+async def render_progress_websocket(websocket: WebSocket, task_id: str):
+    """以WebSocket推送渲染进度，消息内容与SSE事件相同"""
+    await websocket.accept()
+    job = render_queue.get(task_id)
+    if job is None:
+        await websocket.send_json({"error": f"Render task {task_id} not found"})
+        await websocket.close()
+        return
+
+    try:
+        async for event in _subscribe_progress(job):
+            if event is None:
+                await websocket.send_text('{"event": "keepalive"}')
+            else:
+                await websocket.send_text(event.text)
+    except WebSocketDisconnect:
+        return
+    await websocket.close()
+
+@router.get("/preview/{task_id}/{frame}")
+async def preview_render_frame(task_id: str, frame: int, request: Request):
+    """查看某一帧：已完成的帧返回输出文件，渲染中的帧返回已完成tile的PNG预览"""
+    job = render_queue.get(task_id)
+    if job is None:
+        return {"error": f"Render task {task_id} not found"}
+    if frame not in job.frames:
+        return {"error": f"Frame {frame} is not part of render task {task_id}"}
+
+    if frame in job.completed_frames:
+        path = render_cache.frame_path(job.cache_key, frame, frame_extension(job.config))
+        if path.exists():
+            return await file_response(
+                request, path, "public, max-age=31536000, immutable", render_cache.content_tag(path)
+            )
+
+    buffer_path = render_queue.framebuffer_path(job, frame)
+    try:
+        image = await asyncio.to_thread(preview_frame, job.config, buffer_path)
+    except FileNotFoundError:
+        return {"error": f"Frame {frame} has not started rendering"}
+    return Response(image, media_type="image/png", headers={"Cache-Control": "no-cache"})
+
+@router.api_route("/output/{name:path}", methods=["GET", "HEAD"])
+async def download_render_output(name: str, request: Request):
+    """
+    下载渲染输出，支持Range断点续传和ETag条件请求
+
+    渲染缓存里的帧按内容寻址，同一路径的内容不会变化，可以被客户端永久缓存；
+    其他输出每次使用前需要用ETag重新验证。
+    """
+    try:
+        path = _output_path(name)
+    except (ValueError, FileNotFoundError) as e:
+        return {"error": str(e)}
+
+    # 渲染缓存里的文件按内容寻址，ETag直接由路径得出，不读取文件
+    if render_cache.root.resolve() in path.parents:
+        return await file_response(
+            request, path, "public, max-age=31536000, immutable", render_cache.content_tag(path)
+        )
+    return await file_response(request, path, "public, no-cache")
+
 @router.post("/cancel/{task_id}")
 async def cancel_render(task_id: str):
-    """取消渲染"""
+    """取消渲染：中止正在渲染的tile并释放进程槽位，返回回收的CPU时间估计"""
+    job = render_queue.get(task_id)
+    if job is None:
+        return {"error": f"Render task {task_id} not found"}
+    if not job.is_active:
+        return {"error": f"Render task {task_id} is already {job.status.value}"}
+
+    report = await render_queue.cancel(job)
     return {
-        "status": "cancelled",
+        "status": job.status.value,
         "task_id": task_id,
-        "message": "Render task cancelled successfully"
+        "message": "Render task cancelled successfully",
+        "completed_frames": len(job.completed_frames),
+        **report,
     }
 
 @router.get("/history")
-async def get_render_history():
-    """获取渲染历史"""
-    return {
-        "renders": [
-            {
-                "task_id": "render_task_12345",
-                "timestamp": "2024-01-15T10:30:00Z",
-                "resolution": "1920x1080",
-                "quality": "high",
-                "status": "completed",
-                "duration": "8 minutes",
-                "output_file": "render_output_12345.mp4"
-            },
-            {
-                "task_id": "render_task_12344",
-                "timestamp": "2024-01-15T09:15:00Z",
-                "resolution": "2560x1440",
-                "quality": "ultra",
-                "status": "completed",
-                "duration": "15 minutes",
-                "output_file": "render_output_12344.mp4"
-            }
-        ]
-    } 
\ No newline at end of file
+async def get_render_history(status: Optional[str] = None, limit: int = 20, cursor: Optional[str] = None):
+    """获取渲染历史，按结束时间倒序；用返回的 next_cursor 获取下一页"""
+    try:
+        return await list_history(status=status, limit=limit, cursor=cursor)
+    except ValueError as e:
+        return {"error": str(e)}
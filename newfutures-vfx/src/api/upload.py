@@ -0,0 +1,68 @@
+"""
+分块上传API
+
+POST 创建会话，PATCH 按 Upload-Offset 头指定的偏移追加请求体，
+GET 查询已提交偏移（断线后据此续传），DELETE 取消。
+"""
+
+from typing import Any, Dict
+
+from fastapi import APIRouter, Request
+from starlette.requests import ClientDisconnect
+
+from services.uploads import UploadError, upload_manager
+
+router = APIRouter()
+
+@router.post("")
+async def create_upload(upload: Dict[str, Any]):
+    """创建上传会话：filename、size（字节），可选sha256"""
+    for field in ("filename", "size"):
+        if field not in upload:
+            return {"error": f"Missing required field: {field}"}
+    try:
+        session = await upload_manager.create(
+            upload["filename"], upload["size"], upload.get("sha256")
+        )
+    except (TypeError, ValueError, UploadError) as e:
+        return {"error": str(e)}
+    return session.status()
+
+@router.patch("/{upload_id}")
+async def append_upload(upload_id: str, request: Request):
+    """从Upload-Offset处追加数据；请求体边接收边写盘"""
+    session = await upload_manager.get(upload_id)
+    if session is None:
+        return {"error": f"Upload {upload_id} not found"}
+    try:
+        offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        return {"error": "Missing or invalid Upload-Offset header", "offset": session.offset}
+
+    try:
+        await upload_manager.append(session, offset, request.stream())
+    except UploadError as e:
+        return {"error": str(e), "offset": e.offset}
+    except ClientDisconnect:
+        # 客户端已断开，已收到的数据已经提交，下次先查询偏移再续传
+        return session.status()
+    return session.status()
+
+@router.get("/{upload_id}")
+async def get_upload(upload_id: str):
+    """查询上传进度"""
+    session = await upload_manager.get(upload_id)
+    if session is None:
+        return {"error": f"Upload {upload_id} not found"}
+    return session.status()
+
+@router.delete("/{upload_id}")
+async def cancel_upload(upload_id: str):
+    """取消上传并删除已接收的数据"""
+    session = await upload_manager.get(upload_id)
+    if session is None:
+        return {"error": f"Upload {upload_id} not found"}
+    if session.complete:
+        return {"error": f"Upload {upload_id} is already complete"}
+    await upload_manager.abort(session)
+    return {"status": "cancelled", "upload_id": upload_id}
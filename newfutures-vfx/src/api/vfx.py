@@ -2,105 +2,147 @@
 VFX特效相关API
 """
 
-from fastapi import APIRouter
-from typing import Dict, Any
+from fastapi import APIRouter, Request
+from typing import Dict, Any, List
+
+from services.catalog import catalog
 
 router = APIRouter()
 
+# 可用特效列表
+EFFECTS: List[Dict[str, Any]] = [
+    {
+        "id": "particles",
+        "name": "粒子系统",
+        "description": "高性能粒子引擎",
+        "type": "particle_system",
+        "enabled": True
+    },
+    {
+        "id": "fluid",
+        "name": "流体模拟",
+        "description": "基于物理的流体动力学模拟",
+        "type": "physics_simulation",
+        "enabled": True
+    },
+    {
+        "id": "raytracing",
+        "name": "实时光线追踪",
+        "description": "GPU加速的实时光线追踪渲染",
+        "type": "rendering",
+        "enabled": True
+    },
+    {
+        "id": "volumetric",
+        "name": "体积渲染",
+        "description": "云、雾、烟雾等体积效果",
+        "type": "volumetric",
+        "enabled": True
+    },
+    {
+        "id": "physics",
+        "name": "物理模拟",
+        "description": "刚体、软体、布料等物理效果",
+        "type": "physics_simulation",
+        "enabled": True
+    },
+    {
+        "id": "ai",
+        "name": "AI智能特效",
+        "description": "基于深度学习的智能特效生成",
+        "type": "ai_generated",
+        "enabled": True
+    }
+]
+
+# 特效详细信息与参数定义
+EFFECTS_INFO: Dict[str, Dict[str, Any]] = {
+    "particles": {
+        "id": "particles",
+        "name": "粒子系统",
+        "description": "高性能粒子引擎，支持数百万粒子的实时模拟和渲染",
+        "parameters": {
+            "count": {"type": "int", "default": 10000, "min": 1, "max": 1000000},
+            "lifetime": {"type": "float", "default": 5.0, "min": 0.1, "max": 60.0},
+            "size": {"type": "float", "default": 1.0, "min": 0.1, "max": 10.0},
+            "color": {"type": "rgb", "default": [1.0, 1.0, 1.0]},
+            "gravity": {"type": "float", "default": -9.8, "min": -50.0, "max": 50.0}
+        }
+    },
+    "fluid": {
+        "id": "fluid",
+        "name": "流体模拟",
+        "description": "基于物理的流体动力学模拟，支持水、烟雾、火焰等效果",
+        "parameters": {
+            "viscosity": {"type": "float", "default": 0.01, "min": 0.001, "max": 1.0},
+            "density": {"type": "float", "default": 1.0, "min": 0.1, "max": 10.0},
+            "resolution": {"type": "int", "default": 128, "min": 32, "max": 512},
+            "dimensions": {"type": "int", "default": 2, "min": 2, "max": 3},
+            "damping": {"type": "float", "default": 0.99, "min": 0.8, "max": 1.0}
+        }
+    },
+    "raytracing": {
+        "id": "raytracing",
+        "name": "实时光线追踪",
+        "description": "GPU加速的实时光线追踪渲染，提供照片级真实感光照",
+        "parameters": {
+            "samples": {"type": "int", "default": 16, "min": 1, "max": 256},
+            "bounces": {"type": "int", "default": 8, "min": 1, "max": 32},
+            "exposure": {"type": "float", "default": 1.0, "min": 0.1, "max": 10.0},
+            "gamma": {"type": "float", "default": 2.2, "min": 1.0, "max": 3.0}
+        }
+    },
+    "volumetric": {
+        "id": "volumetric",
+        "name": "体积渲染",
+        "description": "云、雾、烟雾的离线体积渲染，稀疏密度brick、空域跳过和光照透射率缓存",
+        "parameters": {
+            "medium": {"type": "choice", "default": "cloud", "options": ["cloud", "fog", "smoke"]},
+            "resolution": {"type": "int", "default": 128, "min": 32, "max": 512},
+            "density": {"type": "float", "default": 1.0, "min": 0.1, "max": 10.0},
+            "absorption": {"type": "float", "default": 0.1, "min": 0.0, "max": 1.0},
+            "scattering": {"type": "float", "default": 0.2, "min": 0.0, "max": 1.0},
+            "anisotropy": {"type": "float", "default": 0.3, "min": -0.9, "max": 0.9},
+            "light_intensity": {"type": "float", "default": 2.0, "min": 0.0, "max": 10.0},
+            "orbit": {"type": "float", "default": 10.0, "min": -90.0, "max": 90.0},
+            "light_orbit": {"type": "float", "default": 0.0, "min": -90.0, "max": 90.0}
+        }
+    },
+    "physics": {
+        "id": "physics",
+        "name": "物理模拟",
+        "description": "刚体物理模拟，支持数万个球体和盒子之间的碰撞、堆叠和休眠",
+        "parameters": {
+            "count": {"type": "int", "default": 1000, "min": 1, "max": 50000},
+            "gravity": {"type": "float", "default": -9.8, "min": -50.0, "max": 50.0},
+            "restitution": {"type": "float", "default": 0.3, "min": 0.0, "max": 1.0},
+            "friction": {"type": "float", "default": 0.5, "min": 0.0, "max": 2.0},
+            "size": {"type": "float", "default": 0.2, "min": 0.05, "max": 2.0},
+            "box_ratio": {"type": "float", "default": 0.5, "min": 0.0, "max": 1.0},
+            "bounds": {"type": "float", "default": 10.0, "min": 2.0, "max": 100.0}
+        }
+    }
+}
+
+# 目录文档启动时序列化一次，请求时直接返回缓存的字节
+catalog.register("effects", {"effects": EFFECTS})
+for _effect_id, _info in EFFECTS_INFO.items():
+    catalog.register(f"effects/{_effect_id}", _info)
+
+
 @router.get("/effects")
-async def get_effects():
+async def get_effects(request: Request):
     """获取可用特效列表"""
-    return {
-        "effects": [
-            {
-                "id": "particles",
-                "name": "粒子系统",
-                "description": "高性能粒子引擎",
-                "type": "particle_system",
-                "enabled": True
-            },
-            {
-                "id": "fluid",
-                "name": "流体模拟",
-                "description": "基于物理的流体动力学模拟",
-                "type": "physics_simulation",
-                "enabled": True
-            },
-            {
-                "id": "raytracing",
-                "name": "实时光线追踪",
-                "description": "GPU加速的实时光线追踪渲染",
-                "type": "rendering",
-                "enabled": True
-            },
-            {
-                "id": "volumetric",
-                "name": "体积渲染",
-                "description": "云、雾、烟雾等体积效果",
-                "type": "volumetric",
-                "enabled": True
-            },
-            {
-                "id": "physics",
-                "name": "物理模拟",
-                "description": "刚体、软体、布料等物理效果",
-                "type": "physics_simulation",
-                "enabled": True
-            },
-            {
-                "id": "ai",
-                "name": "AI智能特效",
-                "description": "基于深度学习的智能特效生成",
-                "type": "ai_generated",
-                "enabled": True
-            }
-        ]
-    }
+    return catalog.response(request, "effects")
 
 @router.get("/effects/{effect_id}")
-async def get_effect_info(effect_id: str):
+async def get_effect_info(effect_id: str, request: Request):
     """获取特定特效的详细信息"""
-    effects_info = {
-        "particles": {
-            "id": "particles",
-            "name": "粒子系统",
-            "description": "高性能粒子引擎，支持数百万粒子的实时模拟和渲染",
-            "parameters": {
-                "count": {"type": "int", "default": 10000, "min": 1, "max": 1000000},
-                "lifetime": {"type": "float", "default": 5.0, "min": 0.1, "max": 60.0},
-                "size": {"type": "float", "default": 1.0, "min": 0.1, "max": 10.0},
-                "color": {"type": "rgb", "default": [1.0, 1.0, 1.0]},
-                "gravity": {"type": "float", "default": -9.8, "min": -50.0, "max": 50.0}
-            }
-        },
-        "fluid": {
-            "id": "fluid",
-            "name": "流体模拟",
-            "description": "基于物理的流体动力学模拟，支持水、烟雾、火焰等效果",
-            "parameters": {
-                "viscosity": {"type": "float", "default": 0.01, "min": 0.001, "max": 1.0},
-                "density": {"type": "float", "default": 1.0, "min": 0.1, "max": 10.0},
-                "resolution": {"type": "int", "default": 128, "min": 32, "max": 512},
-                "damping": {"type": "float", "default": 0.99, "min": 0.8, "max": 1.0}
-            }
-        },
-        "raytracing": {
-            "id": "raytracing",
-            "name": "实时光线追踪",
-            "description": "GPU加速的实时光线追踪渲染，提供照片级真实感光照",
-            "parameters": {
-                "samples": {"type": "int", "default": 16, "min": 1, "max": 256},
-                "bounces": {"type": "int", "default": 8, "min": 1, "max": 32},
-                "exposure": {"type": "float", "default": 1.0, "min": 0.1, "max": 10.0},
-                "gamma": {"type": "float", "default": 2.2, "min": 1.0, "max": 3.0}
-            }
-        }
-    }
-    
-    if effect_id not in effects_info:
+    name = f"effects/{effect_id}"
+    if name not in catalog:
         return {"error": f"Effect {effect_id} not found"}
-    
-    return effects_info[effect_id]
+
+    return catalog.response(request, name)
 
 @router.post("/effects/{effect_id}/start")
 async def start_effect(effect_id: str, parameters: Dict[str, Any] = None):
@@ -0,0 +1,18 @@
+"""
+资源文件定位
+"""
+
+from pathlib import Path
+
+from core.config import settings
+
+
+def asset_path(name: str) -> Path:
+    """把场景里引用的资源路径解析到上传目录下，拒绝目录穿越"""
+    root = Path(settings.UPLOAD_DIR).resolve()
+    path = (root / name).resolve()
+    if root != path and root not in path.parents:
+        raise ValueError(f"Asset path escapes upload directory: {name}")
+    if not path.is_file():
+        raise FileNotFoundError(f"Asset not found: {name}")
+    return path
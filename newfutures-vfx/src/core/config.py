@@ -22,7 +22,8 @@ class Settings(BaseSettings):
     # 服务器配置
     HOST: str = Field(default="0.0.0.0", description="Server host")
     PORT: int = Field(default=8000, description="Server port")
-    WORKERS: int = Field(default=4, description="Number of workers")
+    # 渲染队列运行在API进程内，同一状态目录只能有一个uvicorn进程
+    WORKERS: int = Field(default=1, description="Number of workers (must be 1, see run_server)")
     
     # 数据库配置
     DATABASE_URL: str = Field(
@@ -35,7 +36,7 @@ class Settings(BaseSettings):
     # Redis配置
     REDIS_URL: str = Field(
         default="redis://localhost:6379/0",
-        description="Redis connection URL"
+        description="Redis connection URL (memory:// for the in-process store)"
     )
     REDIS_POOL_SIZE: int = Field(default=10, description="Redis connection pool size")
     
@@ -90,11 +91,20 @@ class Settings(BaseSettings):
         default=["mp3", "wav", "aac", "flac", "ogg"],
         description="Supported audio formats"
     )
+    UPLOAD_SESSION_TTL_HOURS: int = Field(default=24, description="Hours an unfinished upload can be resumed")
     
     # 渲染配置
     RENDER_THREADS: int = Field(default=8, description="Number of render threads")
     RENDER_TIMEOUT: int = Field(default=3600, description="Render timeout in seconds")
     RENDER_OUTPUT_DIR: str = Field(default="render_output", description="Render output directory")
+    STATIC_DIR: str = Field(default="public", description="Web client source directory, built into ASSET_CACHE_DIR/static")
+    ASSET_CACHE_DIR: str = Field(default="cache", description="Derived asset cache directory (BVH etc.)")
+    RENDER_CACHE_MAX_GB: float = Field(default=50.0, description="Size limit of cached render frames in GB")
+    SIMULATION_MEMORY_GB: float = Field(default=4.0, description="Memory budget per render worker for simulation state in GB")
+    FRAMEBUFFER_DTYPE: str = Field(default="float16", description="Pixel type of in-progress frame buffers (float16 or float32)")
+    RENDER_FARM_URL: str = Field(default="", description="Render farm broker (redis://... or local://host:port); empty renders on this node only")
+    FARM_UNIT_SIZE: int = Field(default=8, description="Frames per farm work unit (tiles for single-frame jobs)")
+    FARM_LEASE_SECONDS: float = Field(default=30.0, description="Farm work unit lease; units of nodes that stop heartbeating are requeued")
     
     # 路径配置
     BASE_DIR: Path = Path(__file__).resolve().parent.parent.parent
@@ -111,18 +121,22 @@ class Settings(BaseSettings):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         
-        # 设置路径
+        # 设置路径（只计算，不访问磁盘；目录在应用启动时由 ensure_directories 创建）
         if self.UPLOAD_DIR is None:
             self.UPLOAD_DIR = self.BASE_DIR / "uploads"
         if self.TEMP_DIR is None:
             self.TEMP_DIR = self.BASE_DIR / "temp"
-        
-        # 创建必要的目录
-        self.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-        self.TEMP_DIR.mkdir(parents=True, exist_ok=True)
-        (self.BASE_DIR / "logs").mkdir(parents=True, exist_ok=True)
-        (self.BASE_DIR / self.MODEL_CACHE_DIR).mkdir(parents=True, exist_ok=True)
-        (self.BASE_DIR / self.RENDER_OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+    
+    def ensure_directories(self):
+        """创建必要的目录"""
+        for path in (
+            self.UPLOAD_DIR,
+            self.TEMP_DIR,
+            self.BASE_DIR / "logs",
+            self.BASE_DIR / self.MODEL_CACHE_DIR,
+            self.BASE_DIR / self.RENDER_OUTPUT_DIR,
+        ):
+            path.mkdir(parents=True, exist_ok=True)
     
     @field_validator("CORS_ORIGINS", mode="before")
     @classmethod
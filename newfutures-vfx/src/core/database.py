@@ -1,15 +1,131 @@
 """
-数据库配置模拟实现
+数据库
+
+SQLAlchemy异步引擎：PostgreSQL走asyncpg，连接池大小由 DATABASE_POOL_SIZE /
+DATABASE_MAX_OVERFLOW 控制；本地运行可以把 DATABASE_URL 设为 sqlite:///路径
+（aiosqlite，WAL模式）。配置的数据库连不上时回退到渲染输出目录下的SQLite文件。
+
+表结构用SQLAlchemy Core定义，init_db / run_migrations 创建缺少的表和索引。
 """
 
+from typing import Optional
+
 from loguru import logger
+from sqlalchemy import (
+    BigInteger, Column, DateTime, Float, Index, Integer, MetaData, String, Table, Text, event
+)
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from core.config import settings
+
+metadata = MetaData()
+
+# 渲染历史，一个结束的渲染任务一行
+render_history = Table(
+    "render_history",
+    metadata,
+    # SQLite只有INTEGER PRIMARY KEY才会自增
+    Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True),
+    Column("task_id", String(64), nullable=False, unique=True),
+    # 任务结束时间（UTC）
+    Column("timestamp", DateTime(timezone=True), nullable=False),
+    Column("status", String(16), nullable=False),
+    Column("resolution", String(16)),
+    Column("quality", String(16)),
+    Column("engine", String(32)),
+    Column("effect", String(32)),
+    Column("frames", Integer, nullable=False, default=0),
+    Column("duration_seconds", Float, nullable=False, default=0.0),
+    Column("output_file", Text),
+    Column("error", Text),
+    # 列表按 (timestamp, id) 倒序做keyset分页，按状态过滤时走复合索引
+    Index("ix_render_history_status_timestamp", "status", "timestamp", "id"),
+    Index("ix_render_history_timestamp", "timestamp", "id"),
+)
+
+_engine: Optional[AsyncEngine] = None
+
+
+def _async_url(url: str) -> str:
+    """把同步驱动的URL换成对应的异步驱动"""
+    parsed = make_url(url)
+    driver = {"postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg",
+              "sqlite": "sqlite+aiosqlite"}.get(parsed.drivername)
+    return str(parsed.set(drivername=driver)) if driver else url
+
+
+def _sqlite_pragmas(dbapi_connection, _):
+    cursor = dbapi_connection.cursor()
+    # WAL允许写入时并发读取；NORMAL同步在WAL下只在检查点时fsync
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def create_engine(url: str) -> AsyncEngine:
+    """按URL创建异步引擎和连接池"""
+    url = _async_url(url)
+    if make_url(url).get_backend_name() == "sqlite":
+        engine = create_async_engine(url)
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas)
+        return engine
+    return create_async_engine(
+        url,
+        pool_size=settings.DATABASE_POOL_SIZE,
+        max_overflow=settings.DATABASE_MAX_OVERFLOW,
+        pool_pre_ping=True,
+    )
+
+
+def get_engine() -> AsyncEngine:
+    """当前的数据库引擎，init_db 之前调用会抛出RuntimeError"""
+    if _engine is None:
+        raise RuntimeError("Database is not initialized")
+    return _engine
+
+
+def _fallback_url() -> str:
+    path = settings.BASE_DIR / settings.RENDER_OUTPUT_DIR / "render_history.db"
+    return f"sqlite:///{path}"
+
 
 async def init_db():
-    """初始化数据库（模拟）"""
-    logger.info("🗄️  模拟数据库初始化完成")
+    """连接数据库并创建缺少的表；配置的数据库不可用时回退到本地SQLite"""
+    global _engine
+    engine = None
+    try:
+        engine = create_engine(settings.DATABASE_URL)
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+    except Exception as e:
+        if engine is not None:
+            await engine.dispose()
+        url = _fallback_url()
+        logger.warning(f"⚠️  无法连接数据库: {e}，使用本地SQLite {url}")
+        engine = create_engine(url)
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+    _engine = engine
+    logger.info(f"🗄️  数据库已连接: {engine.url.render_as_string(hide_password=True)}")
     return True
 
+
+async def close_db():
+    """关闭连接池"""
+    global _engine
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+
+
 async def run_migrations():
-    """运行数据库迁移（模拟）"""
-    logger.info("📋 模拟数据库迁移完成")
-    return True 
\ No newline at end of file
+    """创建缺少的表和索引"""
+    engine = create_engine(settings.DATABASE_URL)
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+    finally:
+        await engine.dispose()
+    logger.info("📋 数据库迁移完成")
+    return True
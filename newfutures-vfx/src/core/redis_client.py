@@ -1,10 +1,244 @@
 """
-Redis客户端模拟实现
+Redis客户端
+
+RedisStore 使用有上限的连接池（REDIS_POOL_SIZE），连接在请求之间复用；批量写入
+走一个pipeline，状态迁移用Lua脚本原子地"比较并设置"。MemoryStore 是接口相同的
+进程内实现，用于测试和单节点部署：REDIS_URL 设为 memory:// 时直接使用，配置的
+Redis连不上时也回退到它。
 """
 
+import time
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
 from loguru import logger
 
+from core.config import settings
+
+# 等待空闲连接的超时（秒），连接池满时调用方排队而不是新建连接
+POOL_TIMEOUT = 5.0
+
+# 比较并设置：KEYS[1]为哈希键；ARGV = 字段, 新值, 允许的旧值个数n, n个旧值, ttl, 其余字段/值对
+# 字段不存在时旧值视为空串
+TRANSITION_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1]) or ''
+local n = tonumber(ARGV[3])
+local allowed = false
+for i = 4, 3 + n do
+    if ARGV[i] == current then
+        allowed = true
+        break
+    end
+end
+if not allowed then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+for i = 5 + n, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+local ttl = tonumber(ARGV[4 + n])
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+
+
+def _encode(value: Any) -> str:
+    """与redis-py相同的取值规则：全部以字符串存储，None存为空串"""
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+class RedisStore:
+    """基于redis.asyncio的存储，所有命令共享一个有上限的连接池"""
+
+    backend = "redis"
+
+    def __init__(self, url: str, pool_size: int):
+        from redis.asyncio import BlockingConnectionPool, Redis
+
+        self.pool = BlockingConnectionPool.from_url(
+            url, max_connections=pool_size, timeout=POOL_TIMEOUT, decode_responses=True
+        )
+        self.client = Redis(connection_pool=self.pool)
+        self._transition = self.client.register_script(TRANSITION_SCRIPT)
+
+    async def ping(self) -> bool:
+        return await self.client.ping()
+
+    async def close(self):
+        await self.client.close()
+        await self.pool.disconnect()
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        await self.client.set(key, _encode(value), ex=ttl)
+
+    async def delete(self, *keys: str) -> int:
+        return await self.client.delete(*keys) if keys else 0
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        return await self.client.incrby(key, amount)
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        return await self.client.hgetall(key)
+
+    async def hset_many(self, items: Mapping[str, Mapping[str, Any]], ttl: Optional[int] = None):
+        """一次往返写入多个哈希（非事务pipeline）"""
+        if not items:
+            return
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, mapping in items.items():
+                pipe.hset(key, mapping={field: _encode(value) for field, value in mapping.items()})
+                if ttl:
+                    pipe.expire(key, ttl)
+            await pipe.execute()
+
+    async def transition(
+        self, key: str, field: str, allowed: Iterable[str], value: Any,
+        mapping: Optional[Mapping[str, Any]] = None, ttl: Optional[int] = None,
+    ) -> bool:
+        """字段当前值在allowed中时原子地改为value并写入mapping，返回是否成功"""
+        allowed = [_encode(item) for item in allowed]
+        args = [field, _encode(value), len(allowed), *allowed, ttl or 0]
+        for name, item in (mapping or {}).items():
+            args.extend((name, _encode(item)))
+        return bool(await self._transition(keys=[key], args=args))
+
+
+class MemoryStore:
+    """
+    进程内存储，接口与 RedisStore 相同
+
+    所有操作在事件循环中同步完成，中间没有await，因此天然是原子的。
+    过期的键在访问时清理。
+    """
+
+    backend = "memory"
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+
+    def _live(self, key: str) -> bool:
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            del self._expires[key]
+        return key in self._data
+
+    def _expire(self, key: str, ttl: Optional[int]):
+        if ttl:
+            self._expires[key] = time.monotonic() + ttl
+        else:
+            self._expires.pop(key, None)
+
+    async def ping(self) -> bool:
+        return True
+
+    async def close(self):
+        pass
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._data[key] if self._live(key) else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        self._data[key] = _encode(value)
+        self._expire(key, ttl)
+
+    async def delete(self, *keys: str) -> int:
+        removed = 0
+        for key in keys:
+            if self._live(key):
+                del self._data[key]
+                self._expires.pop(key, None)
+                removed += 1
+        return removed
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        value = int(self._data[key]) + amount if self._live(key) else amount
+        self._data[key] = str(value)
+        return value
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        return dict(self._data[key]) if self._live(key) else {}
+
+    def _hash(self, key: str) -> Dict[str, str]:
+        if not self._live(key):
+            self._data[key] = {}
+        return self._data[key]
+
+    async def hset_many(self, items: Mapping[str, Mapping[str, Any]], ttl: Optional[int] = None):
+        for key, mapping in items.items():
+            self._hash(key).update((field, _encode(value)) for field, value in mapping.items())
+            if ttl:
+                self._expire(key, ttl)
+
+    async def transition(
+        self, key: str, field: str, allowed: Iterable[str], value: Any,
+        mapping: Optional[Mapping[str, Any]] = None, ttl: Optional[int] = None,
+    ) -> bool:
+        current = self._data[key].get(field, "") if self._live(key) else ""
+        if current not in {_encode(item) for item in allowed}:
+            return False
+        data = self._hash(key)
+        data[field] = _encode(value)
+        data.update((name, _encode(item)) for name, item in (mapping or {}).items())
+        if ttl:
+            self._expire(key, ttl)
+        return True
+
+
+# 启动前为进程内实现，init_redis 连接成功后替换为 RedisStore
+_store: Any = MemoryStore()
+
+
+def get_redis():
+    """当前使用的存储（RedisStore 或 MemoryStore）"""
+    return _store
+
+
+def _redacted(url: str) -> Tuple[str, str]:
+    scheme, _, rest = url.partition("://")
+    return scheme, rest.rpartition("@")[2]
+
+
 async def init_redis():
-    """初始化Redis连接（模拟）"""
-    logger.info("🔴 模拟Redis连接初始化完成")
-    return True 
\ No newline at end of file
+    """连接Redis；配置为 memory:// 或连接失败时使用进程内实现"""
+    global _store
+    scheme, location = _redacted(settings.REDIS_URL)
+    if scheme == "memory":
+        _store = MemoryStore()
+        logger.info("🔴 使用进程内存储代替Redis")
+        return True
+
+    try:
+        store = RedisStore(settings.REDIS_URL, settings.REDIS_POOL_SIZE)
+    except ImportError:
+        logger.warning("⚠️  未安装redis包，使用进程内存储代替Redis")
+        _store = MemoryStore()
+        return False
+    try:
+        await store.ping()
+    except Exception as e:
+        await store.close()
+        logger.warning(f"⚠️  无法连接Redis {location}: {e}，使用进程内存储代替")
+        _store = MemoryStore()
+        return False
+
+    _store = store
+    logger.info(f"🔴 Redis已连接: {location}，连接池上限 {settings.REDIS_POOL_SIZE}")
+    return True
+
+
+async def close_redis():
+    """关闭连接池"""
+    await _store.close()
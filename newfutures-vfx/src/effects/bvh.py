@@ -0,0 +1,347 @@
+"""
+BVH加速结构
+
+按分箱SAH逐层构建三角形包围体层次，节点和三角形都展平成连续数组；
+遍历对整批光线做广度优先的向量化求交，单条光线的代价从O(三角形数)降到O(log)。
+构建结果按资源内容哈希序列化到磁盘，之后的任务直接以内存映射方式加载。
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from core.config import settings
+from utils.hashing import file_digest
+
+# 磁盘格式版本，构建算法或数组布局变化时递增
+BVH_FORMAT_VERSION = 1
+
+MAX_LEAF_SIZE = 4
+SAH_BINS = 16
+
+EPSILON = 1e-4
+
+_ARRAYS = (
+    "node_min", "node_max", "node_first", "node_count",
+    "tri_v0", "tri_e1", "tri_e2", "tri_normal", "tri_face",
+)
+
+
+def _surface_area(lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    d = np.maximum(hi - lo, 0.0)
+    return 2.0 * (d[..., 0] * d[..., 1] + d[..., 1] * d[..., 2] + d[..., 2] * d[..., 0])
+
+
+def _segment_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """把若干 [start, start+count) 区间展开成一个位置数组"""
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(starts - offsets, counts) + np.arange(int(counts.sum()))
+
+
+def _best_splits(
+    seg: np.ndarray, offsets: np.ndarray, centroid: np.ndarray, tri_min: np.ndarray,
+    tri_max: np.ndarray, segments: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    同一层所有待划分节点一起做分箱SAH
+
+    返回每个节点最佳的划分轴、划分所在的箱序号，以及质心包围盒（用于重新计算箱序号）。
+    划分无效（质心完全重合）的节点轴为-1。
+    """
+    count = np.diff(np.append(offsets, seg.size))
+    cmin = np.minimum.reduceat(centroid, offsets)
+    extent = np.maximum.reduceat(centroid, offsets) - cmin
+
+    best_cost = np.full(segments, np.inf)
+    best_axis = np.full(segments, -1, dtype=np.int64)
+    best_bin = np.zeros(segments, dtype=np.int64)
+    for axis in range(3):
+        scale = np.zeros(segments, dtype=np.float32)
+        valid_axis = extent[:, axis] > 1e-12
+        scale[valid_axis] = SAH_BINS / extent[valid_axis, axis]
+        bins = ((centroid[:, axis] - cmin[seg, axis]) * scale[seg]).astype(np.int64)
+        np.clip(bins, 0, SAH_BINS - 1, out=bins)
+        key = seg * SAH_BINS + bins
+
+        counts = np.bincount(key, minlength=segments * SAH_BINS).reshape(segments, SAH_BINS)
+        bin_min = np.full((segments * SAH_BINS, 3), np.inf, dtype=np.float32)
+        bin_max = np.full((segments * SAH_BINS, 3), -np.inf, dtype=np.float32)
+        np.minimum.at(bin_min, key, tri_min)
+        np.maximum.at(bin_max, key, tri_max)
+        bin_min = bin_min.reshape(segments, SAH_BINS, 3)
+        bin_max = bin_max.reshape(segments, SAH_BINS, 3)
+
+        left_area = _surface_area(
+            np.minimum.accumulate(bin_min[:, :-1], axis=1),
+            np.maximum.accumulate(bin_max[:, :-1], axis=1),
+        )
+        right_area = _surface_area(
+            np.minimum.accumulate(bin_min[:, :0:-1], axis=1)[:, ::-1],
+            np.maximum.accumulate(bin_max[:, :0:-1], axis=1)[:, ::-1],
+        )
+        left_count = np.cumsum(counts, axis=1)[:, :-1]
+        right_count = count[:, None] - left_count
+
+        cost = left_area * left_count + right_area * right_count
+        cost[(left_count == 0) | (right_count == 0) | ~valid_axis[:, None]] = np.inf
+        split = np.argmin(cost, axis=1)
+        axis_cost = cost[np.arange(segments), split]
+        better = axis_cost < best_cost
+        best_cost[better] = axis_cost[better]
+        best_axis[better] = axis
+        best_bin[better] = split[better]
+
+    return best_axis, best_bin, np.stack((cmin, extent), axis=1)
+
+
+class BVH:
+    """展平的BVH：节点数组 + 按叶子顺序重排的三角形数组"""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @property
+    def node_count_total(self) -> int:
+        return self.node_min.shape[0]
+
+    @property
+    def triangle_count(self) -> int:
+        return self.tri_v0.shape[0]
+
+    @classmethod
+    def build(cls, vertices: np.ndarray, faces: np.ndarray) -> "BVH":
+        """从顶点和三角面构建"""
+        tris = np.asarray(vertices, dtype=np.float32)[np.asarray(faces, dtype=np.int64)]
+        n = tris.shape[0]
+        if n == 0:
+            raise ValueError("Cannot build a BVH without triangles")
+        tri_min = tris.min(axis=1)
+        tri_max = tris.max(axis=1)
+        centroid = tris.mean(axis=1)
+
+        order = np.arange(n, dtype=np.int64)
+        capacity = 2 * n
+        node_min = np.empty((capacity, 3), dtype=np.float32)
+        node_max = np.empty((capacity, 3), dtype=np.float32)
+        node_first = np.zeros(capacity, dtype=np.int32)
+        node_count = np.zeros(capacity, dtype=np.int32)
+
+        # 逐层构建：同一深度的所有节点在一次向量化计算里完成包围盒、分箱和划分
+        next_node = 1
+        seg_node = np.zeros(1, dtype=np.int64)
+        seg_start = np.zeros(1, dtype=np.int64)
+        seg_count = np.array([n], dtype=np.int64)
+        while seg_node.size:
+            segments = seg_node.size
+            offsets = np.cumsum(seg_count) - seg_count
+            positions = _segment_ranges(seg_start, seg_count)
+            idx = order[positions]
+            node_min[seg_node] = np.minimum.reduceat(tri_min[idx], offsets)
+            node_max[seg_node] = np.maximum.reduceat(tri_max[idx], offsets)
+
+            leaf = seg_count <= MAX_LEAF_SIZE
+            node_first[seg_node[leaf]] = seg_start[leaf]
+            node_count[seg_node[leaf]] = seg_count[leaf]
+            if leaf.all():
+                break
+
+            # 只保留需要继续划分的节点
+            keep = ~leaf
+            keep_tris = np.repeat(keep, seg_count)
+            seg_node, seg_start, seg_count = seg_node[keep], seg_start[keep], seg_count[keep]
+            positions, idx = positions[keep_tris], idx[keep_tris]
+            segments = seg_node.size
+            offsets = np.cumsum(seg_count) - seg_count
+            seg = np.repeat(np.arange(segments), seg_count)
+
+            axis, split_bin, centroid_box = _best_splits(
+                seg, offsets, centroid[idx], tri_min[idx], tri_max[idx], segments
+            )
+            tri_axis = np.maximum(axis[seg], 0)
+            cmin = centroid_box[seg, 0, tri_axis]
+            extent = centroid_box[seg, 1, tri_axis]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                bins = ((centroid[idx, tri_axis] - cmin) * (SAH_BINS / extent)).astype(np.int64)
+            np.clip(bins, 0, SAH_BINS - 1, out=bins)
+            right = bins > split_bin[seg]
+            # 质心完全重合（或浮点误差导致一侧为空）的节点按顺序对半分
+            left_count = np.bincount(seg[~right], minlength=segments)
+            unsplit = (axis < 0) | (left_count == 0) | (left_count == seg_count)
+            degenerate = unsplit[seg]
+            local = np.arange(seg.size) - offsets[seg]
+            right[degenerate] = local[degenerate] >= (seg_count[seg[degenerate]] // 2)
+            left_count[unsplit] = seg_count[unsplit] // 2
+
+            # 段内稳定划分：左子树在前，段的位置范围不变
+            permutation = np.lexsort((right, seg))
+            order[positions] = idx[permutation]
+
+            children = next_node + 2 * np.arange(segments)
+            next_node += 2 * segments
+            node_first[seg_node] = children
+            node_count[seg_node] = 0
+
+            seg_node = np.concatenate((children, children + 1))
+            seg_start = np.concatenate((seg_start, seg_start + left_count))
+            seg_count = np.concatenate((left_count, seg_count - left_count))
+
+        ordered = tris[order]
+        v0 = ordered[:, 0]
+        e1 = ordered[:, 1] - v0
+        e2 = ordered[:, 2] - v0
+        normal = np.cross(e1, e2)
+        normal /= np.maximum(np.linalg.norm(normal, axis=1, keepdims=True), 1e-20)
+
+        return cls({
+            "node_min": node_min[:next_node],
+            "node_max": node_max[:next_node],
+            "node_first": node_first[:next_node],
+            "node_count": node_count[:next_node],
+            "tri_v0": np.ascontiguousarray(v0),
+            "tri_e1": np.ascontiguousarray(e1),
+            "tri_e2": np.ascontiguousarray(e2),
+            "tri_normal": normal.astype(np.float32),
+            "tri_face": order.astype(np.int32),
+        })
+
+    def save(self, directory: Path):
+        """原子地写入磁盘，每个数组一个 .npy 文件以便内存映射"""
+        directory = Path(directory)
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=directory.parent, prefix=".bvh-"))
+        try:
+            for name in _ARRAYS:
+                np.save(tmp_dir / f"{name}.npy", getattr(self, name))
+            with open(tmp_dir / "meta.json", "w", encoding="utf-8") as fh:
+                json.dump({
+                    "version": BVH_FORMAT_VERSION,
+                    "nodes": self.node_count_total,
+                    "triangles": self.triangle_count,
+                }, fh)
+            os.replace(tmp_dir, directory)
+        except OSError:
+            # 另一个进程已经写好了同一份BVH
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not (directory / "meta.json").exists():
+                raise
+
+    @classmethod
+    def load(cls, directory: Path) -> "BVH":
+        """以只读内存映射方式加载"""
+        directory = Path(directory)
+        return cls({
+            name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in _ARRAYS
+        })
+
+    def intersect(
+        self, origins: np.ndarray, directions: np.ndarray, t_max: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        批量求交
+
+        维护 (光线, 节点) 工作列表逐层展开，已找到更近交点的光线会被包围盒测试剪掉。
+        返回每条光线的最近距离（未命中为inf）和三角形序号（未命中为-1）。
+        """
+        n = origins.shape[0]
+        best_t = np.full(n, np.inf, dtype=np.float32)
+        if t_max is not None:
+            best_t[:] = t_max
+        best_tri = np.full(n, -1, dtype=np.int64)
+
+        with np.errstate(divide="ignore"):
+            inv_dir = (1.0 / directions).astype(np.float32)
+
+        rays = np.arange(n)
+        nodes = np.zeros(n, dtype=np.int64)
+        while rays.size:
+            o = origins[rays]
+            inv = inv_dir[rays]
+            with np.errstate(invalid="ignore"):
+                t0 = (self.node_min[nodes] - o) * inv
+                t1 = (self.node_max[nodes] - o) * inv
+            t_near = np.nan_to_num(np.minimum(t0, t1), nan=-np.inf).max(axis=1)
+            t_far = np.nan_to_num(np.maximum(t0, t1), nan=np.inf).min(axis=1)
+            hit = (t_near <= t_far) & (t_far >= 0.0) & (t_near < best_t[rays])
+            rays, nodes = rays[hit], nodes[hit]
+            if not rays.size:
+                break
+
+            counts = self.node_count[nodes]
+            leaf = counts > 0
+            if leaf.any():
+                self._intersect_leaves(
+                    origins, directions, rays[leaf], nodes[leaf], counts[leaf], best_t, best_tri
+                )
+
+            inner_rays = rays[~leaf]
+            left = self.node_first[nodes[~leaf]].astype(np.int64)
+            rays = np.concatenate((inner_rays, inner_rays))
+            nodes = np.concatenate((left, left + 1))
+
+        best_t[best_tri < 0] = np.inf
+        return best_t, best_tri
+
+    def _intersect_leaves(self, origins, directions, rays, nodes, counts, best_t, best_tri):
+        """把叶子展开成 (光线, 三角形) 对，Möller–Trumbore批量求交"""
+        total = int(counts.sum())
+        offsets = np.cumsum(counts) - counts
+        pair_rays = np.repeat(rays, counts)
+        tris = np.repeat(self.node_first[nodes].astype(np.int64), counts) + (
+            np.arange(total) - np.repeat(offsets, counts)
+        )
+
+        d = directions[pair_rays]
+        e1 = self.tri_e1[tris]
+        e2 = self.tri_e2[tris]
+        pvec = np.cross(d, e2)
+        det = np.einsum("nk,nk->n", e1, pvec)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_det = 1.0 / det
+            tvec = origins[pair_rays] - self.tri_v0[tris]
+            u = np.einsum("nk,nk->n", tvec, pvec) * inv_det
+            qvec = np.cross(tvec, e1)
+            v = np.einsum("nk,nk->n", d, qvec) * inv_det
+            t = np.einsum("nk,nk->n", e2, qvec) * inv_det
+
+        valid = (
+            (np.abs(det) > 1e-12) & (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0) & (t > EPSILON)
+        )
+        valid &= t < best_t[pair_rays]
+        if not valid.any():
+            return
+        pair_rays, tris, t = pair_rays[valid], tris[valid], t[valid].astype(np.float32)
+        np.minimum.at(best_t, pair_rays, t)
+        winner = t == best_t[pair_rays]
+        best_tri[pair_rays[winner]] = tris[winner]
+
+
+def load_mesh(path: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """用trimesh读取网格（obj/stl/ply/glTF/glb），多节点场景按变换合并成一个网格"""
+    import trimesh
+
+    mesh = trimesh.load(str(path), force="mesh", process=False)
+    return (
+        np.asarray(mesh.vertices, dtype=np.float32),
+        np.asarray(mesh.faces, dtype=np.int64),
+    )
+
+
+def load_mesh_bvh(path: Path) -> BVH:
+    """读取网格资源的BVH：已缓存则直接内存映射，否则构建后写入缓存"""
+    path = Path(path)
+    cache_dir = (
+        settings.BASE_DIR / settings.ASSET_CACHE_DIR / "bvh"
+        / f"{file_digest(path)}-v{BVH_FORMAT_VERSION}"
+    )
+    if not (cache_dir / "meta.json").exists():
+        vertices, faces = load_mesh(path)
+        logger.info(f"🌲 构建BVH: {path.name} ({len(faces)} 个三角形)")
+        BVH.build(vertices, faces).save(cache_dir)
+    return BVH.load(cache_dir)
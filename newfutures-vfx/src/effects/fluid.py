@@ -0,0 +1,309 @@
+"""
+稳定流体求解器
+
+Stam稳定流体方法的网格求解器，支持2D和3D：半拉格朗日平流、隐式粘性扩散、
+压力投影。压力用Jacobi迭代求解，并以上一步的压力场作为初值（warm start），
+帧间变化不大时少量迭代即可收敛。
+
+所有场都是float32；轴0始终是竖直方向（向上），3D时轴2是深度方向。
+除固定的若干个全尺寸场外，平流按切片分块计算，内存占用只取决于分辨率，
+可以用 estimate_memory 在提交任务前预估。
+"""
+
+import itertools
+from typing import Any, Dict
+
+import numpy as np
+
+# 每个分块平流的最大网格数，限制插值用的临时数组大小
+ADVECT_SLAB_CELLS = 1 << 18
+
+# 全尺寸float32场的数量：速度(d) + 染料 + 压力，以及下一步速度(d) + 下一步染料 + 散度 + 迭代缓冲
+PERSISTENT_FIELDS = 3
+SCRATCH_FIELDS = 3
+
+DIFFUSION_ITERATIONS = 10
+PRESSURE_ITERATIONS = 60
+# 每隔多少次迭代检查一次收敛
+RESIDUAL_INTERVAL = 10
+# 相邻两次迭代压力最大变化与散度尺度之比低于该值时提前结束
+PRESSURE_TOLERANCE = 1e-3
+
+# 源的注入速度（每秒穿过的域长度比例）、注入速率和浮力系数
+INFLOW_SPEED = 0.5
+INFLOW_RATE = 4.0
+BUOYANCY = 0.3
+# 渲染时染料的光学厚度系数
+OPTICAL_DEPTH = 1.5
+
+
+def estimate_memory(resolution: int, dimensions: int) -> int:
+    """按分辨率和维数预估求解器的峰值内存（字节）"""
+    if dimensions not in (2, 3):
+        raise ValueError(f"Unsupported fluid dimensions: {dimensions}")
+    cells = int(resolution) ** int(dimensions)
+    fields = PERSISTENT_FIELDS + SCRATCH_FIELDS + 2 * dimensions
+    slab = min(cells, max(ADVECT_SLAB_CELLS, int(resolution) ** (dimensions - 1)))
+    # 分块平流：每个轴的坐标/下标/小数部分，以及每个角点的权重和下标
+    corners = 2 ** dimensions
+    slab_arrays = 3 * dimensions + 2 * corners + 4
+    return 4 * (cells * fields + slab * slab_arrays)
+
+
+class FluidSolver:
+    """
+    烟雾/流体求解器
+
+    参数与 /vfx/effects/fluid 描述一致：resolution（每轴网格数）、viscosity、
+    density（源注入的染料浓度）、damping（每步速度衰减），另有 dimensions（2或3）。
+    """
+
+    def __init__(
+        self,
+        resolution: int = 128,
+        dimensions: int = 2,
+        viscosity: float = 0.01,
+        density: float = 1.0,
+        damping: float = 0.99,
+        seed: int = 0,
+    ):
+        if dimensions not in (2, 3):
+            raise ValueError(f"Unsupported fluid dimensions: {dimensions}")
+        self.n = int(resolution)
+        self.dims = int(dimensions)
+        self.viscosity = float(viscosity)
+        self.density = float(density)
+        self.damping = float(damping)
+        self.seed = int(seed)
+        self.steps = 0
+        self.last_pressure_iterations = 0
+
+        shape = (self.n,) * self.dims
+        self.velocity = np.zeros((self.dims,) + shape, dtype=np.float32)
+        self.dye = np.zeros(shape, dtype=np.float32)
+        self.pressure = np.zeros(shape, dtype=np.float32)
+        self._velocity_next = np.empty_like(self.velocity)
+        self._dye_next = np.empty_like(self.dye)
+        self._divergence = np.empty_like(self.dye)
+        self._buffer = np.empty_like(self.dye)
+
+        # 底部中央的注入区域
+        radius = max(2, self.n // 16)
+        center = self.n // 2
+        self._source = (slice(2, 2 + radius),) + (slice(center - radius, center + radius),) * (
+            self.dims - 1
+        )
+
+    @classmethod
+    def from_parameters(cls, parameters: Dict[str, Any], seed: int = 0) -> "FluidSolver":
+        """按特效参数创建"""
+        known = ("resolution", "dimensions", "viscosity", "density", "damping")
+        return cls(seed=seed, **{k: parameters[k] for k in known if k in parameters})
+
+    def step(self, dt: float):
+        """推进一个时间步"""
+        self._add_sources(dt)
+        self._diffuse(dt)
+        self._advect(dt)
+        self._project()
+        self.velocity *= np.float32(self.damping)
+        self._enforce_walls()
+        self.steps += 1
+
+    def _add_sources(self, dt: float):
+        rng = np.random.default_rng([self.seed, self.steps])
+        src = self._source
+        self.dye[src] += np.float32(self.density * INFLOW_RATE * dt)
+        self.velocity[0][src] = INFLOW_SPEED * self.n
+        # 水平方向的小扰动，让烟柱产生涡旋
+        for axis in range(1, self.dims):
+            self.velocity[axis][src] += rng.standard_normal(dtype=np.float32) * (
+                0.1 * INFLOW_SPEED * self.n
+            )
+        # 浮力：染料越浓上升越快
+        np.multiply(self.dye, np.float32(BUOYANCY * self.n * dt), out=self._buffer)
+        self.velocity[0] += self._buffer
+
+    def _interior(self):
+        return (slice(1, -1),) * self.dims
+
+    def _shifted(self, axis: int, offset: int):
+        """内部区域沿axis平移offset格后的切片"""
+        index = [slice(1, -1)] * self.dims
+        index[axis] = slice(1 + offset, self.n - 1 + offset)
+        return tuple(index)
+
+    def _neumann(self, field: np.ndarray):
+        """边界复制相邻的内部值（法向导数为零）"""
+        for axis in range(self.dims):
+            lo = [slice(None)] * self.dims
+            hi = [slice(None)] * self.dims
+            lo[axis], hi[axis] = 0, -1
+            inner_lo, inner_hi = list(lo), list(hi)
+            inner_lo[axis], inner_hi[axis] = 1, -2
+            field[tuple(lo)] = field[tuple(inner_lo)]
+            field[tuple(hi)] = field[tuple(inner_hi)]
+
+    def _jacobi(self, x: np.ndarray, b: np.ndarray, alpha: float, beta: float) -> np.ndarray:
+        """
+        一次Jacobi迭代：x' = (b + alpha * 邻居之和) / beta，结果写入缓冲区后与x交换
+
+        返回新的x（原缓冲区），调用方负责保存引用。
+        """
+        inner = self._interior()
+        out = self._buffer
+        target = out[inner]
+        target[...] = 0
+        for axis in range(self.dims):
+            target += x[self._shifted(axis, 1)]
+            target += x[self._shifted(axis, -1)]
+        target *= np.float32(alpha)
+        target += b[inner]
+        target *= np.float32(1.0 / beta)
+        self._neumann(out)
+        self._buffer = x
+        return out
+
+    def _diffuse(self, dt: float):
+        """隐式粘性扩散 (I - ν dt ∇²) u = u0"""
+        a = self.viscosity * dt * self.n * self.n
+        if a < 1e-4:
+            return
+        for axis in range(self.dims):
+            component = self.velocity[axis]
+            b = self._divergence
+            np.copyto(b, component)
+            x = component
+            for _ in range(DIFFUSION_ITERATIONS):
+                x = self._jacobi(x, b, a, 1.0 + 2.0 * self.dims * a)
+            # 迭代次数为奇数时结果在缓冲区里，拷回并把缓冲区还回去
+            if x is not component:
+                np.copyto(component, x)
+                self._buffer = x
+
+    def _advect(self, dt: float):
+        """半拉格朗日平流：速度和染料沿速度场反向追踪后线性插值，按切片分块"""
+        n, d = self.n, self.dims
+        plane = n ** (d - 1)
+        rows = max(1, ADVECT_SLAB_CELLS // plane)
+        strides = [n ** (d - 1 - axis) for axis in range(d)]
+        sources = [field.reshape(-1) for field in (*self.velocity, self.dye)]
+        targets = [*self._velocity_next, self._dye_next]
+        upper = np.float32(n - 1.001)
+
+        for start in range(0, n, rows):
+            stop = min(start + rows, n)
+            flat = None
+            fracs = []
+            for axis in range(d):
+                grid = np.arange(start, stop) if axis == 0 else np.arange(n)
+                shape = [1] * d
+                shape[axis] = -1
+                pos = self.velocity[axis][start:stop] * np.float32(-dt)
+                pos += grid.reshape(shape).astype(np.float32)
+                np.clip(pos, 0.0, upper, out=pos)
+                base = pos.astype(np.int32)
+                pos -= base
+                fracs.append(pos)
+                base *= strides[axis]
+                flat = base if flat is None else flat + base
+
+            for corner in itertools.product((0, 1), repeat=d):
+                weight = None
+                offset = 0
+                for axis, bit in enumerate(corner):
+                    w = fracs[axis] if bit else 1.0 - fracs[axis]
+                    weight = w if weight is None else weight * w
+                    offset += bit * strides[axis]
+                index = flat + offset if offset else flat
+                for source, target in zip(sources, targets):
+                    value = source[index] * weight
+                    if corner == (0,) * d:
+                        target[start:stop] = value
+                    else:
+                        target[start:stop] += value
+
+        self.velocity, self._velocity_next = self._velocity_next, self.velocity
+        self.dye, self._dye_next = self._dye_next, self.dye
+
+    def _project(self):
+        """压力投影，使速度场无散"""
+        inner = self._interior()
+        div = self._divergence
+        div[...] = 0
+        scratch = self._buffer[inner]
+        for axis in range(self.dims):
+            u = self.velocity[axis]
+            np.subtract(u[self._shifted(axis, 1)], u[self._shifted(axis, -1)], out=scratch)
+            div[inner] += scratch
+        div *= np.float32(-0.5)
+        self._neumann(div)
+
+        # 以上一步的压力为初值迭代，收敛后提前结束
+        scale = float(np.abs(div).max())
+        p = self.pressure
+        iterations = 0
+        if scale > 0:
+            for iterations in range(1, PRESSURE_ITERATIONS + 1):
+                previous = p
+                p = self._jacobi(p, div, 1.0, 2.0 * self.dims)
+                if iterations % RESIDUAL_INTERVAL == 0:
+                    change = float(np.abs(p - previous).max())
+                    if change <= PRESSURE_TOLERANCE * scale:
+                        break
+        self.last_pressure_iterations = iterations
+        if p is not self.pressure:
+            np.copyto(self.pressure, p)
+            self._buffer = p
+
+        scratch = self._buffer[inner]
+        for axis in range(self.dims):
+            u = self.velocity[axis]
+            np.subtract(p[self._shifted(axis, 1)], p[self._shifted(axis, -1)], out=scratch)
+            scratch *= np.float32(0.5)
+            u[inner] -= scratch
+
+    def _enforce_walls(self):
+        """盒子边界不可穿透"""
+        for axis in range(self.dims):
+            wall = [slice(None)] * self.dims
+            for side in (0, -1):
+                wall[axis] = side
+                self.velocity[axis][tuple(wall)] = 0.0
+
+    def render(self, width: int, height: int) -> np.ndarray:
+        """
+        渲染染料浓度，返回 (h, w, 3) 线性图像
+
+        3D时沿深度方向积分光学厚度；网格按正方形居中放置。
+        """
+        if self.dims == 3:
+            column = self.dye.sum(axis=2) * np.float32(OPTICAL_DEPTH / self.n * 8.0)
+        else:
+            column = self.dye * np.float32(OPTICAL_DEPTH)
+        opacity = 1.0 - np.exp(-np.maximum(column, 0.0))
+
+        size = min(width, height)
+        sample = ((np.arange(size) + 0.5) * self.n / size).astype(np.int64)
+        # 轴0向上，图像行从上往下
+        view = opacity[::-1][sample][:, sample]
+        pixels = np.zeros((height, width, 3), dtype=np.float32)
+        y0, x0 = (height - size) // 2, (width - size) // 2
+        pixels[y0:y0 + size, x0:x0 + size] = view[..., None]
+        return pixels
+
+    def state_dict(self) -> Dict[str, np.ndarray]:
+        """可序列化的完整状态"""
+        return {
+            "velocity": self.velocity,
+            "dye": self.dye,
+            "pressure": self.pressure,
+            "steps": np.int64(self.steps),
+        }
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        """从 state_dict 恢复"""
+        self.velocity[...] = state["velocity"]
+        self.dye[...] = state["dye"]
+        self.pressure[...] = state["pressure"]
+        self.steps = int(state["steps"])
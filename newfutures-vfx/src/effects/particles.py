@@ -0,0 +1,161 @@
+"""
+粒子系统
+
+状态按结构数组（SoA）存放：位置、速度、颜色各是一块 (3, N) 的连续float32数组，
+尺寸、年龄和寿命各是一条 (N,) 数组。每一步只做整数组运算并复用预分配的缓冲区，
+单核即可交互式地步进百万级粒子。
+"""
+
+import json
+import math
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+# 寿命随机抖动比例，避免同一批粒子同时消亡
+LIFETIME_JITTER = 0.25
+
+# 加性混合的整体增益：全部粒子落在画面内时平均每像素的亮度
+SPLAT_GAIN = 0.25
+
+# 每个粒子的float32数量：位置/速度/颜色/步进缓冲各3个，尺寸/年龄/寿命各1个
+PARTICLE_FLOATS = 15
+# 渲染时每个粒子的临时数据（像素坐标、可见性、权重）字节数
+RENDER_BYTES_PER_PARTICLE = 40
+
+
+def estimate_memory(count: int) -> int:
+    """按粒子数预估峰值内存（字节）"""
+    return int(count) * (4 * PARTICLE_FLOATS + RENDER_BYTES_PER_PARTICLE)
+
+
+class ParticleSystem:
+    """
+    点发射器粒子系统
+
+    参数与 /vfx/effects/particles 描述一致：count、lifetime、size、color、gravity；
+    另外支持 emitter（发射点）、speed（初速度）和 spread（发射锥半角，弧度）。
+    """
+
+    def __init__(
+        self,
+        count: int = 10000,
+        lifetime: float = 5.0,
+        size: float = 1.0,
+        color=(1.0, 1.0, 1.0),
+        gravity: float = -9.8,
+        emitter=(0.0, 0.0, 0.0),
+        speed: float = 8.0,
+        spread: float = 0.35,
+        seed: int = 0,
+    ):
+        self.count = int(count)
+        self.lifetime = float(lifetime)
+        self.size = float(size)
+        self.base_color = np.asarray(color, dtype=np.float32).reshape(3, 1)
+        self.gravity = float(gravity)
+        self.emitter = np.asarray(emitter, dtype=np.float32).reshape(3, 1)
+        self.speed = float(speed)
+        self.spread = float(spread)
+        self.rng = np.random.default_rng(seed)
+
+        n = self.count
+        self.position = np.empty((3, n), dtype=np.float32)
+        self.velocity = np.empty((3, n), dtype=np.float32)
+        self.color = np.empty((3, n), dtype=np.float32)
+        self.particle_size = np.empty(n, dtype=np.float32)
+        self.age = np.empty(n, dtype=np.float32)
+        self.max_age = np.empty(n, dtype=np.float32)
+        self._scratch = np.empty((3, n), dtype=np.float32)
+
+        self._spawn(np.arange(n))
+        # 初始年龄均匀分布，之后每一步重生的粒子数量大致恒定
+        self.age[:] = self.rng.random(n, dtype=np.float32) * self.max_age
+
+    @classmethod
+    def from_parameters(cls, parameters: Dict[str, Any], seed: int = 0) -> "ParticleSystem":
+        """按特效参数创建"""
+        known = ("count", "lifetime", "size", "color", "gravity", "emitter", "speed", "spread")
+        return cls(seed=seed, **{k: parameters[k] for k in known if k in parameters})
+
+    def _spawn(self, idx: np.ndarray):
+        """在发射器处重生指定粒子"""
+        k = idx.size
+        if not k:
+            return
+        rng = self.rng
+        # 以+Y为轴的锥体内均匀取方向
+        cos_theta = 1.0 - rng.random(k, dtype=np.float32) * (1.0 - math.cos(self.spread))
+        sin_theta = np.sqrt(np.maximum(0.0, 1.0 - cos_theta * cos_theta))
+        phi = rng.random(k, dtype=np.float32) * np.float32(2.0 * math.pi)
+        speed = self.speed * (0.75 + 0.5 * rng.random(k, dtype=np.float32))
+
+        self.position[:, idx] = self.emitter
+        self.velocity[0, idx] = sin_theta * np.cos(phi) * speed
+        self.velocity[1, idx] = cos_theta * speed
+        self.velocity[2, idx] = sin_theta * np.sin(phi) * speed
+        self.color[:, idx] = self.base_color
+        self.particle_size[idx] = self.size * (0.5 + rng.random(k, dtype=np.float32))
+        self.age[idx] = 0.0
+        self.max_age[idx] = self.lifetime * (
+            1.0 + LIFETIME_JITTER * (2.0 * rng.random(k, dtype=np.float32) - 1.0)
+        )
+
+    def step(self, dt: float):
+        """推进一个时间步"""
+        dt = np.float32(dt)
+        self.age += dt
+        self.velocity[1] += np.float32(self.gravity) * dt
+        np.multiply(self.velocity, dt, out=self._scratch)
+        self.position += self._scratch
+        self._spawn(np.flatnonzero(self.age >= self.max_age))
+
+    def render(
+        self, width: int, height: int, extent: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        正视投影到XY平面并加性混合，返回 (h, w, 3) 线性图像
+
+        画面以发射器为中心，extent为半高（世界单位），默认按初速度和重力估算抛物线高度。
+        """
+        if extent is None:
+            apex = self.speed * self.speed / (2.0 * max(abs(self.gravity), 1e-3))
+            extent = max(1.0, min(apex, self.speed * self.lifetime)) * 1.2
+        scale = height / (2.0 * extent)
+        cx = width * 0.5 - self.emitter[0, 0] * scale
+        cy = height * 0.85 + self.emitter[1, 0] * scale
+
+        px = (self.position[0] * scale + cx).astype(np.int64)
+        py = (cy - self.position[1] * scale).astype(np.int64)
+        visible = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        pixel = py[visible] * width + px[visible]
+
+        # 随年龄淡出，亮度与粒子面积成正比；按粒子数归一化，画面总亮度与count无关
+        weight = (1.0 - self.age / self.max_age) * self.particle_size ** 2
+        weight = weight[visible] * np.float32(SPLAT_GAIN * width * height / max(self.count, 1))
+        image = np.empty((3, height * width), dtype=np.float32)
+        for channel in range(3):
+            image[channel] = np.bincount(
+                pixel, weights=weight * self.color[channel, visible], minlength=height * width
+            )
+        return image.reshape(3, height, width).transpose(1, 2, 0)
+
+    def state_dict(self) -> Dict[str, np.ndarray]:
+        """可序列化的完整状态"""
+        return {
+            "position": self.position,
+            "velocity": self.velocity,
+            "color": self.color,
+            "particle_size": self.particle_size,
+            "age": self.age,
+            "max_age": self.max_age,
+            "rng": np.frombuffer(
+                json.dumps(self.rng.bit_generator.state).encode("utf-8"), dtype=np.uint8
+            ),
+        }
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        """从 state_dict 恢复"""
+        for name in ("position", "velocity", "color", "particle_size", "age", "max_age"):
+            getattr(self, name)[...] = state[name]
+        self.rng.bit_generator.state = json.loads(bytes(state["rng"]).decode("utf-8"))
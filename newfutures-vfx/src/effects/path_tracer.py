@@ -0,0 +1,401 @@
+"""
+CPU路径追踪器
+
+以整批光线为单位做向量化计算：一个tile内所有像素、若干采样一次性发射，
+每次弹射对整批光线求交、着色并剔除终止的路径，避免逐像素的Python循环。
+三角网格通过BVH求交（见 effects.bvh）。
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from assets.storage import asset_path
+from effects.bvh import BVH, load_mesh_bvh
+
+# 单批次光线数量上限，决定一次性发射多少个采样
+RAY_BATCH = 1 << 16
+
+# 自适应采样估计噪声用的亮度权重（Rec.709）
+LUMINANCE = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+# 相对噪声的分母下限：很暗的像素按这个亮度计算，不会因为均值接近0而永远不收敛
+NOISE_FLOOR = 0.02
+
+# 自相交偏移
+EPSILON = 1e-3
+
+# 第几次弹射之后开始俄罗斯轮盘赌
+ROULETTE_DEPTH = 3
+
+Tile = Tuple[int, int, int, int]
+
+DEFAULT_SCENE: Dict[str, Any] = {
+    "camera": {"position": [0.0, 1.0, 4.5], "look_at": [0.0, 0.6, 0.0], "fov": 40.0},
+    "sky": {"top": [0.55, 0.7, 1.0], "bottom": [1.0, 1.0, 1.0], "intensity": 1.0},
+    "spheres": [
+        {"center": [0.0, 0.6, 0.0], "radius": 0.6,
+         "material": {"albedo": [0.8, 0.3, 0.25]}},
+        {"center": [-1.3, 0.45, -0.4], "radius": 0.45,
+         "material": {"albedo": [0.9, 0.9, 0.9], "metallic": 1.0, "roughness": 0.05}},
+        {"center": [1.25, 0.4, 0.3], "radius": 0.4,
+         "material": {"albedo": [0.2, 0.4, 0.8], "metallic": 0.5, "roughness": 0.3}},
+        {"center": [0.3, 2.4, 1.0], "radius": 0.3,
+         "material": {"albedo": [0.0, 0.0, 0.0], "emission": [12.0, 10.0, 8.0]}},
+    ],
+    "planes": [
+        {"point": [0.0, 0.0, 0.0], "normal": [0.0, 1.0, 0.0],
+         "material": {"albedo": [0.75, 0.75, 0.72]}},
+    ],
+}
+
+
+def _normalize(v: np.ndarray) -> np.ndarray:
+    length = np.linalg.norm(v, axis=-1, keepdims=True)
+    return v / np.maximum(length, 1e-12)
+
+
+@dataclass
+class Camera:
+    """针孔相机"""
+
+    position: np.ndarray
+    look_at: np.ndarray
+    up: np.ndarray
+    fov: float
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Camera":
+        return cls(
+            position=np.asarray(data.get("position", [0.0, 1.0, 4.5]), dtype=np.float32),
+            look_at=np.asarray(data.get("look_at", [0.0, 0.0, 0.0]), dtype=np.float32),
+            up=np.asarray(data.get("up", [0.0, 1.0, 0.0]), dtype=np.float32),
+            fov=float(data.get("fov", 40.0)),
+        )
+
+    def orbit(self, degrees: float) -> "Camera":
+        """绕look_at的竖直轴旋转相机"""
+        angle = math.radians(degrees)
+        c, s = math.cos(angle), math.sin(angle)
+        offset = self.position - self.look_at
+        rotated = np.array(
+            [c * offset[0] + s * offset[2], offset[1], -s * offset[0] + c * offset[2]],
+            dtype=np.float32,
+        )
+        return Camera(self.look_at + rotated, self.look_at, self.up, self.fov)
+
+    def generate_rays(
+        self, px: np.ndarray, py: np.ndarray, width: int, height: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """根据像素坐标（可带亚像素抖动）生成主光线"""
+        forward = _normalize(self.look_at - self.position)
+        right = _normalize(np.cross(forward, self.up))
+        true_up = np.cross(right, forward)
+
+        scale = math.tan(math.radians(self.fov) * 0.5)
+        aspect = width / height
+        sx = ((2.0 * px / width) - 1.0) * aspect * scale
+        sy = (1.0 - (2.0 * py / height)) * scale
+
+        directions = (
+            forward[None, :]
+            + sx[:, None].astype(np.float32) * right[None, :]
+            + sy[:, None].astype(np.float32) * true_up[None, :]
+        )
+        origins = np.broadcast_to(self.position, directions.shape).copy()
+        return origins, _normalize(directions).astype(np.float32)
+
+
+@dataclass
+class MeshInstance:
+    """场景中的网格实例：对象空间BVH + 均匀缩放和平移"""
+
+    bvh: BVH
+    translate: np.ndarray
+    scale: float
+    material: int
+
+
+class Scene:
+    """球体、无限平面和三角网格组成的场景，几何与材质都存放在连续数组中"""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.camera = Camera.from_dict(data.get("camera", {}))
+        self.orbit_per_frame = float(data.get("camera", {}).get("orbit_per_frame", 0.0))
+
+        sky = data.get("sky", {})
+        self.sky_top = np.asarray(sky.get("top", [0.55, 0.7, 1.0]), dtype=np.float32)
+        self.sky_bottom = np.asarray(sky.get("bottom", [1.0, 1.0, 1.0]), dtype=np.float32)
+        self.sky_intensity = float(sky.get("intensity", 1.0))
+
+        materials: List[Dict[str, Any]] = []
+
+        def add_material(material: Dict[str, Any]) -> int:
+            materials.append(material)
+            return len(materials) - 1
+
+        spheres = data.get("spheres", [])
+        self.sphere_center = np.array(
+            [s["center"] for s in spheres], dtype=np.float32
+        ).reshape(-1, 3)
+        self.sphere_radius = np.array([s["radius"] for s in spheres], dtype=np.float32)
+        self.sphere_material = np.array(
+            [add_material(s.get("material", {})) for s in spheres], dtype=np.int32
+        )
+
+        planes = data.get("planes", [])
+        self.plane_point = np.array([p["point"] for p in planes], dtype=np.float32).reshape(-1, 3)
+        self.plane_normal = _normalize(
+            np.array([p["normal"] for p in planes], dtype=np.float32).reshape(-1, 3)
+        )
+        self.plane_material = np.array(
+            [add_material(p.get("material", {})) for p in planes], dtype=np.int32
+        )
+
+        self.meshes: List[MeshInstance] = []
+        for mesh in data.get("meshes", []):
+            self.meshes.append(MeshInstance(
+                bvh=load_mesh_bvh(asset_path(mesh["path"])),
+                translate=np.asarray(mesh.get("translate", [0.0, 0.0, 0.0]), dtype=np.float32),
+                scale=float(mesh.get("scale", 1.0)),
+                material=add_material(mesh.get("material", {})),
+            ))
+
+        self.albedo = np.array(
+            [m.get("albedo", [0.8, 0.8, 0.8]) for m in materials], dtype=np.float32
+        ).reshape(-1, 3)
+        self.emission = np.array(
+            [m.get("emission", [0.0, 0.0, 0.0]) for m in materials], dtype=np.float32
+        ).reshape(-1, 3)
+        self.metallic = np.array([m.get("metallic", 0.0) for m in materials], dtype=np.float32)
+        self.roughness = np.array([m.get("roughness", 0.0) for m in materials], dtype=np.float32)
+
+    def camera_for_frame(self, frame: int) -> Camera:
+        if self.orbit_per_frame:
+            return self.camera.orbit(self.orbit_per_frame * (frame - 1))
+        return self.camera
+
+    def sky(self, directions: np.ndarray) -> np.ndarray:
+        """天空环境光"""
+        t = (0.5 * (directions[:, 1] + 1.0))[:, None]
+        return ((1.0 - t) * self.sky_bottom + t * self.sky_top) * self.sky_intensity
+
+    def intersect(
+        self, origins: np.ndarray, directions: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        批量求交
+
+        返回每条光线最近交点的距离（未命中为inf）、几何法线和材质序号。
+        """
+        n = origins.shape[0]
+        t_hit = np.full(n, np.inf, dtype=np.float32)
+        normal = np.zeros((n, 3), dtype=np.float32)
+        material = np.full(n, -1, dtype=np.int32)
+        rows = np.arange(n)
+
+        if self.sphere_radius.size:
+            oc = origins[:, None, :] - self.sphere_center[None, :, :]
+            b = np.einsum("nsk,nk->ns", oc, directions)
+            c = np.einsum("nsk,nsk->ns", oc, oc) - self.sphere_radius[None, :] ** 2
+            disc = b * b - c
+            sq = np.sqrt(np.maximum(disc, 0.0))
+            t0 = -b - sq
+            t1 = -b + sq
+            t = np.where(t0 > EPSILON, t0, np.where(t1 > EPSILON, t1, np.inf))
+            t[disc < 0.0] = np.inf
+            nearest = np.argmin(t, axis=1)
+            t_sphere = t[rows, nearest]
+            closer = t_sphere < t_hit
+            if closer.any():
+                idx = nearest[closer]
+                t_hit[closer] = t_sphere[closer]
+                hit_points = origins[closer] + directions[closer] * t_sphere[closer, None]
+                normal[closer] = (
+                    hit_points - self.sphere_center[idx]
+                ) / self.sphere_radius[idx, None]
+                material[closer] = self.sphere_material[idx]
+
+        if self.plane_normal.size:
+            denom = directions @ self.plane_normal.T
+            numer = np.einsum(
+                "npk,pk->np", self.plane_point[None, :, :] - origins[:, None, :], self.plane_normal
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = numer / denom
+            t[(np.abs(denom) < 1e-8) | ~(t > EPSILON)] = np.inf
+            nearest = np.argmin(t, axis=1)
+            t_plane = t[rows, nearest]
+            closer = t_plane < t_hit
+            if closer.any():
+                idx = nearest[closer]
+                t_hit[closer] = t_plane[closer]
+                normal[closer] = self.plane_normal[idx]
+                material[closer] = self.plane_material[idx]
+
+        for mesh in self.meshes:
+            # 光线变换到对象空间；方向同样除以缩放，距离t保持不变
+            t_mesh, tri = mesh.bvh.intersect(
+                (origins - mesh.translate) / mesh.scale, directions / mesh.scale, t_max=t_hit
+            )
+            closer = t_mesh < t_hit
+            if closer.any():
+                t_hit[closer] = t_mesh[closer]
+                normal[closer] = mesh.bvh.tri_normal[tri[closer]]
+                material[closer] = mesh.material
+
+        return t_hit, normal, material
+
+
+def _random_unit_vectors(rng: np.random.Generator, n: int) -> np.ndarray:
+    return _normalize(rng.standard_normal((n, 3)).astype(np.float32))
+
+
+def trace(
+    scene: Scene,
+    origins: np.ndarray,
+    directions: np.ndarray,
+    bounces: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """对一批光线做路径追踪，返回每条光线的辐射亮度"""
+    n = origins.shape[0]
+    radiance = np.zeros((n, 3), dtype=np.float32)
+    throughput = np.ones((n, 3), dtype=np.float32)
+    alive = np.arange(n)
+
+    for depth in range(bounces):
+        t, normal, material = scene.intersect(origins, directions)
+
+        miss = ~np.isfinite(t)
+        if miss.any():
+            radiance[alive[miss]] += throughput[miss] * scene.sky(directions[miss])
+        hit = ~miss
+        if not hit.any():
+            return radiance
+
+        alive = alive[hit]
+        origins, directions = origins[hit], directions[hit]
+        t, normal, material = t[hit], normal[hit], material[hit]
+        throughput = throughput[hit]
+
+        radiance[alive] += throughput * scene.emission[material]
+
+        # 法线朝向入射光线一侧
+        facing = np.einsum("nk,nk->n", normal, directions) > 0.0
+        normal[facing] = -normal[facing]
+        points = origins + directions * t[:, None]
+
+        # 漫反射按余弦分布采样，金属按粗糙度扰动镜面反射方向
+        m = alive.size
+        scatter = _random_unit_vectors(rng, m)
+        diffuse = normal + scatter
+        degenerate = np.einsum("nk,nk->n", diffuse, diffuse) < 1e-8
+        diffuse[degenerate] = normal[degenerate]
+
+        reflected = directions - 2.0 * np.einsum("nk,nk->n", directions, normal)[:, None] * normal
+        specular = reflected + scene.roughness[material, None] * scatter
+        is_specular = rng.random(m, dtype=np.float32) < scene.metallic[material]
+        new_dirs = _normalize(np.where(is_specular[:, None], specular, diffuse))
+
+        # 粗糙金属扰动后可能穿入表面，这些路径直接终止
+        valid = np.einsum("nk,nk->n", new_dirs, normal) > 0.0
+        throughput = throughput * scene.albedo[material]
+
+        if depth + 1 >= ROULETTE_DEPTH:
+            survive_p = np.clip(throughput.max(axis=1), 0.05, 0.95)
+            valid &= rng.random(m, dtype=np.float32) < survive_p
+            throughput = throughput / survive_p[:, None]
+
+        if not valid.any():
+            return radiance
+        alive = alive[valid]
+        throughput = throughput[valid]
+        directions = new_dirs[valid].astype(np.float32)
+        origins = (points[valid] + normal[valid] * EPSILON).astype(np.float32)
+
+    return radiance
+
+
+def _relative_noise(lum_sum: np.ndarray, lum_sq: np.ndarray, count: int) -> np.ndarray:
+    """像素亮度均值的标准误差相对于均值的比例，暗部按 NOISE_FLOOR 计算避免除零"""
+    mean = lum_sum / count
+    variance = np.maximum(lum_sq / count - mean * mean, 0.0) * (count / (count - 1))
+    return np.sqrt(variance / count) / np.maximum(mean, NOISE_FLOOR)
+
+
+def render_tile(
+    scene: Scene,
+    camera: Camera,
+    width: int,
+    height: int,
+    tile: Tile,
+    samples: int,
+    bounces: int,
+    rng: np.random.Generator,
+    cancel: Optional[Callable[[], None]] = None,
+    noise_threshold: float = 0.0,
+    min_samples: int = 0,
+) -> Tuple[np.ndarray, int]:
+    """
+    渲染一个tile，返回 (h, w, 3) 的线性辐射亮度和实际花费的像素采样数
+
+    samples 是每个像素的采样数。noise_threshold > 0 时为自适应采样，samples 只是上限：
+    像素采样满 min_samples 次后按亮度估计相对噪声，低于阈值的像素停止采样，之后每批
+    光线只分给还没收敛的像素，省下的预算集中到噪声大的区域。
+    cancel 在每批采样之前调用，抛出异常即中止渲染（任务取消）。
+    """
+    x0, y0, x1, y1 = tile
+    tile_w, tile_h = x1 - x0, y1 - y0
+    pixels = tile_w * tile_h
+    py, px = np.mgrid[y0:y1, x0:x1]
+    px = px.ravel().astype(np.float32)
+    py = py.ravel().astype(np.float32)
+
+    accum = np.zeros((pixels, 3), dtype=np.float64)
+    spent = np.zeros(pixels, dtype=np.int64)
+    # 估计方差至少需要两个采样，上限不足两个时按固定采样渲染
+    adaptive = noise_threshold > 0 and samples >= 2
+    if adaptive:
+        min_samples = min(max(2, min_samples), samples)
+        lum_sum = np.zeros(pixels, dtype=np.float64)
+        lum_sq = np.zeros(pixels, dtype=np.float64)
+
+    # 未收敛的像素，它们的采样数始终相同（taken）
+    active = np.arange(pixels)
+    taken = 0
+    while taken < samples and active.size:
+        if cancel is not None:
+            cancel()
+        count = min(max(1, RAY_BATCH // active.size), samples - taken)
+        if adaptive and taken < min_samples:
+            count = min(count, min_samples - taken)
+        jitter = rng.random((2, count * active.size), dtype=np.float32)
+        origins, directions = camera.generate_rays(
+            np.tile(px[active], count) + jitter[0], np.tile(py[active], count) + jitter[1],
+            width, height,
+        )
+        radiance = trace(scene, origins, directions, bounces, rng).reshape(count, active.size, 3)
+        accum[active] += radiance.sum(axis=0)
+        spent[active] += count
+        taken += count
+        if not adaptive:
+            continue
+
+        luminance = radiance @ LUMINANCE
+        lum_sum[active] += luminance.sum(axis=0)
+        lum_sq[active] += (luminance * luminance).sum(axis=0)
+        if taken >= min_samples:
+            noise = _relative_noise(lum_sum[active], lum_sq[active], taken)
+            active = active[noise > noise_threshold]
+
+    image = (accum / spent[:, None]).reshape(tile_h, tile_w, 3).astype(np.float32)
+    return image, int(spent.sum())
+
+
+def tone_map(pixels: np.ndarray, exposure: float = 1.0, gamma: float = 2.2) -> np.ndarray:
+    """曝光+伽马校正，输出8位图像"""
+    mapped = np.clip(pixels * exposure, 0.0, 1.0) ** (1.0 / gamma)
+    return (mapped * 255.0 + 0.5).astype(np.uint8)
@@ -0,0 +1,487 @@
+"""
+刚体物理
+
+球体和轴对齐盒子的刚体模拟，面向上万个刚体：
+
+- 宽相：空间哈希。刚体中心按网格单元打包成int64键并排序，每个醒着的刚体用
+  searchsorted查询周围27个单元，候选对数量只与实际邻近程度有关。睡眠刚体单独建一份
+  有序索引，只在睡眠集合变化时重建。
+- 窄相：按候选对批量计算球-球、球-盒、盒-盒的法线和穿透深度。
+- 求解：接触着色后分批做Gauss-Seidel冲量迭代，以上一步的冲量warm start，
+  带恢复系数、摩擦和位置修正。
+- 睡眠：通过接触连成岛，整个岛都静止一段时间后一起睡眠；被快速撞击时唤醒。
+
+状态以 (N, 3) 行存放，窄相按接触对整行gather。盒子不旋转。
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+SPHERE = 0
+BOX = 1
+
+SOLVER_ITERATIONS = 8
+# 上一步的接触冲量作为本步初值的比例
+WARM_START = 0.9
+# 允许的穿透深度和每步修正的比例
+PENETRATION_SLOP = 0.005
+POSITION_CORRECTION = 0.4
+# 低于该相对速度的碰撞不反弹，避免静止接触抖动
+RESTITUTION_THRESHOLD = 0.5
+# 速度低于SLEEP_SPEED持续SLEEP_TIME秒的岛进入睡眠
+SLEEP_SPEED = 0.2
+SLEEP_TIME = 0.5
+# 撞击速度超过该值时唤醒睡眠刚体
+WAKE_SPEED = 0.3
+# 单个子步的最大时长，更长的步进自动细分
+MAX_SUBSTEP = 1.0 / 60.0
+# 每个刚体的常驻状态和每步接触数据的预估字节数
+BODY_BYTES = 160
+CONTACT_BYTES_PER_BODY = 2048
+
+# 网格坐标打包：每轴21位
+_CELL_BITS = 21
+_CELL_MASK = (1 << _CELL_BITS) - 1
+_NEIGHBOR_OFFSETS = np.array(
+    [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)], dtype=np.int64
+)
+# 半邻域：自身单元加上字典序为正的13个方向
+_HALF_OFFSETS = _NEIGHBOR_OFFSETS[13:]
+
+
+def estimate_memory(count: int) -> int:
+    """按刚体数预估峰值内存（字节）"""
+    return int(count) * (BODY_BYTES + CONTACT_BYTES_PER_BODY)
+
+
+def _pack_cells(cells: np.ndarray) -> np.ndarray:
+    """(N, 3) 网格坐标 -> int64键；哈希冲突只会多出候选对，由窄相过滤"""
+    cells = cells & _CELL_MASK
+    return (cells[..., 0] << (2 * _CELL_BITS)) | (cells[..., 1] << _CELL_BITS) | cells[..., 2]
+
+
+class _CellIndex:
+    """按单元键排序的刚体索引"""
+
+    def __init__(self, bodies: np.ndarray, keys: np.ndarray):
+        order = np.argsort(keys, kind="stable")
+        self.bodies = bodies[order]
+        self.keys = keys[order]
+
+    def query(self, cells: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (查询行号, 刚体ID) 候选对：刚体位于查询单元按offsets平移后的单元中"""
+        if not self.keys.size or not cells.size:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        neighbor_keys = _pack_cells(cells[:, None, :] + offsets).ravel()
+        start = np.searchsorted(self.keys, neighbor_keys, side="left")
+        counts = np.searchsorted(self.keys, neighbor_keys, side="right") - start
+        total = int(counts.sum())
+        rows = np.repeat(np.arange(neighbor_keys.size) // len(offsets), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        return rows, self.bodies[np.repeat(start, counts) + offsets]
+
+
+def _scatter(index: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    """按刚体累加 (K, 3) 的值"""
+    out = np.empty((size, 3), dtype=np.float64)
+    for axis in range(3):
+        out[:, axis] = np.bincount(index, weights=values[:, axis], minlength=size)
+    return out
+
+
+def _color_contacts(la: np.ndarray, lb: np.ndarray, inv_mass: np.ndarray) -> List[np.ndarray]:
+    """
+    接触着色：把接触分成若干批，同一批内没有两个接触作用在同一个可动刚体上
+
+    每一轮里，一个接触若在它两个刚体的所有剩余接触中优先级最高就入选当前批。
+    不可动的一侧（环境、睡眠刚体）不参与冲突判断。
+    """
+    k = len(la)
+    m = len(inv_mass)
+    # 不可动的一侧换成各不相同的虚拟下标
+    dummy = m + np.arange(k)
+    ka = np.where(inv_mass[la] > 0, la, dummy)
+    kb = np.where(inv_mass[lb] > 0, lb, dummy)
+    # 固定的伪随机优先级，避免按下标选择时链状接触一轮只能选一个
+    priority = np.random.default_rng(k).permutation(k)
+    remaining = np.arange(k)
+    batches = []
+    while remaining.size:
+        best = np.full(m + k, k)
+        pr = priority[remaining]
+        np.minimum.at(best, ka[remaining], pr)
+        np.minimum.at(best, kb[remaining], pr)
+        chosen = (best[ka[remaining]] == pr) & (best[kb[remaining]] == pr)
+        batches.append(remaining[chosen])
+        remaining = remaining[~chosen]
+    return batches
+
+
+class RigidBodyWorld:
+    """
+    刚体世界
+
+    参数：count（刚体数）、gravity、restitution（恢复系数）、friction、size（平均半径/半边长）、
+    box_ratio（盒子所占比例）、bounds（地面以上 ±bounds 的围墙）。
+    """
+
+    def __init__(
+        self,
+        count: int = 1000,
+        gravity: float = -9.8,
+        restitution: float = 0.3,
+        friction: float = 0.5,
+        size: float = 0.2,
+        box_ratio: float = 0.5,
+        bounds: float = 10.0,
+        seed: int = 0,
+    ):
+        self.count = int(count)
+        self.gravity = np.array([0.0, float(gravity), 0.0])
+        self.restitution = float(restitution)
+        self.friction = float(friction)
+        self.bounds = float(bounds)
+        rng = np.random.default_rng(seed)
+        n = self.count
+
+        self.shape = (rng.random(n) < box_ratio).astype(np.int8)
+        self.half = np.repeat(
+            (float(size) * (0.7 + 0.6 * rng.random(n)))[:, None], 3, axis=1
+        )
+        is_box = self.shape == BOX
+        volume = np.where(is_box, 8.0, 4.18879) * self.half[:, 0] ** 3
+        self.inv_mass = 1.0 / volume
+        # 包围球半径：球是半径，盒子是半对角线
+        self.bound_radius = np.where(is_box, np.sqrt(3.0), 1.0) * self.half[:, 0]
+        self.cell_size = 2.0 * float(self.bound_radius.max()) if n else 1.0
+
+        # 在场地中央的立方格子上错开摆放，向上堆叠
+        spacing = self.cell_size * 1.1
+        side = max(1, int(min(np.ceil(n ** (1.0 / 3.0)), 1.6 * self.bounds / spacing)))
+        layer = side * side
+        index = np.arange(n)
+        grid = np.stack([index % side, index // layer, (index // side) % side], axis=1)
+        self.position = (grid - [(side - 1) / 2.0, -0.5, (side - 1) / 2.0]) * spacing
+        self.position += (rng.random((n, 3)) - 0.5) * (0.1 * spacing)
+        self.position[:, 1] += self.bounds * 0.3
+        self.velocity = (rng.random((n, 3)) - 0.5) * [1.0, 0.0, 1.0]
+        self.color = rng.random((n, 3)) * 0.6 + 0.3
+
+        self.awake = np.ones(n, dtype=bool)
+        self.rest_time = np.zeros(n)
+        self.last_contacts = 0
+        self._sleep_index: Optional[_CellIndex] = None
+        # 接触缓存：按接触键排序，用于warm start
+        self._contact_keys = np.empty(0, dtype=np.int64)
+        self._contact_impulses = np.empty((0, 4))
+
+    @classmethod
+    def from_parameters(cls, parameters: Dict[str, Any], seed: int = 0) -> "RigidBodyWorld":
+        """按特效参数创建"""
+        known = ("count", "gravity", "restitution", "friction", "size", "box_ratio", "bounds")
+        return cls(seed=seed, **{k: parameters[k] for k in known if k in parameters})
+
+    def _cells(self, bodies: np.ndarray) -> np.ndarray:
+        return np.floor(self.position[bodies] / self.cell_size).astype(np.int64)
+
+    def _candidate_pairs(self, awake: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """宽相：醒着的刚体与所有刚体的候选对，每对只出现一次，已按包围球过滤"""
+        cells = self._cells(awake)
+        # 醒着的刚体之间只查半个邻域：同一单元按ID去重，其余13个方向各查一次
+        awake_index = _CellIndex(awake, _pack_cells(cells))
+        rows, others = awake_index.query(cells, _HALF_OFFSETS)
+        a, b = awake[rows], others
+        keep = (a < b) | (self._cell_keys(b) != self._cell_keys(a))
+        pairs_a, pairs_b = [a[keep]], [b[keep]]
+
+        if self._sleep_index is None:
+            sleeping = np.flatnonzero(~self.awake)
+            self._sleep_index = _CellIndex(sleeping, _pack_cells(self._cells(sleeping)))
+        rows, others = self._sleep_index.query(cells, _NEIGHBOR_OFFSETS)
+        pairs_a.append(awake[rows])
+        pairs_b.append(others)
+
+        a, b = np.concatenate(pairs_a), np.concatenate(pairs_b)
+        delta = self.position[b] - self.position[a]
+        reach = self.bound_radius[a] + self.bound_radius[b]
+        near = np.einsum("ij,ij->i", delta, delta) < reach * reach
+        return a[near], b[near]
+
+    def _cell_keys(self, bodies: np.ndarray) -> np.ndarray:
+        return _pack_cells(self._cells(bodies))
+
+    def _narrowphase(self, a: np.ndarray, b: np.ndarray):
+        """窄相：返回有穿透的接触 (a, b, 法线a->b, 穿透深度)"""
+        # 球-盒统一成 a 是球、b 是盒
+        swap = (self.shape[a] == BOX) & (self.shape[b] == SPHERE)
+        a, b = np.where(swap, b, a), np.where(swap, a, b)
+        pa, pb = self.position[a], self.position[b]
+        ha, hb = self.half[a], self.half[b]
+        delta = pb - pa
+        normal = np.zeros_like(delta)
+        depth = np.full(len(a), -1.0)
+
+        sa, sb = self.shape[a] == SPHERE, self.shape[b] == SPHERE
+        # 球-球
+        m = sa & sb
+        dist = np.linalg.norm(delta[m], axis=1)
+        depth[m] = ha[m, 0] + hb[m, 0] - dist
+        normal[m] = delta[m] / np.maximum(dist, 1e-9)[:, None]
+
+        # 球-盒：球心到盒子的最近点
+        m = sa & ~sb
+        closest = np.clip(pa[m], pb[m] - hb[m], pb[m] + hb[m])
+        offset = closest - pa[m]
+        dist = np.linalg.norm(offset, axis=1)
+        depth[m] = ha[m, 0] - dist
+        normal[m] = offset / np.maximum(dist, 1e-9)[:, None]
+        # 球心在盒子内部时按盒-盒处理
+        inside = np.flatnonzero(m)[dist < 1e-9]
+
+        # 盒-盒（以及球心落入盒子的情况）：最小重叠轴
+        m = ~sa & ~sb
+        m[inside] = True
+        overlap = ha[m] + hb[m] - np.abs(delta[m])
+        axis = np.argmin(overlap, axis=1)
+        rows = np.arange(len(axis))
+        depth[m] = overlap[rows, axis]
+        box_normal = np.zeros((len(axis), 3))
+        box_normal[rows, axis] = np.where(delta[m][rows, axis] >= 0, 1.0, -1.0)
+        normal[m] = box_normal
+
+        hit = depth > 0
+        return a[hit], b[hit], normal[hit], depth[hit]
+
+    def _world_contacts(self, bodies: np.ndarray):
+        """地面和四周围墙的接触，a为-1表示静态环境"""
+        p, extent = self.position[bodies], self.half[bodies]
+        contacts = [(p[:, 1] - extent[:, 1], 1, 1.0)]
+        for axis in (0, 2):
+            contacts.append((self.bounds - extent[:, axis] - p[:, axis], axis, -1.0))
+            contacts.append((self.bounds - extent[:, axis] + p[:, axis], axis, 1.0))
+        b, normal, depth = [], [], []
+        for gap, axis, sign in contacts:
+            hit = gap < 0
+            b.append(bodies[hit])
+            n = np.zeros((int(hit.sum()), 3))
+            n[:, axis] = sign
+            normal.append(n)
+            depth.append(-gap[hit])
+        b = np.concatenate(b)
+        return np.full(len(b), -1), b, np.concatenate(normal), np.concatenate(depth)
+
+    def _contact_keys_for(self, a: np.ndarray, b: np.ndarray, normal: np.ndarray) -> np.ndarray:
+        """接触键：刚体对，环境接触再区分是哪一面"""
+        surface = np.where(a < 0, np.argmax(np.abs(normal), axis=1) * 2 + (normal.sum(axis=1) > 0), 0)
+        return ((a + 1) * (self.count + 1) + b) * 8 + surface
+
+    def _solve_contacts(self, a, b, normal, depth):
+        """
+        分批Gauss-Seidel冲量迭代，以上一步同一接触的冲量为初值
+
+        接触按着色分批，同一批内的接触不共享刚体，可以整批向量化更新。
+        只在参与接触的刚体上计算（压缩成局部下标），代价与接触数成正比。
+        """
+        keys = self._contact_keys_for(a, b, normal)
+        k = len(a)
+        bodies, inverse = np.unique(np.concatenate([a, b]), return_inverse=True)
+        la, lb = inverse[:k], inverse[k:]
+        real = bodies >= 0
+        # 静态环境和睡眠刚体在本步视为不可移动
+        inv_mass = np.where(real, self.inv_mass[bodies] * self.awake[bodies], 0.0)
+        velocity = np.where(real[:, None], self.velocity[bodies], 0.0)
+        wa, wb = inv_mass[la], inv_mass[lb]
+        w = wa + wb
+        valid = w > 0
+        la, lb, normal, depth, wa, wb, w, keys = (
+            x[valid] for x in (la, lb, normal, depth, wa, wb, w, keys)
+        )
+        batches = _color_contacts(la, lb, inv_mass)
+        wa, wb = wa[:, None], wb[:, None]
+
+        vn0 = np.einsum("ij,ij->i", velocity[lb] - velocity[la], normal)
+        target = np.where(vn0 < -RESTITUTION_THRESHOLD, -self.restitution * vn0, 0.0)
+        impulses = np.zeros((len(la), 4))
+        if self._contact_keys.size and len(la):
+            found = np.minimum(np.searchsorted(self._contact_keys, keys), len(self._contact_keys) - 1)
+            hit = self._contact_keys[found] == keys
+            cached = self._contact_impulses[found[hit]] * WARM_START
+            # 摩擦冲量只保留与当前法线垂直的部分
+            tangent = cached[:, 1:]
+            tangent -= np.einsum("ij,ij->i", tangent, normal[hit])[:, None] * normal[hit]
+            impulses[hit, 0] = cached[:, 0]
+            impulses[hit, 1:] = tangent
+            applied = impulses[:, :1] * normal + impulses[:, 1:]
+            velocity -= _scatter(la, applied * wa, len(bodies))
+            velocity += _scatter(lb, applied * wb, len(bodies))
+
+        for _ in range(SOLVER_ITERATIONS):
+            for batch in batches:
+                ia, ib, n = la[batch], lb[batch], normal[batch]
+                relative = velocity[ib] - velocity[ia]
+                vn = np.einsum("ij,ij->i", relative, n)
+                previous = impulses[batch]
+                total = np.maximum(previous[:, 0] + (target[batch] - vn) / w[batch], 0.0)
+
+                # 库仑摩擦：切向冲量限制在 μ * 法向冲量 以内
+                tangent = relative - vn[:, None] * n
+                friction = previous[:, 1:] - tangent / w[batch, None]
+                limit = self.friction * total
+                magnitude = np.linalg.norm(friction, axis=1)
+                friction *= np.minimum(1.0, limit / np.maximum(magnitude, 1e-12))[:, None]
+
+                change = (total - previous[:, 0])[:, None] * n + friction - previous[:, 1:]
+                impulses[batch, 0] = total
+                impulses[batch, 1:] = friction
+                velocity[ia] -= change * wa[batch]
+                velocity[ib] += change * wb[batch]
+
+        # 位置修正，同样分批，穿透深度随已做的修正更新
+        shift = np.zeros_like(velocity)
+        for batch in batches:
+            ia, ib, n = la[batch], lb[batch], normal[batch]
+            remaining = depth[batch] - np.einsum("ij,ij->i", shift[ib] - shift[ia], n)
+            push = np.maximum(remaining - PENETRATION_SLOP, 0.0) * POSITION_CORRECTION / w[batch]
+            shift[ia] -= push[:, None] * n * wa[batch]
+            shift[ib] += push[:, None] * n * wb[batch]
+
+        self.velocity[bodies[real]] = velocity[real]
+        self.position[bodies[real]] += shift[real]
+        order = np.argsort(keys)
+        self._contact_keys = keys[order]
+        self._contact_impulses = impulses[order]
+
+    def _update_sleep(self, awake: np.ndarray, a: np.ndarray, b: np.ndarray, dt: float):
+        """整个接触岛都静止足够久才睡眠"""
+        speed2 = np.einsum("ij,ij->i", self.velocity[awake], self.velocity[awake])
+        rest = np.where(speed2 < SLEEP_SPEED ** 2, self.rest_time[awake] + dt, 0.0)
+        self.rest_time[awake] = rest
+
+        # 只有两个都已静止的醒着刚体之间的接触构成岛：运动中的刚体不会让整堆刚体保持清醒，
+        # 它撞上睡眠刚体时由唤醒逻辑处理。本步刚被唤醒的刚体不在awake里，也不参与
+        la = np.minimum(np.searchsorted(awake, a), len(awake) - 1)
+        lb = np.minimum(np.searchsorted(awake, b), len(awake) - 1)
+        both = (awake[la] == a) & (awake[lb] == b)
+        la, lb = la[both], lb[both]
+        resting = (rest[la] > 0) & (rest[lb] > 0)
+        la, lb = la[resting], lb[resting]
+        labels = np.arange(len(awake))
+        while la.size:
+            low = np.minimum(labels[la], labels[lb])
+            before = labels.copy()
+            np.minimum.at(labels, la, low)
+            np.minimum.at(labels, lb, low)
+            labels = labels[labels]
+            if np.array_equal(labels, before):
+                break
+        island_rest = np.full(len(awake), np.inf)
+        np.minimum.at(island_rest, labels, rest)
+        asleep = awake[island_rest[labels] >= SLEEP_TIME]
+        if asleep.size:
+            self.awake[asleep] = False
+            self.velocity[asleep] = 0.0
+            self._sleep_index = None
+
+    def _wake(self, bodies: np.ndarray):
+        bodies = bodies[~self.awake[bodies]]
+        if bodies.size:
+            self.awake[bodies] = True
+            self.rest_time[bodies] = 0.0
+            self._sleep_index = None
+
+    def step(self, dt: float):
+        """推进一个时间步；代价随醒着的刚体数和接触数增长"""
+        substeps = max(1, int(np.ceil(dt / MAX_SUBSTEP - 1e-9)))
+        for _ in range(substeps):
+            self._substep(dt / substeps)
+
+    def _substep(self, dt: float):
+        awake = np.flatnonzero(self.awake)
+        if not awake.size:
+            self.last_contacts = 0
+            return
+        self.velocity[awake] += self.gravity * dt
+
+        a, b, normal, depth = self._narrowphase(*self._candidate_pairs(awake))
+        self.last_contacts = len(a)
+        # 快速撞上睡眠刚体时唤醒它，本步仍按静止处理
+        impact = -np.einsum("ij,ij->i", self.velocity[b] - self.velocity[a], normal)
+        hard = impact > WAKE_SPEED
+        self._wake(np.concatenate([a[hard], b[hard]]))
+
+        world = self._world_contacts(awake)
+        self._solve_contacts(
+            *(np.concatenate(pair) for pair in zip((a, b, normal, depth), world))
+        )
+
+        self.position[awake] += self.velocity[awake] * dt
+        self._update_sleep(awake, a, b, dt)
+
+    def render(self, width: int, height: int) -> np.ndarray:
+        """
+        正视图，返回 (h, w, 3) 线性图像
+
+        按像素深度缓冲合成：每个刚体展开成覆盖的像素，每个像素取离相机最近的刚体。
+        """
+        scale = width / (2.2 * self.bounds)
+        cx = width * 0.5 + self.position[:, 0] * scale
+        cy = height * 0.9 - self.position[:, 1] * scale
+        radius = np.maximum(1, np.ceil(self.half[:, 0] * scale)).astype(np.int64)
+
+        pixels_all, depth_all, shade_all, body_all = [], [], [], []
+        for r in np.unique(radius):
+            bodies = np.flatnonzero(radius == r)
+            oy, ox = np.mgrid[-r:r + 1, -r:r + 1]
+            ox, oy = ox.ravel(), oy.ravel()
+            falloff = 1.0 - (ox * ox + oy * oy) / float(r * r + 1)
+            for shape, stencil in ((SPHERE, falloff > 0), (BOX, np.ones_like(falloff, bool))):
+                group = bodies[self.shape[bodies] == shape]
+                if not group.size:
+                    continue
+                sx, sy = ox[stencil], oy[stencil]
+                shade = np.sqrt(np.maximum(falloff[stencil], 0.0)) if shape == SPHERE else (
+                    0.8 - 0.2 * (sy / (r + 1))
+                )
+                px = (cx[group, None] + sx).astype(np.int64)
+                py = (cy[group, None] + sy).astype(np.int64)
+                inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+                pixels_all.append((py * width + px)[inside])
+                depth_all.append(np.broadcast_to(self.position[group, 2, None], px.shape)[inside])
+                shade_all.append(np.broadcast_to(shade, px.shape)[inside])
+                body_all.append(np.broadcast_to(group[:, None], px.shape)[inside])
+
+        image = np.zeros((height * width, 3), dtype=np.float32)
+        image[:] = (0.02, 0.02, 0.03)
+        if pixels_all:
+            pixel = np.concatenate(pixels_all)
+            # 相机在+Z方向，z越大越近
+            order = np.lexsort((-np.concatenate(depth_all), pixel))
+            pixel = pixel[order]
+            first = np.ones(len(pixel), dtype=bool)
+            first[1:] = pixel[1:] != pixel[:-1]
+            chosen = order[first]
+            body = np.concatenate(body_all)[chosen]
+            shade = np.concatenate(shade_all)[chosen]
+            image[pixel[first]] = self.color[body] * (0.25 + 0.75 * shade)[:, None]
+        return image.reshape(height, width, 3)
+
+    def state_dict(self) -> Dict[str, np.ndarray]:
+        """可序列化的完整状态"""
+        return {
+            "position": self.position,
+            "velocity": self.velocity,
+            "awake": self.awake,
+            "rest_time": self.rest_time,
+        }
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        """从 state_dict 恢复"""
+        self.position[...] = state["position"]
+        self.velocity[...] = state["velocity"]
+        self.awake[...] = state["awake"]
+        self.rest_time[...] = state["rest_time"]
+        self._sleep_index = None
+        self._contact_keys = np.empty(0, dtype=np.int64)
+        self._contact_impulses = np.empty((0, 4))
@@ -0,0 +1,401 @@
+"""
+视频特效流水线
+
+解码 → 特效链 → 编码 的流式处理：
+
+- 解码和编码各是一个ffmpeg子进程，原始RGB帧通过管道逐帧读写，不落盘、不整段读入内存。
+- 每个特效阶段一个线程（可再开若干计算线程并保持帧序），阶段之间用有界队列连接。
+  内存中最多只有约 (阶段数 + 1) * (QUEUE_FRAMES + 阶段线程数) 帧，与片段长度无关。
+- 解码、各特效阶段和编码同时进行，吞吐量由最慢的一环决定，通常是编码器。
+
+任一环节出错时所有线程停止，解码进程被终止，错误在调用线程重新抛出。
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from fractions import Fraction
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+# 相邻两个环节之间最多排队的帧数
+QUEUE_FRAMES = 2
+# 每个特效阶段默认的计算线程数；NumPy/OpenCV在计算时释放GIL
+STAGE_THREADS = 2
+# 阻塞的队列操作检查停止信号的间隔（秒）
+POLL_INTERVAL = 0.1
+
+DEFAULT_CODEC = "libx264"
+DEFAULT_CRF = 18
+
+Frame = np.ndarray
+FrameEffect = Callable[[Frame], Frame]
+
+# 队列结束标记
+_END = object()
+
+
+@dataclass
+class VideoInfo:
+    """视频流信息"""
+
+    width: int
+    height: int
+    fps: float
+    frames: Optional[int] = None
+    has_audio: bool = False
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.width * self.height * 3
+
+
+def probe(path: Path) -> VideoInfo:
+    """用ffprobe读取第一个视频流的尺寸、帧率和帧数"""
+    import ffmpeg
+
+    streams = ffmpeg.probe(str(path))["streams"]
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    if video is None:
+        raise ValueError(f"No video stream in {Path(path).name}")
+    frames = video.get("nb_frames")
+    return VideoInfo(
+        width=int(video["width"]),
+        height=int(video["height"]),
+        fps=float(Fraction(video.get("avg_frame_rate") or video["r_frame_rate"])),
+        frames=int(frames) if frames and frames.isdigit() else None,
+        has_audio=any(s.get("codec_type") == "audio" for s in streams),
+    )
+
+
+def _read_exact(stream, buffer: memoryview) -> bool:
+    """把buffer读满；流在帧开头结束时返回False"""
+    filled = 0
+    while filled < len(buffer):
+        count = stream.readinto(buffer[filled:])
+        if not count:
+            if filled:
+                raise RuntimeError(f"Truncated frame: got {filled} of {len(buffer)} bytes")
+            return False
+        filled += count
+    return True
+
+
+def decode_frames(path: Path, info: VideoInfo) -> Iterator[Frame]:
+    """
+    逐帧解码为 (h, w, 3) uint8 RGB
+
+    生成器被提前关闭时终止解码进程。
+    """
+    import ffmpeg
+
+    process = (
+        ffmpeg.input(str(path))
+        .output("pipe:", format="rawvideo", pix_fmt="rgb24")
+        .global_args("-loglevel", "error", "-nostdin")
+        .run_async(pipe_stdout=True)
+    )
+    finished = False
+    try:
+        while True:
+            frame = np.empty((info.height, info.width, 3), dtype=np.uint8)
+            if not _read_exact(process.stdout, memoryview(frame.reshape(-1))):
+                break
+            yield frame
+        finished = True
+    finally:
+        if not finished:
+            process.kill()
+        process.stdout.close()
+        code = process.wait()
+        if finished and code != 0:
+            raise RuntimeError(f"ffmpeg decoder exited with code {code}")
+
+
+class VideoEncoder:
+    """
+    流式编码器：帧写入ffmpeg的stdin
+
+    audio_source不为空时从该文件复制音轨（不重新编码）。
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        info: VideoInfo,
+        codec: str = DEFAULT_CODEC,
+        crf: int = DEFAULT_CRF,
+        audio_source: Optional[Path] = None,
+    ):
+        import ffmpeg
+
+        self.path = Path(path)
+        self.info = info
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        video = ffmpeg.input(
+            "pipe:", format="rawvideo", pix_fmt="rgb24",
+            s=f"{info.width}x{info.height}", framerate=info.fps,
+        )
+        streams = [video]
+        options: Dict[str, Any] = {"vcodec": codec, "pix_fmt": "yuv420p", "crf": crf}
+        if audio_source is not None:
+            streams.append(ffmpeg.input(str(audio_source)).audio)
+            options["acodec"] = "copy"
+        self._process = (
+            ffmpeg.output(*streams, str(self.path), **options)
+            .overwrite_output()
+            .global_args("-loglevel", "error", "-nostdin")
+            .run_async(pipe_stdin=True)
+        )
+        self.frames = 0
+
+    def write(self, frame: Frame):
+        if frame.shape != (self.info.height, self.info.width, 3) or frame.dtype != np.uint8:
+            raise ValueError(f"Unexpected frame {frame.shape} {frame.dtype}")
+        self._process.stdin.write(memoryview(np.ascontiguousarray(frame).reshape(-1)))
+        self.frames += 1
+
+    def close(self):
+        """结束输入并等待编码完成"""
+        self._process.stdin.close()
+        code = self._process.wait()
+        if code != 0:
+            raise RuntimeError(f"ffmpeg encoder exited with code {code}")
+
+    def abort(self):
+        """放弃编码并删除不完整的输出"""
+        self._process.kill()
+        self._process.wait()
+        self.path.unlink(missing_ok=True)
+
+
+def _color_grade(
+    exposure: float = 1.0, contrast: float = 1.0, gamma: float = 1.0, saturation: float = 1.0
+) -> FrameEffect:
+    """曝光/对比度/伽马合并成一张256项查找表，饱和度单独按亮度混合"""
+    x = np.arange(256, dtype=np.float32) / 255.0
+    y = np.clip((x * float(exposure) - 0.5) * float(contrast) + 0.5, 0.0, 1.0) ** (1.0 / float(gamma))
+    lut = (y * 255.0 + 0.5).astype(np.uint8)
+    saturation = float(saturation)
+
+    def apply(frame: Frame) -> Frame:
+        out = lut[frame]
+        if saturation != 1.0:
+            luma = out @ np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+            mixed = luma[..., None] + (out - luma[..., None]) * np.float32(saturation)
+            out = np.clip(mixed, 0.0, 255.0).astype(np.uint8)
+        return out
+
+    return apply
+
+
+def _grayscale() -> FrameEffect:
+    def apply(frame: Frame) -> Frame:
+        luma = (frame @ np.array([54, 183, 19], dtype=np.uint16)) >> 8
+        return np.repeat(luma.astype(np.uint8)[..., None], 3, axis=2)
+
+    return apply
+
+
+def _blur(radius: float = 2.0) -> FrameEffect:
+    import cv2
+
+    sigma = max(float(radius), 0.1)
+
+    def apply(frame: Frame) -> Frame:
+        return cv2.GaussianBlur(frame, (0, 0), sigma)
+
+    return apply
+
+
+def _vignette(strength: float = 0.5) -> FrameEffect:
+    """暗角；掩码按分辨率只计算一次"""
+    masks: Dict[tuple, np.ndarray] = {}
+
+    def apply(frame: Frame) -> Frame:
+        h, w = frame.shape[:2]
+        mask = masks.get((h, w))
+        if mask is None:
+            y = np.linspace(-1.0, 1.0, h, dtype=np.float32)[:, None]
+            x = np.linspace(-1.0, 1.0, w, dtype=np.float32)[None, :]
+            falloff = np.clip(1.0 - float(strength) * (x * x + y * y) * 0.5, 0.0, 1.0)
+            mask = masks[(h, w)] = (falloff * 256.0).astype(np.uint16)[..., None]
+        return ((frame * mask) >> 8).astype(np.uint8)
+
+    return apply
+
+
+# 帧特效注册表：特效名 -> 按参数创建逐帧函数的工厂
+FRAME_EFFECTS: Dict[str, Callable[..., FrameEffect]] = {
+    "color_grade": _color_grade,
+    "grayscale": _grayscale,
+    "blur": _blur,
+    "vignette": _vignette,
+}
+
+
+@dataclass
+class Stage:
+    """特效链中的一个阶段"""
+
+    name: str
+    apply: FrameEffect
+    threads: int = STAGE_THREADS
+
+
+def build_chain(effects: Sequence[Dict[str, Any]]) -> List[Stage]:
+    """由 [{"effect": 名称, "threads": 线程数, ...参数}] 创建特效链"""
+    chain = []
+    for spec in effects:
+        params = dict(spec)
+        name = params.pop("effect", None)
+        if name not in FRAME_EFFECTS:
+            raise ValueError(f"Video effect {name} is not available")
+        threads = max(1, int(params.pop("threads", STAGE_THREADS)))
+        chain.append(Stage(name, FRAME_EFFECTS[name](**params), threads))
+    return chain
+
+
+def run_pipeline(
+    frames: Iterable[Frame],
+    stages: Sequence[Stage],
+    sink: Callable[[Frame], None],
+    queue_frames: int = QUEUE_FRAMES,
+) -> int:
+    """
+    把frames依次经过各阶段送入sink，返回处理的帧数
+
+    帧源和每个阶段各在一个线程中运行，sink在调用线程中执行；帧顺序保持不变。
+    """
+    queues = [queue.Queue(maxsize=queue_frames) for _ in range(len(stages) + 1)]
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def put(target: queue.Queue, item) -> bool:
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(source: queue.Queue):
+        while not stop.is_set():
+            try:
+                return source.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _END
+
+    def fail(error: BaseException):
+        errors.append(error)
+        stop.set()
+
+    def produce():
+        iterator = iter(frames)
+        try:
+            for frame in iterator:
+                if not put(queues[0], frame):
+                    return
+            put(queues[0], _END)
+        except BaseException as e:
+            fail(e)
+        finally:
+            # 提前结束时关闭生成器，让解码进程退出
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except BaseException as e:
+                    fail(e)
+
+    def work(stage: Stage, inbox: queue.Queue, outbox: queue.Queue):
+        # 最多threads帧同时计算，按提交顺序输出
+        pending = deque()
+        try:
+            with ThreadPoolExecutor(stage.threads, thread_name_prefix=f"video-{stage.name}") as pool:
+                while True:
+                    item = get(inbox)
+                    if item is _END:
+                        break
+                    pending.append(pool.submit(stage.apply, item))
+                    if len(pending) >= stage.threads and not put(outbox, pending.popleft().result()):
+                        return
+                while pending:
+                    if not put(outbox, pending.popleft().result()):
+                        return
+            put(outbox, _END)
+        except BaseException as e:
+            fail(e)
+
+    threads = [threading.Thread(target=produce, name="video-decode", daemon=True)]
+    for index, stage in enumerate(stages):
+        threads.append(threading.Thread(
+            target=work, args=(stage, queues[index], queues[index + 1]),
+            name=f"video-stage-{stage.name}", daemon=True,
+        ))
+    for thread in threads:
+        thread.start()
+
+    count = 0
+    try:
+        while True:
+            item = get(queues[-1])
+            if item is _END:
+                break
+            sink(item)
+            count += 1
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return count
+
+
+def process_video(
+    input_path: Path,
+    output_path: Path,
+    effects: Sequence[Dict[str, Any]],
+    codec: str = DEFAULT_CODEC,
+    crf: int = DEFAULT_CRF,
+    queue_frames: int = QUEUE_FRAMES,
+) -> Dict[str, Any]:
+    """对整个视频应用特效链并编码输出，保留原音轨"""
+    info = probe(input_path)
+    chain = build_chain(effects)
+    encoder = VideoEncoder(
+        output_path, info, codec=codec, crf=crf,
+        audio_source=input_path if info.has_audio else None,
+    )
+    started = time.perf_counter()
+    try:
+        frames = run_pipeline(decode_frames(input_path, info), chain, encoder.write, queue_frames)
+        encoder.close()
+    except BaseException:
+        encoder.abort()
+        raise
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"🎞️ 视频处理完成: {Path(input_path).name} -> {Path(output_path).name}, "
+        f"{frames} 帧, {frames / max(elapsed, 1e-9):.1f} fps"
+    )
+    return {
+        "output_file": str(output_path),
+        "frames": frames,
+        "width": info.width,
+        "height": info.height,
+        "fps": info.fps,
+        "elapsed": elapsed,
+        "effects": [stage.name for stage in chain],
+    }
@@ -0,0 +1,501 @@
+"""
+体积渲染
+
+云、雾、烟雾的离线CPU光线步进渲染器：
+
+- 密度场按 8³ 体素的brick稀疏存储（每个brick带1体素的边，brick内即可完成三线性插值），
+  空brick不分配内存。brick-level的占用网格同时用作空域跳过的加速结构。
+- 光线步进时落在空brick里的光线直接跳到该brick的出口，只在有密度的brick里定步长采样，
+  透射率低于阈值后提前终止。
+- 方向光的透射率在每个brick的 3³ 个节点上预计算并缓存，光源不变时跨帧复用，
+  着色时三线性插值，不再逐采样点朝光源步进。
+- 每帧只取决于时间（相机和光源的环绕角度），可以按tile渲染（render_tile），
+  各帧、各tile在渲染进程池中并行。
+- 密度brick按参数预计算后写入 ASSET_CACHE_DIR，之后内存映射加载，同一任务的各个分块共用。
+
+坐标：体积占据世界空间 [-1, 1]³，y轴向上；内部计算使用网格坐标 [0, n]³。
+"""
+
+import json
+import math
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from core.config import settings
+from effects.path_tracer import RAY_BATCH, Camera
+from utils.hashing import canonical_digest
+
+# 磁盘格式版本，密度生成或数组布局变化时递增
+VOLUME_FORMAT_VERSION = 1
+
+MEDIUMS = ("cloud", "fog", "smoke")
+
+# brick边长（体素），存储时每轴多一个节点
+BRICK = 8
+BRICK_NODES = BRICK + 1
+# 每个brick上缓存透射率的节点数（每轴），节点间距 BRICK / (LIGHT_NODES - 1)
+LIGHT_NODES = 3
+
+# 低于该值的密度视为空，整个brick都低于它时不分配
+DENSITY_EPSILON = 1e-3
+# 相机光线和光照光线的步长（体素）
+VIEW_STEP = 1.0
+LIGHT_STEP = 2.0
+# 透射率低于该值时终止相机光线；光学厚度超过该值时终止光照光线
+MIN_TRANSMITTANCE = 1e-3
+MAX_OPTICAL_DEPTH = 7.0
+# 跳出空brick时越过边界的距离，避免停在边界上
+SKIP_EPSILON = 1e-3
+# 世界空间中密度为1时的消光系数倍数
+EXTINCTION_SCALE = 10.0
+NOISE_OCTAVES = 4
+
+SUN_COLOR = np.array([1.0, 0.95, 0.85], dtype=np.float32)
+SKY_TOP = np.array([0.35, 0.5, 0.8], dtype=np.float32)
+SKY_BOTTOM = np.array([0.75, 0.8, 0.85], dtype=np.float32)
+AMBIENT = 0.25
+
+# 每条光线在渲染时的临时内存，以及每个brick的常驻内存（密度 + 透射率 + 索引）
+RAY_BYTES = 256
+BRICK_BYTES = 4 * (BRICK_NODES ** 3 + LIGHT_NODES ** 3)
+
+
+def _brick_count(resolution: int) -> int:
+    return max(1, math.ceil(int(resolution) / BRICK))
+
+
+def estimate_memory(resolution: int) -> int:
+    """按分辨率预估峰值内存（字节），按所有brick都被占用计算"""
+    bricks = _brick_count(resolution) ** 3
+    slab = BRICK_NODES * (_brick_count(resolution) * BRICK + 1) ** 2
+    return bricks * (BRICK_BYTES + 4) + 4 * slab * 8 + RAY_BATCH * RAY_BYTES
+
+
+def _hash_lattice(x: np.ndarray, y: np.ndarray, z: np.ndarray, seed: int) -> np.ndarray:
+    """整数格点 -> [0, 1) 的伪随机值"""
+    h = (x.astype(np.uint32) * np.uint32(0x8DA6B343)) ^ (y.astype(np.uint32) * np.uint32(0xD8163841))
+    h ^= z.astype(np.uint32) * np.uint32(0xCB1AB31F) + np.uint32(seed * 0x9E3779B9 & 0xFFFFFFFF)
+    h ^= h >> np.uint32(13)
+    h *= np.uint32(0x5BD1E995)
+    h ^= h >> np.uint32(15)
+    return (h >> np.uint32(8)).astype(np.float32) * np.float32(1.0 / (1 << 24))
+
+
+def _value_noise(p: np.ndarray, seed: int) -> np.ndarray:
+    """三线性插值的值噪声，p为 (..., 3)"""
+    base = np.floor(p)
+    f = p - base
+    f = f * f * (3.0 - 2.0 * f)
+    i = base.astype(np.int64)
+    out = np.zeros(p.shape[:-1], dtype=np.float32)
+    for dx in (0, 1):
+        wx = f[..., 0] if dx else 1.0 - f[..., 0]
+        for dy in (0, 1):
+            wy = f[..., 1] if dy else 1.0 - f[..., 1]
+            for dz in (0, 1):
+                wz = f[..., 2] if dz else 1.0 - f[..., 2]
+                out += wx * wy * wz * _hash_lattice(i[..., 0] + dx, i[..., 1] + dy, i[..., 2] + dz, seed)
+    return out
+
+
+def _fbm(p: np.ndarray, seed: int) -> np.ndarray:
+    """分形噪声，值域 [0, 1]"""
+    total = np.zeros(p.shape[:-1], dtype=np.float32)
+    amplitude, norm = 1.0, 0.0
+    for octave in range(NOISE_OCTAVES):
+        total += amplitude * _value_noise(p * (2.0 ** octave), seed + octave)
+        norm += amplitude
+        amplitude *= 0.5
+    return total / norm
+
+
+def _cloud(p: np.ndarray, seed: int) -> np.ndarray:
+    """椭球形积云，边缘由噪声侵蚀"""
+    shape = 1.0 - np.sum((p - [0.0, 0.1, 0.0]) ** 2 / np.array([0.9, 0.5, 0.9]) ** 2, axis=-1)
+    return np.clip(shape * 1.5 + (_fbm(p * 2.5, seed) - 0.5) * 1.6 - 0.2, 0.0, 1.0)
+
+
+def _fog(p: np.ndarray, seed: int) -> np.ndarray:
+    """贴地浓雾，随高度指数衰减"""
+    height = p[..., 1] + 1.0
+    layer = np.exp(-height / 0.35) * (0.6 + 0.8 * _fbm(p * [2.0, 4.0, 2.0], seed))
+    # 水平方向在包围盒边缘淡出
+    edge = np.clip((1.0 - np.maximum(np.abs(p[..., 0]), np.abs(p[..., 2]))) * 4.0, 0.0, 1.0)
+    return np.clip(layer * edge * (height < 1.2), 0.0, 1.0)
+
+
+def _smoke(p: np.ndarray, seed: int) -> np.ndarray:
+    """从底部升起、逐渐变宽的烟柱"""
+    rise = (p[..., 1] + 1.0) * 0.5
+    radius = 0.1 + 0.35 * rise
+    sway = (_fbm(p * [1.5, 3.0, 1.5], seed + 7) - 0.5) * 0.6 * rise
+    r = np.hypot(p[..., 0] - sway, p[..., 2])
+    body = (1.0 - r / radius) * 1.5 + (_fbm(p * 4.0, seed) - 0.5) * 1.2
+    return np.clip(body * (1.0 - rise), 0.0, 1.0)
+
+
+DENSITY_FIELDS: Dict[str, Callable[[np.ndarray, int], np.ndarray]] = {
+    "cloud": _cloud,
+    "fog": _fog,
+    "smoke": _smoke,
+}
+
+
+class BrickVolume:
+    """
+    稀疏brick密度场
+
+    brick_index 是brick级的占用网格（-1为空），bricks 是 (K, 9, 9, 9) 的brick节点数据，
+    网格坐标g处的密度位于第 floor(g / 8) 个brick内，由该brick的节点三线性插值。
+    """
+
+    def __init__(self, brick_index: np.ndarray, bricks: np.ndarray):
+        self.brick_index = brick_index
+        self.bricks = bricks
+        self.bricks_per_axis = brick_index.shape[0]
+        self.n = self.bricks_per_axis * BRICK
+
+    @property
+    def occupancy(self) -> float:
+        """被占用的brick比例"""
+        return len(self.bricks) / float(self.brick_index.size)
+
+    @classmethod
+    def build(cls, medium: str, resolution: int, seed: int) -> "BrickVolume":
+        """逐层计算密度并打包成brick，同一时间只有一层brick的稠密数据"""
+        field = DENSITY_FIELDS[medium]
+        nb = _brick_count(resolution)
+        n = nb * BRICK
+        axis = (np.arange(n + 1, dtype=np.float32) * np.float32(2.0 / n) - 1.0)
+        brick_index = np.full((nb, nb, nb), -1, dtype=np.int32)
+        bricks = []
+        for bx in range(nb):
+            xs = axis[bx * BRICK: bx * BRICK + BRICK_NODES]
+            p = np.stack(np.meshgrid(xs, axis, axis, indexing="ij"), axis=-1)
+            slab = field(p, seed).astype(np.float32)
+            slab[slab < DENSITY_EPSILON] = 0.0
+            for by in range(nb):
+                for bz in range(nb):
+                    brick = slab[:, by * BRICK: by * BRICK + BRICK_NODES, bz * BRICK: bz * BRICK + BRICK_NODES]
+                    if brick.max() >= DENSITY_EPSILON:
+                        brick_index[bx, by, bz] = len(bricks)
+                        bricks.append(brick.copy())
+        data = np.stack(bricks) if bricks else np.zeros((0,) + (BRICK_NODES,) * 3, dtype=np.float32)
+        return cls(brick_index, data)
+
+    def save(self, directory: Path):
+        """原子地写入磁盘，每个数组一个 .npy 文件以便内存映射"""
+        directory = Path(directory)
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=directory.parent, prefix=".volume-"))
+        try:
+            np.save(tmp_dir / "brick_index.npy", self.brick_index)
+            np.save(tmp_dir / "bricks.npy", self.bricks)
+            with open(tmp_dir / "meta.json", "w", encoding="utf-8") as fh:
+                json.dump({
+                    "version": VOLUME_FORMAT_VERSION,
+                    "resolution": self.n,
+                    "bricks": len(self.bricks),
+                }, fh)
+            os.replace(tmp_dir, directory)
+        except OSError:
+            # 另一个进程已经写好了同一份brick
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not (directory / "meta.json").exists():
+                raise
+
+    @classmethod
+    def load(cls, directory: Path) -> "BrickVolume":
+        """以只读内存映射方式加载"""
+        directory = Path(directory)
+        return cls(
+            np.load(directory / "brick_index.npy"),
+            np.load(directory / "bricks.npy", mmap_mode="r"),
+        )
+
+    def lookup(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """网格坐标 -> (brick序号，空brick为-1；brick内的局部坐标 [0, 8])"""
+        cell = np.clip(np.floor(points / BRICK), 0, self.bricks_per_axis - 1).astype(np.int64)
+        index = self.brick_index[cell[:, 0], cell[:, 1], cell[:, 2]]
+        return index, points - cell * BRICK
+
+    def sample(self, points: np.ndarray) -> np.ndarray:
+        """网格坐标处的密度"""
+        index, local = self.lookup(points)
+        return _sample_bricks(self.bricks, index, local, BRICK_NODES, 1.0)
+
+    def intersect(self, origins: np.ndarray, directions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """网格坐标下光线与体积包围盒的 (进入, 离开) 距离，未命中时进入 >= 离开"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv = 1.0 / directions
+            t0 = (0.0 - origins) * inv
+            t1 = (self.n - origins) * inv
+        # 平行于某个轴的光线：在板内则该轴不限制，否则不相交
+        parallel = directions == 0
+        inside = (origins >= 0) & (origins <= self.n)
+        t0 = np.where(parallel, np.where(inside, -np.inf, np.inf), t0)
+        t1 = np.where(parallel, np.where(inside, np.inf, -np.inf), t1)
+        near = np.maximum(np.minimum(t0, t1).max(axis=1), 0.0)
+        far = np.maximum(t0, t1).min(axis=1)
+        return near, far
+
+    def march(
+        self,
+        origins: np.ndarray,
+        directions: np.ndarray,
+        near: np.ndarray,
+        far: np.ndarray,
+        step: float,
+        visit: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray],
+    ):
+        """
+        带空域跳过的光线步进
+
+        位于空brick的光线跳到该brick的出口，位于被占用brick的光线前进一个步长，
+        并以 (光线序号, 步长中点, 步长) 调用visit，visit返回哪些光线继续步进。
+        每轮只保留仍在体积内的活跃光线。
+        """
+        with np.errstate(divide="ignore"):
+            inv = np.where(directions != 0, 1.0 / directions, np.inf)
+        rows = np.flatnonzero(near < far)
+        t = near[rows]
+        while rows.size:
+            o, d = origins[rows], directions[rows]
+            points = o + d * t[:, None]
+            index, local = self.lookup(points)
+            occupied = index >= 0
+
+            # 空brick：到该brick各轴出口面的最小距离
+            cell_origin = points - local
+            boundary = cell_origin + np.where(d > 0, BRICK, 0.0)
+            with np.errstate(invalid="ignore"):
+                exit_t = np.where(d != 0, (boundary - o) * inv[rows], np.inf).min(axis=1)
+            limit = far[rows]
+            next_t = np.where(occupied, t + step, np.maximum(exit_t, t) + SKIP_EPSILON)
+
+            alive = next_t < limit
+            hits = np.flatnonzero(occupied)
+            if hits.size:
+                dt = np.minimum(step, limit[hits] - t[hits])
+                mid = o[hits] + d[hits] * (t[hits] + 0.5 * dt)[:, None]
+                alive[hits] &= visit(rows[hits], mid, dt)
+            rows, t = rows[alive], next_t[alive]
+
+
+def _sample_bricks(
+    data: np.ndarray, index: np.ndarray, local: np.ndarray, nodes: int, spacing: float
+) -> np.ndarray:
+    """在 (K, nodes, nodes, nodes) 的brick数据上三线性插值，空brick（index为-1）返回0"""
+    valid = index >= 0
+    scaled = np.clip(local / spacing, 0.0, nodes - 1)
+    i0 = np.minimum(scaled.astype(np.int64), nodes - 2)
+    f = (scaled - i0).astype(np.float32)
+    base = np.where(valid, index, 0) * nodes ** 3 + (i0[:, 0] * nodes + i0[:, 1]) * nodes + i0[:, 2]
+    flat = data.reshape(-1)
+    out = np.zeros(len(index), dtype=np.float32)
+    for dx in (0, 1):
+        wx = f[:, 0] if dx else 1.0 - f[:, 0]
+        for dy in (0, 1):
+            wy = f[:, 1] if dy else 1.0 - f[:, 1]
+            for dz in (0, 1):
+                wz = f[:, 2] if dz else 1.0 - f[:, 2]
+                out += wx * wy * wz * flat[base + (dx * nodes + dy) * nodes + dz]
+    return out * valid
+
+
+def load_volume(medium: str, resolution: int, seed: int) -> BrickVolume:
+    """读取密度brick：已缓存则直接内存映射，否则生成后写入缓存"""
+    if medium not in DENSITY_FIELDS:
+        raise ValueError(f"Unsupported volumetric medium: {medium}")
+    key = canonical_digest({"medium": medium, "resolution": _brick_count(resolution), "seed": seed})
+    cache_dir = (
+        settings.BASE_DIR / settings.ASSET_CACHE_DIR / "volume"
+        / f"{key}-v{VOLUME_FORMAT_VERSION}"
+    )
+    if not (cache_dir / "meta.json").exists():
+        logger.info(f"☁️ 生成体积密度brick: {medium} ({_brick_count(resolution) * BRICK}³)")
+        BrickVolume.build(medium, resolution, seed).save(cache_dir)
+    return BrickVolume.load(cache_dir)
+
+
+class VolumeRenderer:
+    """
+    体积特效
+
+    参数：medium（cloud/fog/smoke）、resolution（每轴体素数，向上取整到8的倍数）、
+    density（密度倍数）、absorption、scattering、anisotropy（Henyey-Greenstein相函数g）、
+    light_intensity、orbit（相机每秒环绕角度）、light_orbit（光源每秒环绕角度，0为静止光源）。
+    """
+
+    def __init__(
+        self,
+        medium: str = "cloud",
+        resolution: int = 128,
+        density: float = 1.0,
+        absorption: float = 0.1,
+        scattering: float = 0.2,
+        anisotropy: float = 0.3,
+        light_intensity: float = 2.0,
+        orbit: float = 10.0,
+        light_orbit: float = 0.0,
+        seed: int = 0,
+    ):
+        self.volume = load_volume(str(medium), int(resolution), int(seed))
+        extinction = (float(absorption) + float(scattering)) * float(density) * EXTINCTION_SCALE
+        # 网格坐标下每单位长度的消光系数
+        self.sigma_t = np.float32(extinction * 2.0 / self.volume.n)
+        self.albedo = float(scattering) / max(float(absorption) + float(scattering), 1e-6)
+        self.anisotropy = float(np.clip(anisotropy, -0.95, 0.95))
+        self.light_intensity = float(light_intensity)
+        self.orbit = float(orbit)
+        self.light_orbit = float(light_orbit)
+        self.camera = Camera(
+            position=np.array([0.0, 0.3, 2.8], dtype=np.float32),
+            look_at=np.array([0.0, -0.1, 0.0], dtype=np.float32),
+            up=np.array([0.0, 1.0, 0.0], dtype=np.float32),
+            fov=45.0,
+        )
+        self.time = 0.0
+        self.last_samples = 0
+        # 透射率缓存：光源方向 -> 每个brick的 (3, 3, 3) 节点透射率
+        self._light_key: Optional[Tuple[float, ...]] = None
+        self._light_transmittance: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_parameters(cls, parameters: Dict[str, Any], seed: int = 0) -> "VolumeRenderer":
+        """按特效参数创建"""
+        known = (
+            "medium", "resolution", "density", "absorption", "scattering",
+            "anisotropy", "light_intensity", "orbit", "light_orbit",
+        )
+        return cls(seed=seed, **{k: parameters[k] for k in known if k in parameters})
+
+    def light_direction(self) -> np.ndarray:
+        """指向光源的单位向量"""
+        angle = math.radians(35.0 + self.light_orbit * self.time)
+        direction = np.array([math.cos(angle), 0.9, math.sin(angle)], dtype=np.float32)
+        return direction / np.linalg.norm(direction)
+
+    def step(self, dt: float):
+        """推进时间：相机和光源按各自的角速度环绕"""
+        self.time += dt
+
+    def _light_cache(self, light: np.ndarray) -> np.ndarray:
+        """每个brick节点到光源的透射率，光源方向不变时直接复用"""
+        key = tuple(np.round(light, 6).tolist())
+        if key == self._light_key:
+            return self._light_transmittance
+
+        volume = self.volume
+        spacing = BRICK / (LIGHT_NODES - 1)
+        offsets = np.stack(np.meshgrid(*(np.arange(LIGHT_NODES) * spacing,) * 3, indexing="ij"), -1)
+        # argwhere按C顺序返回，与build时分配brick序号的顺序一致
+        corners = np.argwhere(volume.brick_index >= 0)
+        origins = (corners[:, None, :] * BRICK + offsets.reshape(1, -1, 3)).reshape(-1, 3)
+        origins = origins.astype(np.float32)
+        directions = np.broadcast_to(light, origins.shape).astype(np.float32)
+        depth = np.zeros(len(origins), dtype=np.float32)
+
+        def accumulate(rows, points, dt):
+            depth[rows] += volume.sample(points) * self.sigma_t * dt
+            return depth[rows] < MAX_OPTICAL_DEPTH
+
+        for start in range(0, len(origins), RAY_BATCH):
+            batch = slice(start, start + RAY_BATCH)
+            o, d = origins[batch], directions[batch]
+            near, far = volume.intersect(o, d)
+            volume.march(o, d, near, far, LIGHT_STEP, lambda r, p, dt: accumulate(r + start, p, dt))
+
+        self._light_key = key
+        self._light_transmittance = np.exp(-depth).reshape((-1,) + (LIGHT_NODES,) * 3)
+        return self._light_transmittance
+
+    def render(self, width: int, height: int) -> np.ndarray:
+        """单次散射的光线步进，返回 (h, w, 3) 线性图像"""
+        # 每帧固定种子的步进起点抖动，把条带伪影变成噪声
+        rng = np.random.default_rng([int(round(self.time * 1e6)), width, height])
+        return self._render_pixels(width, height, (0, 0, width, height), rng)
+
+    def render_tile(
+        self, width: int, height: int, tile: Tuple[int, int, int, int],
+        cancel: Optional[Callable[[], None]] = None,
+    ) -> np.ndarray:
+        """
+        渲染整帧中的一个tile，返回 (h, w, 3) 线性图像
+
+        抖动种子包含tile位置，同一个tile重复渲染得到相同的结果。cancel 在每批光线之前调用，
+        抛出异常即中止。
+        """
+        x0, y0 = tile[0], tile[1]
+        rng = np.random.default_rng([int(round(self.time * 1e6)), width, height, x0, y0])
+        return self._render_pixels(width, height, tile, rng, cancel)
+
+    def _render_pixels(
+        self, width: int, height: int, tile: Tuple[int, int, int, int], rng: np.random.Generator,
+        cancel: Optional[Callable[[], None]] = None,
+    ) -> np.ndarray:
+        volume = self.volume
+        light = self.light_direction()
+        transmittance_to_light = self._light_cache(light)
+        camera = self.camera.orbit(self.orbit * self.time)
+        light_spacing = BRICK / (LIGHT_NODES - 1)
+        sun = SUN_COLOR * np.float32(self.light_intensity)
+        g = self.anisotropy
+
+        x0, y0, x1, y1 = tile
+        count = (x1 - x0) * (y1 - y0)
+        py, px = np.mgrid[y0:y1, x0:x1]
+        px = px.ravel().astype(np.float32) + 0.5
+        py = py.ravel().astype(np.float32) + 0.5
+        pixels = np.empty((count, 3), dtype=np.float32)
+        self.last_samples = 0
+
+        for start in range(0, count, RAY_BATCH):
+            if cancel is not None:
+                cancel()
+            stop = min(start + RAY_BATCH, count)
+            origins, directions = camera.generate_rays(px[start:stop], py[start:stop], width, height)
+            sky_t = (0.5 * (directions[:, 1] + 1.0))[:, None]
+            background = (1.0 - sky_t) * SKY_BOTTOM + sky_t * SKY_TOP
+            origins = (origins + 1.0) * np.float32(volume.n * 0.5)
+
+            # Henyey-Greenstein相函数（各向同性时为1），cosθ为视线方向与光源方向的夹角余弦
+            cos_theta = directions @ light
+            phase = (1.0 - g * g) / (1.0 + g * g - 2.0 * g * cos_theta) ** 1.5
+            direct = sun[None, :] * phase[:, None].astype(np.float32)
+            ambient = background * np.float32(AMBIENT)
+
+            radiance = np.zeros((stop - start, 3), dtype=np.float32)
+            transmittance = np.ones(stop - start, dtype=np.float32)
+
+            def shade(rows, points, dt):
+                density = volume.sample(points)
+                index, local = volume.lookup(points)
+                lit = _sample_bricks(transmittance_to_light, index, local, LIGHT_NODES, light_spacing)
+                source = (direct[rows] * lit[:, None] + ambient[rows]) * np.float32(self.albedo)
+                absorbed = 1.0 - np.exp(-density * self.sigma_t * dt)
+                radiance[rows] += (transmittance[rows] * absorbed)[:, None] * source
+                transmittance[rows] *= 1.0 - absorbed
+                self.last_samples += len(rows)
+                return transmittance[rows] > MIN_TRANSMITTANCE
+
+            near, far = volume.intersect(origins, directions)
+            near = near + VIEW_STEP * rng.random(len(near))
+            volume.march(origins, directions, near, far, VIEW_STEP, shade)
+            pixels[start:stop] = radiance + transmittance[:, None] * background
+
+        return pixels.reshape(y1 - y0, x1 - x0, 3)
+
+    def state_dict(self) -> Dict[str, np.ndarray]:
+        """可序列化的完整状态；密度brick和透射率缓存可由参数重建"""
+        return {"time": np.float64(self.time)}
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        """从 state_dict 恢复"""
+        self.time = float(state["time"])
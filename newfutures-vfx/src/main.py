@@ -6,16 +6,20 @@ import asyncio
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
-import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from loguru import logger
 
 from core.config import settings
-from core.database import init_db
-from core.redis_client import init_redis
+from core.redis_client import close_redis, init_redis
+from services.catalog import catalog
+from services.hardware import init_hardware
+from services.metrics import CONTENT_TYPE_LATEST, MetricsMiddleware, render_metrics
+from services.render_history import database
+from services.render_queue import init_render_queue, shutdown_render_queue
+from services.static_assets import build_static, static_assets
 from api import router as api_router
+from utils.json_response import FastJSONResponse
 from utils.logger import setup_logger
 
 
@@ -30,14 +34,28 @@ async def lifespan(app: FastAPI) -> AsyncGenerator:
     # 设置日志
     setup_logger()
     
-    # 初始化数据库
-    await init_db()
-    logger.info("✅ Database initialized")
+    # 创建数据目录
+    settings.ensure_directories()
+    
+    # 数据库在后台连接，不推迟服务就绪（首次读写渲染历史时等待）
+    database.start()
     
     # 初始化Redis
     await init_redis()
     logger.info("✅ Redis initialized")
     
+    # 探测硬件，渲染进程数和能力信息使用实测值
+    await init_hardware()
+    catalog.refresh()
+    logger.info("✅ Hardware probed")
+    
+    # 启动渲染队列
+    await init_render_queue()
+    logger.info("✅ Render queue started")
+    
+    # 构建静态资源（内容未变的文件直接复用上次的构建结果）
+    await asyncio.to_thread(static_assets.load)
+    
     # 启动后台任务
     # asyncio.create_task(start_background_tasks())
     
@@ -47,6 +65,9 @@ async def lifespan(app: FastAPI) -> AsyncGenerator:
     
     # 关闭时的清理
     logger.info("🔄 Shutting down NewFutures VFX Platform...")
+    await shutdown_render_queue()
+    await close_redis()
+    await database.close()
     # await cleanup_resources()
     logger.info("👋 Goodbye!")
 
@@ -63,6 +84,7 @@ def create_app() -> FastAPI:
         redoc_url="/api/redoc",
         openapi_url="/api/openapi.json",
         lifespan=lifespan,
+        default_response_class=FastJSONResponse,
     )
     
     # CORS中间件配置 - 完整配置
@@ -76,8 +98,11 @@ def create_app() -> FastAPI:
         max_age=3600,
     )
     
-    # 静态文件服务
-    app.mount("/static", StaticFiles(directory="public"), name="static")
+    # 请求延迟和计数指标，放在最外层以计入所有中间件的耗时
+    app.add_middleware(MetricsMiddleware)
+    
+    # 静态文件服务：带指纹的预压缩资源
+    app.mount("/static", static_assets, name="static")
     
     # 注册路由
     app.include_router(api_router, prefix="/api/v1")
@@ -91,6 +116,17 @@ def create_app() -> FastAPI:
             "version": "0.1.0"
         }
     
+    # Prometheus指标
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+    
+    # Web客户端入口页面
+    @app.get("/", include_in_schema=False)
+    async def index(request: Request):
+        await static_assets.check_config()
+        return await static_assets.get_response("index.html", request.scope)
+    
     # CORS预检请求处理
     @app.options("/")
     async def options_root():
@@ -113,6 +149,18 @@ def run_server():
     """
     启动服务器
     """
+    import sys
+
+    import uvicorn
+    
+    # 渲染任务只存在于接收它的进程的队列里，多个uvicorn进程会各自持有一份队列：
+    # 进度和取消请求落到其他进程时找不到任务，重启后每个进程都会恢复并重复渲染
+    if settings.WORKERS > 1:
+        logger.error(
+            f"❌ WORKERS={settings.WORKERS}: 渲染队列运行在API进程内，只能使用1个工作进程；"
+            "渲染吞吐量请通过渲染农场节点（main.py worker）扩展"
+        )
+        sys.exit(1)
     uvicorn.run(
         "src.main:app",
         host=settings.HOST,
@@ -137,6 +185,9 @@ def main():
         elif command == "worker":
             from worker import run_worker
             run_worker()
+        elif command == "build-static":
+            manifest = build_static(settings.BASE_DIR / settings.STATIC_DIR, static_assets.build_dir)
+            logger.info(f"📦 Built {len(manifest)} static assets into {static_assets.build_dir}")
         elif command == "migrate":
             from core.database import run_migrations
             asyncio.run(run_migrations())
@@ -0,0 +1,71 @@
+"""
+目录类文档缓存
+
+特效列表、特效参数、渲染预设和渲染器能力这类文档只在启动或配置变化时改变，
+却在每次页面加载时被请求。注册时序列化一次并计算ETag，请求时直接返回缓存的
+字节；客户端带着匹配的 If-None-Match 时返回304，不发送正文。
+"""
+
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from utils.file_response import etag_matches
+from utils.json_response import dumps
+
+
+@dataclass(frozen=True)
+class CatalogDocument:
+    """序列化好的文档"""
+
+    body: bytes
+    etag: str
+
+
+class Catalog:
+    """按名称登记的只读JSON文档"""
+
+    def __init__(self):
+        self._documents: Dict[str, CatalogDocument] = {}
+        self._builders: Dict[str, Callable[[], Any]] = {}
+
+    def register(self, name: str, content: Any) -> CatalogDocument:
+        """登记（或替换）文档；内容变化后重新登记即可，ETag随之改变"""
+        body = dumps(content)
+        document = CatalogDocument(body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        self._documents[name] = document
+        return document
+
+    def register_builder(self, name: str, builder: Callable[[], Any]):
+        """登记由函数生成的文档，第一次请求时生成，refresh 时重新生成"""
+        self._builders[name] = builder
+        self._documents.pop(name, None)
+
+    def refresh(self):
+        """重新生成所有由函数生成的文档（依赖的数据变化后调用）"""
+        for name, builder in self._builders.items():
+            self.register(name, builder())
+
+    def get(self, name: str) -> Optional[CatalogDocument]:
+        document = self._documents.get(name)
+        if document is None and name in self._builders:
+            document = self.register(name, self._builders[name]())
+        return document
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._documents or name in self._builders
+
+    def response(self, request: Request, name: str) -> Response:
+        """返回文档，If-None-Match 匹配时返回304"""
+        document = self.get(name)
+        headers = {"ETag": document.etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, document.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(document.body, media_type="application/json", headers=headers)
+
+
+catalog = Catalog()
@@ -0,0 +1,473 @@
+"""
+渲染农场任务分发
+
+非模拟任务在配置了 RENDER_FARM_URL 时不在本机进程池渲染，而是切成工作单元发布到
+代理（broker）上，由各节点的 `main.py worker` 领取：多帧任务按帧段切分，单帧任务按
+tile切分。单元里的条目是 [帧, tile序号]，整帧条目的tile序号为 WHOLE_FRAME。
+
+- 领取：节点从队列中按优先级取出一个单元并获得租约，渲染期间定期心跳续约；
+  租约到期（节点宕机或失联）的单元在下一次领取时重新入队，从未完成的位置继续。
+- 汇报：每完成一个条目汇报一次，代理记录完成条目并返回该单元当前的末位置；
+  单元被拆分后末位置变小，节点据此提前结束。汇报返回 None 表示单元已经不属于该节点
+  （租约被接管或任务已取消），节点应立即放弃。
+- 窃取：队列空了的节点从剩余条目最多的租约单元尾部拆走一半，慢节点上积压的帧段
+  由空闲节点分担，整个任务的完成时间不被最慢的节点拖长。
+- 汇总：API进程定期取走各任务已完成的条目（附带实际花费的像素采样数），写入渲染缓存
+  和任务进度。
+
+RedisBroker 用Lua脚本保证领取、汇报、窃取的原子性；LocalBroker 是接口相同的进程内
+实现，local://host:port 时由API进程通过 multiprocessing 管理器在TCP上提供，
+用于单机多进程的开发和测试。帧输出和帧缓冲写在 RENDER_OUTPUT_DIR 中，各节点需要
+共享这个目录。
+"""
+
+import functools
+import heapq
+import itertools
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.config import settings
+
+# 整帧条目的tile序号
+WHOLE_FRAME = -1
+
+# 汇报时表示只续约、没有完成条目的位置
+HEARTBEAT = -1
+
+# 代理记录的任务错误保留时间（秒）
+ERROR_TTL = 24 * 3600
+
+Item = List[int]
+
+UNIT_KEY = "farm:unit:"
+TASK_KEY = "farm:task:"
+DONE_KEY = "farm:done:"
+ERROR_KEY = "farm:error:"
+QUEUE_KEY = "farm:queue"
+LEASES_KEY = "farm:leases"
+SEQ_KEY = "farm:seq"
+
+# 当前时间（毫秒），各节点以Redis服务器时钟为准
+_NOW = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+"""
+
+# 单元的完整内容：id, task_id, spec, items, next, last
+_UNIT = """
+local function unit(id, key)
+    local fields = redis.call('HMGET', key, 'task_id', 'spec', 'items', 'next', 'last')
+    return {id, fields[1], fields[2], fields[3], fields[4], fields[5]}
+end
+"""
+
+# 领取：KEYS = 队列, 租约；ARGV = 节点, 租约毫秒, 单元键前缀
+# 先把租约到期的单元放回队列，再按分数取出最靠前的单元
+CLAIM_SCRIPT = _NOW + _UNIT + """
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    redis.call('ZREM', KEYS[2], id)
+    local score = redis.call('HGET', ARGV[3] .. id, 'score')
+    if score then
+        redis.call('HSET', ARGV[3] .. id, 'owner', '')
+        redis.call('ZADD', KEYS[1], score, id)
+    end
+end
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then
+    return false
+end
+local key = ARGV[3] .. popped[1]
+redis.call('HSET', key, 'owner', ARGV[1])
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), popped[1])
+return unit(popped[1], key)
+"""
+
+# 汇报/心跳：KEYS = 租约；ARGV = 节点, 单元id, 位置（-1为心跳）, 租约毫秒, 单元键前缀, 完成列表前缀,
+# 采样数；完成列表中的条目为 [帧, tile序号, 采样数]
+# 返回单元当前的末位置，单元不属于该节点时返回-1
+REPORT_SCRIPT = _NOW + """
+local key = ARGV[5] .. ARGV[2]
+if redis.call('HGET', key, 'owner') ~= ARGV[1] then
+    return -1
+end
+local position = tonumber(ARGV[3])
+if position >= 0 then
+    local item = cjson.decode(redis.call('HGET', key, 'items'))[position + 1]
+    item[3] = tonumber(ARGV[7])
+    redis.call('RPUSH', ARGV[6] .. redis.call('HGET', key, 'task_id'), cjson.encode(item))
+    redis.call('HSET', key, 'next', position + 1)
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[4]), ARGV[2])
+return tonumber(redis.call('HGET', key, 'last'))
+"""
+
+# 窃取：KEYS = 租约, 序号；ARGV = 节点, 租约毫秒, 单元键前缀, 任务键前缀
+# 在其他节点持有的有效租约中找剩余条目最多的单元，把尾部一半拆成新单元交给该节点
+STEAL_SCRIPT = _NOW + _UNIT + """
+local victim, victim_key, stealable = nil, nil, 0
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], now, '+inf')) do
+    local key = ARGV[3] .. id
+    local fields = redis.call('HMGET', key, 'owner', 'next', 'last')
+    if fields[1] and fields[1] ~= '' and fields[1] ~= ARGV[1] then
+        local count = tonumber(fields[3]) - tonumber(fields[2])
+        if count > stealable then
+            victim, victim_key, stealable = id, key, count
+        end
+    end
+end
+if not victim then
+    return false
+end
+local fields = redis.call('HMGET', victim_key, 'task_id', 'spec', 'items', 'score', 'last')
+local last = tonumber(fields[5])
+local split = last - math.floor((stealable + 1) / 2) + 1
+redis.call('HSET', victim_key, 'last', split - 1)
+local id = fields[1] .. ':' .. redis.call('INCR', KEYS[2])
+local key = ARGV[3] .. id
+redis.call('HSET', key, 'task_id', fields[1], 'spec', fields[2], 'items', fields[3],
+    'score', fields[4], 'next', split, 'last', last, 'owner', ARGV[1])
+redis.call('SADD', ARGV[4] .. fields[1], id)
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), id)
+return unit(id, key)
+"""
+
+# 完成释放：KEYS = 租约；ARGV = 节点, 单元id, 单元键前缀, 任务键前缀
+RELEASE_SCRIPT = """
+local key = ARGV[3] .. ARGV[2]
+local fields = redis.call('HMGET', key, 'owner', 'task_id')
+if fields[1] ~= ARGV[1] then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[2])
+redis.call('DEL', key)
+redis.call('SREM', ARGV[4] .. fields[2], ARGV[2])
+return 1
+"""
+
+# 取消任务的全部单元：KEYS = 队列, 租约；ARGV = 单元键前缀, 任务键, 完成列表键, 错误键,
+# 错误信息（空串表示取消）, 节点, 单元id（节点非空时只有该单元的持有者可以让任务失败）
+# 返回删除的单元数
+CANCEL_SCRIPT = """
+if ARGV[6] ~= '' and redis.call('HGET', ARGV[1] .. ARGV[7], 'owner') ~= ARGV[6] then
+    return -1
+end
+local ids = redis.call('SMEMBERS', ARGV[2])
+for _, id in ipairs(ids) do
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('DEL', ARGV[1] .. id)
+end
+redis.call('DEL', ARGV[2])
+if ARGV[5] ~= '' then
+    redis.call('SET', ARGV[4], ARGV[5], 'EX', %d)
+else
+    redis.call('DEL', ARGV[3], ARGV[4])
+end
+return #ids
+""" % ERROR_TTL
+
+
+def _unit(fields) -> Optional[Dict[str, Any]]:
+    """脚本返回的 [id, task_id, spec, items, next, last] 转成单元字典"""
+    if not fields:
+        return None
+    unit_id, task_id, spec, items, next_position, last = fields
+    return {
+        "unit_id": unit_id,
+        "task_id": task_id,
+        **json.loads(spec),
+        "items": json.loads(items),
+        "next": int(next_position),
+        "last": int(last),
+    }
+
+
+class RedisBroker:
+    """基于Redis的代理，节点和API进程各自持有同步客户端（API进程在线程中调用）"""
+
+    backend = "redis"
+
+    def __init__(self, url: str):
+        from redis import Redis
+
+        self.client = Redis.from_url(url, decode_responses=True)
+        self._claim = self.client.register_script(CLAIM_SCRIPT)
+        self._report = self.client.register_script(REPORT_SCRIPT)
+        self._steal = self.client.register_script(STEAL_SCRIPT)
+        self._release = self.client.register_script(RELEASE_SCRIPT)
+        self._cancel = self.client.register_script(CANCEL_SCRIPT)
+
+    def ping(self) -> bool:
+        return self.client.ping()
+
+    def submit(self, task_id: str, priority: int, spec: Dict[str, Any], chunks: List[List[Item]]):
+        """发布任务的工作单元，替换该任务之前发布的单元（重启后重新提交）"""
+        self.cancel(task_id)
+        base = self.client.incrby(SEQ_KEY, len(chunks)) - len(chunks)
+        encoded = json.dumps(spec, ensure_ascii=False)
+        with self.client.pipeline(transaction=True) as pipe:
+            for offset, items in enumerate(chunks):
+                unit_id = f"{task_id}:{base + offset}"
+                score = priority * 1e12 + base + offset
+                pipe.hset(UNIT_KEY + unit_id, mapping={
+                    "task_id": task_id, "spec": encoded, "items": json.dumps(items),
+                    "score": score, "next": 0, "last": len(items) - 1, "owner": "",
+                })
+                pipe.sadd(TASK_KEY + task_id, unit_id)
+                pipe.zadd(QUEUE_KEY, {unit_id: score})
+            pipe.execute()
+
+    def claim(self, node: str, lease: float) -> Optional[Dict[str, Any]]:
+        """领取优先级最高的排队单元"""
+        return _unit(self._claim(keys=[QUEUE_KEY, LEASES_KEY], args=[node, int(lease * 1000), UNIT_KEY]))
+
+    def steal(self, node: str, lease: float) -> Optional[Dict[str, Any]]:
+        """从其他节点的单元拆走尾部一半"""
+        return _unit(self._steal(
+            keys=[LEASES_KEY, SEQ_KEY], args=[node, int(lease * 1000), UNIT_KEY, TASK_KEY]
+        ))
+
+    def report(
+        self, node: str, unit_id: str, position: int, lease: float, samples: int = 0
+    ) -> Optional[int]:
+        """第position个条目完成（花费了samples个像素采样）并续约，返回单元当前的末位置"""
+        last = self._report(
+            keys=[LEASES_KEY],
+            args=[node, unit_id, position, int(lease * 1000), UNIT_KEY, DONE_KEY, samples],
+        )
+        return None if last < 0 else last
+
+    def heartbeat(self, node: str, unit_id: str, lease: float) -> Optional[int]:
+        """只续约"""
+        return self.report(node, unit_id, HEARTBEAT, lease)
+
+    def release(self, node: str, unit_id: str):
+        """单元全部完成"""
+        self._release(keys=[LEASES_KEY], args=[node, unit_id, UNIT_KEY, TASK_KEY])
+
+    def fail(self, node: str, unit_id: str, task_id: str, error: str):
+        """单元渲染出错：记录错误并撤下该任务的全部单元"""
+        self._drop(task_id, error, node, unit_id)
+
+    def cancel(self, task_id: str) -> int:
+        """撤下任务的全部单元，返回撤下的单元数"""
+        return self._drop(task_id, "", "", "")
+
+    def _drop(self, task_id: str, error: str, node: str, unit_id: str) -> int:
+        return self._cancel(
+            keys=[QUEUE_KEY, LEASES_KEY],
+            args=[UNIT_KEY, TASK_KEY + task_id, DONE_KEY + task_id, ERROR_KEY + task_id,
+                  error, node, unit_id],
+        )
+
+    def collect(self, task_ids: List[str]) -> Dict[str, Tuple[List[Item], Optional[str]]]:
+        """一次往返取走各任务已完成的条目和错误"""
+        with self.client.pipeline(transaction=True) as pipe:
+            for task_id in task_ids:
+                pipe.lrange(DONE_KEY + task_id, 0, -1)
+                pipe.delete(DONE_KEY + task_id)
+                pipe.get(ERROR_KEY + task_id)
+                pipe.delete(ERROR_KEY + task_id)
+            results = pipe.execute()
+        collected = {}
+        for index, task_id in enumerate(task_ids):
+            done, _, error, _ = results[4 * index: 4 * index + 4]
+            collected[task_id] = ([json.loads(item) for item in done], error)
+        return collected
+
+
+class LocalBroker:
+    """进程内代理，接口与 RedisBroker 相同；由 FarmManager 提供给其他进程时各方法在线程中执行"""
+
+    backend = "local"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._units: Dict[str, Dict[str, Any]] = {}
+        self._queue: List[Tuple[float, str]] = []
+        self._tasks: Dict[str, set] = {}
+        self._done: Dict[str, List[Item]] = {}
+        self._errors: Dict[str, str] = {}
+
+    def ping(self) -> bool:
+        return True
+
+    @staticmethod
+    def _view(unit_id: str, unit: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "unit_id": unit_id, "task_id": unit["task_id"], **unit["spec"],
+            "items": unit["items"], "next": unit["next"], "last": unit["last"],
+        }
+
+    def _lease(self, unit: Dict[str, Any], node: str, lease: float):
+        unit["owner"] = node
+        unit["deadline"] = time.monotonic() + lease
+
+    def submit(self, task_id: str, priority: int, spec: Dict[str, Any], chunks: List[List[Item]]):
+        self.cancel(task_id)
+        with self._lock:
+            ids = self._tasks.setdefault(task_id, set())
+            for items in chunks:
+                seq = next(self._seq)
+                unit_id = f"{task_id}:{seq}"
+                score = priority * 1e12 + seq
+                self._units[unit_id] = {
+                    "task_id": task_id, "spec": spec, "items": items, "score": score,
+                    "next": 0, "last": len(items) - 1, "owner": None, "deadline": 0.0,
+                }
+                ids.add(unit_id)
+                heapq.heappush(self._queue, (score, unit_id))
+
+    def claim(self, node: str, lease: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            now = time.monotonic()
+            for unit_id, unit in self._units.items():
+                if unit["owner"] is not None and unit["deadline"] <= now:
+                    unit["owner"] = None
+                    heapq.heappush(self._queue, (unit["score"], unit_id))
+            while self._queue:
+                _, unit_id = heapq.heappop(self._queue)
+                unit = self._units.get(unit_id)
+                # 已撤下或重复入队的条目
+                if unit is None or unit["owner"] is not None:
+                    continue
+                self._lease(unit, node, lease)
+                return self._view(unit_id, unit)
+            return None
+
+    def steal(self, node: str, lease: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            now = time.monotonic()
+            victim, stealable = None, 0
+            for unit_id, unit in self._units.items():
+                if unit["owner"] in (None, node) or unit["deadline"] <= now:
+                    continue
+                count = unit["last"] - unit["next"]
+                if count > stealable:
+                    victim, stealable = unit, count
+            if victim is None:
+                return None
+            split = victim["last"] - (stealable + 1) // 2 + 1
+            unit_id = f"{victim['task_id']}:{next(self._seq)}"
+            unit = {**victim, "next": split}
+            victim["last"] = split - 1
+            self._lease(unit, node, lease)
+            self._units[unit_id] = unit
+            self._tasks[unit["task_id"]].add(unit_id)
+            return self._view(unit_id, unit)
+
+    def report(
+        self, node: str, unit_id: str, position: int, lease: float, samples: int = 0
+    ) -> Optional[int]:
+        with self._lock:
+            unit = self._units.get(unit_id)
+            if unit is None or unit["owner"] != node:
+                return None
+            if position >= 0:
+                self._done.setdefault(unit["task_id"], []).append([*unit["items"][position], samples])
+                unit["next"] = position + 1
+            unit["deadline"] = time.monotonic() + lease
+            return unit["last"]
+
+    def heartbeat(self, node: str, unit_id: str, lease: float) -> Optional[int]:
+        return self.report(node, unit_id, HEARTBEAT, lease)
+
+    def release(self, node: str, unit_id: str):
+        with self._lock:
+            unit = self._units.get(unit_id)
+            if unit is None or unit["owner"] != node:
+                return
+            del self._units[unit_id]
+            self._tasks.get(unit["task_id"], set()).discard(unit_id)
+
+    def fail(self, node: str, unit_id: str, task_id: str, error: str):
+        with self._lock:
+            unit = self._units.get(unit_id)
+            if unit is None or unit["owner"] != node:
+                return
+            self._drop(task_id)
+            self._errors[task_id] = error
+
+    def cancel(self, task_id: str) -> int:
+        with self._lock:
+            self._done.pop(task_id, None)
+            self._errors.pop(task_id, None)
+            return self._drop(task_id)
+
+    def _drop(self, task_id: str) -> int:
+        ids = self._tasks.pop(task_id, set())
+        for unit_id in ids:
+            self._units.pop(unit_id, None)
+        return len(ids)
+
+    def collect(self, task_ids: List[str]) -> Dict[str, Tuple[List[Item], Optional[str]]]:
+        with self._lock:
+            return {
+                task_id: (self._done.pop(task_id, []), self._errors.pop(task_id, None))
+                for task_id in task_ids
+            }
+
+
+_local_broker: Optional[LocalBroker] = None
+
+
+def _shared_broker() -> LocalBroker:
+    """管理器服务进程中唯一的 LocalBroker"""
+    global _local_broker
+    if _local_broker is None:
+        _local_broker = LocalBroker()
+    return _local_broker
+
+
+@functools.lru_cache(maxsize=None)
+def _manager_class():
+    """local:// 代理的管理器类；multiprocessing.managers 只在用到时导入，不拖慢API启动"""
+    from multiprocessing.managers import BaseManager
+
+    class FarmManager(BaseManager):
+        """在TCP上把 LocalBroker 提供给本机的其他进程"""
+
+    FarmManager.register("broker", callable=_shared_broker)
+    return FarmManager
+
+
+def _manager(location: str):
+    host, _, port = location.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid local render farm address: {location} (expected host:port)")
+    return _manager_class()(address=(host, int(port)), authkey=settings.SECRET_KEY.encode("utf-8"))
+
+
+def serve_local_broker(url: str):
+    """
+    local:// 时启动提供 LocalBroker 的管理器进程
+
+    其余代理，或该地址上已经有进程（例如同一台机器上的另一个API进程）在提供时返回 None。
+    """
+    scheme, _, location = url.partition("://")
+    if scheme != "local":
+        return None
+    try:
+        _manager(location).connect()
+        return None
+    except ConnectionRefusedError:
+        pass
+    manager = _manager(location)
+    manager.start()
+    return manager
+
+
+def connect_broker(url: str):
+    """按 RENDER_FARM_URL 连接代理，返回 RedisBroker 或 LocalBroker 的代理对象"""
+    scheme, _, location = url.partition("://")
+    if scheme in ("redis", "rediss"):
+        return RedisBroker(url)
+    if scheme == "local":
+        manager = _manager(location)
+        manager.connect()
+        return manager.broker()
+    raise ValueError(f"Unsupported render farm URL: {url}")
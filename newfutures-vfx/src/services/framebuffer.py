@@ -0,0 +1,194 @@
+"""
+分块帧缓冲
+
+渲染中的帧以内存映射文件的形式存放，文件格式：
+
+- 文件头：魔数、版本、宽高、通道数、tile边长、像素类型、数据区偏移
+- tile状态表：每个tile一个字节，tile像素写完后置1
+- 像素数据：按tile连续存放，形状 (tiles_y, tiles_x, tile, tile, channels)，
+  边缘tile按整tile补齐；数据区按页对齐
+
+渲染进程把tile直接写进同一个文件的共享映射，像素不经过进程池回传；编码和预览
+按tile读取映射视图，帧还在渲染时也能读取已完成的tile。默认以float16存储。
+
+文件头和状态表只用标准库读写，API进程不需要加载NumPy。
+"""
+
+import os
+import struct
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional, Set, Tuple
+
+MAGIC = b"NFFB"
+FORMAT_VERSION = 1
+
+# 魔数、版本、宽、高、通道数、tile边长、数据区偏移、像素类型
+_HEADER = struct.Struct("<4sIIIIIQ8s")
+STATE_OFFSET = 64
+PAGE_SIZE = 4096
+
+# 支持的像素类型：名称 -> (numpy类型串, 字节数)
+DTYPES = {
+    "float16": ("<f2", 2),
+    "float32": ("<f4", 4),
+}
+DEFAULT_DTYPE = "float16"
+
+# float16能表示的最大有限值，更亮的像素写入时截断而不是变成inf
+FLOAT16_MAX = 65504.0
+
+Tile = Tuple[int, int, int, int]
+
+
+@dataclass(frozen=True)
+class FrameHeader:
+    """帧缓冲文件头"""
+
+    width: int
+    height: int
+    channels: int
+    tile_size: int
+    dtype: str
+    data_offset: int
+
+    @property
+    def tiles_x(self) -> int:
+        return -(-self.width // self.tile_size)
+
+    @property
+    def tiles_y(self) -> int:
+        return -(-self.height // self.tile_size)
+
+    @property
+    def tile_count(self) -> int:
+        return self.tiles_x * self.tiles_y
+
+    @property
+    def file_size(self) -> int:
+        pixels = self.tile_count * self.tile_size * self.tile_size * self.channels
+        return self.data_offset + pixels * DTYPES[self.dtype][1]
+
+    def tile_rect(self, index: int) -> Tile:
+        """tile序号 -> (x0, y0, x1, y1)，与 plan_tiles 的行优先顺序一致"""
+        ty, tx = divmod(index, self.tiles_x)
+        x0, y0 = tx * self.tile_size, ty * self.tile_size
+        return x0, y0, min(x0 + self.tile_size, self.width), min(y0 + self.tile_size, self.height)
+
+    def tile_index(self, tile: Tile) -> int:
+        """(x0, y0, x1, y1) -> tile序号"""
+        return (tile[1] // self.tile_size) * self.tiles_x + tile[0] // self.tile_size
+
+
+def create(
+    path: Path, width: int, height: int, tile_size: int, channels: int = 3,
+    dtype: str = DEFAULT_DTYPE,
+) -> FrameHeader:
+    """创建空的帧缓冲文件（稀疏文件），先写临时文件再原子替换"""
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported frame buffer dtype: {dtype}")
+    tiles = -(-width // tile_size) * -(-height // tile_size)
+    data_offset = -(-(STATE_OFFSET + tiles) // PAGE_SIZE) * PAGE_SIZE
+    header = FrameHeader(width, height, channels, tile_size, dtype, data_offset)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(_HEADER.pack(
+                MAGIC, FORMAT_VERSION, width, height, channels, tile_size, data_offset,
+                dtype.encode("ascii"),
+            ))
+            fh.truncate(header.file_size)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return header
+
+
+def read_header(path: Path) -> FrameHeader:
+    """读取并校验文件头"""
+    with open(path, "rb") as fh:
+        raw = fh.read(_HEADER.size)
+    if len(raw) < _HEADER.size:
+        raise ValueError(f"Truncated frame buffer: {path}")
+    magic, version, width, height, channels, tile_size, data_offset, dtype = _HEADER.unpack(raw)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"Not a version {FORMAT_VERSION} frame buffer: {path}")
+    return FrameHeader(
+        width, height, channels, tile_size, dtype.rstrip(b"\0").decode("ascii"), data_offset
+    )
+
+
+def completed_tiles(path: Path) -> Set[int]:
+    """已经写完的tile序号"""
+    header = read_header(path)
+    with open(path, "rb") as fh:
+        fh.seek(STATE_OFFSET)
+        states = fh.read(header.tile_count)
+    return {index for index, state in enumerate(states) if state}
+
+
+class FrameBuffer:
+    """帧缓冲文件的内存映射视图"""
+
+    def __init__(self, path: Path, writable: bool = False):
+        import numpy as np
+
+        self.path = Path(path)
+        self.header = read_header(self.path)
+        h = self.header
+        mapped = np.memmap(self.path, dtype=np.uint8, mode="r+" if writable else "r",
+                           shape=(h.file_size,))
+        self.states = mapped[STATE_OFFSET:STATE_OFFSET + h.tile_count]
+        self.data = mapped[h.data_offset:].view(DTYPES[h.dtype][0]).reshape(
+            h.tiles_y, h.tiles_x, h.tile_size, h.tile_size, h.channels
+        )
+
+    @property
+    def is_complete(self) -> bool:
+        return bool(self.states.all())
+
+    def tile(self, index: int):
+        """tile像素的只读视图 (h, w, channels)，不拷贝"""
+        x0, y0, x1, y1 = self.header.tile_rect(index)
+        ty, tx = divmod(index, self.header.tiles_x)
+        return self.data[ty, tx, :y1 - y0, :x1 - x0]
+
+    def write_tile(self, index: int, pixels):
+        """写入一个tile并标记完成；float16存储时截断超出范围的值"""
+        import numpy as np
+
+        view = self.tile(index)
+        if self.header.dtype == "float16":
+            np.clip(pixels, -FLOAT16_MAX, FLOAT16_MAX, out=view, casting="same_kind")
+        else:
+            view[...] = pixels
+        # 像素写完之后才置状态位，读者看到状态位时tile一定是完整的
+        self.states[index] = 1
+
+    def iter_tiles(self, completed_only: bool = True) -> Iterator[Tuple[Tile, "object"]]:
+        """逐个产出 (tile矩形, 像素视图)"""
+        for index in range(self.header.tile_count):
+            if completed_only and not self.states[index]:
+                continue
+            yield self.header.tile_rect(index), self.tile(index)
+
+    def read(self, region: Optional[Tile] = None):
+        """
+        把区域拼成 (h, w, channels) 的float32数组（拷贝），未完成的tile为0
+
+        用于合成和预览；编码整帧时用 iter_tiles 逐tile处理即可避免整帧拷贝。
+        """
+        import numpy as np
+
+        x0, y0, x1, y1 = region or (0, 0, self.header.width, self.header.height)
+        out = np.zeros((y1 - y0, x1 - x0, self.header.channels), dtype=np.float32)
+        for (tx0, ty0, tx1, ty1), pixels in self.iter_tiles():
+            ix0, iy0, ix1, iy1 = max(tx0, x0), max(ty0, y0), min(tx1, x1), min(ty1, y1)
+            if ix0 < ix1 and iy0 < iy1:
+                out[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = pixels[iy0 - ty0:iy1 - ty0, ix0 - tx0:ix1 - tx0]
+        return out
@@ -0,0 +1,364 @@
+"""
+节点硬件探测
+
+启动时测量本机的CPU核数（含cgroup配额和CPU亲和性限制）、NUMA布局、内存（含
+cgroup内存上限）和GPU，并在渲染进程里跑一次简短的基准测试：向量化内核吞吐量
+和路径追踪采样速率。基准结果按主机缓存在 ASSET_CACHE_DIR/hardware 下，同一台
+机器重启时不再重复测量；内存等会变化的数据每次启动重新读取。
+
+探测本身只用标准库，基准测试在独立的子进程中运行，API进程不需要加载NumPy。
+测量结果用于 /render/capabilities 的返回值、渲染进程池大小和模拟任务的内存准入。
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from core.config import settings
+from services.render_tasks import benchmark_worker, init_worker
+from utils.file_lock import FileLock
+
+# 基准测试时长（秒）
+BENCHMARK_SECONDS = 1.0
+
+# 基准结果格式版本，测量方法改变时递增使旧缓存失效
+BENCHMARK_VERSION = 1
+
+GIB = 1 << 30
+
+
+@dataclass
+class NumaNode:
+    """一个NUMA节点"""
+
+    node: int
+    cpus: List[int]
+    memory_total: int
+    memory_free: int
+
+
+@dataclass
+class HardwareProfile:
+    """本机硬件测量结果"""
+
+    host: str
+    cpu_model: str
+    logical_cores: int
+    physical_cores: int
+    # 本进程实际可用的核数：CPU亲和性和cgroup配额中较小的一个
+    usable_cores: int
+    memory_total: int
+    memory_available: int
+    numa_nodes: List[NumaNode] = field(default_factory=list)
+    gpus: List[Dict[str, Any]] = field(default_factory=list)
+    benchmark: Optional[Dict[str, Any]] = None
+
+    @property
+    def fingerprint(self) -> str:
+        """硬件指纹：同一主机换了CPU、内存或GPU后基准需要重新测量"""
+        identity = [
+            self.host, self.cpu_model, self.logical_cores, self.usable_cores,
+            self.memory_total, [gpu["name"] for gpu in self.gpus], BENCHMARK_VERSION,
+        ]
+        return hashlib.sha256(json.dumps(identity).encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def gpu_memory(self) -> int:
+        return sum(gpu["memory_total"] for gpu in self.gpus)
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as fh:
+            return fh.read().strip()
+    except OSError:
+        return None
+
+
+def _parse_cpulist(text: str) -> List[int]:
+    """解析 "0-3,8,10-11" 形式的CPU列表"""
+    cpus: List[int] = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _meminfo(text: Optional[str]) -> Dict[str, int]:
+    """解析 /proc/meminfo 格式（值为kB），返回字节数"""
+    values: Dict[str, int] = {}
+    for line in (text or "").splitlines():
+        key, _, rest = line.partition(":")
+        parts = rest.split()
+        if parts and parts[0].isdigit():
+            # NUMA节点的meminfo带 "Node 0 " 前缀
+            values[key.split()[-1]] = int(parts[0]) * 1024
+    return values
+
+
+def _cpu_info():
+    """CPU型号、逻辑核数和物理核数"""
+    logical = os.cpu_count() or 1
+    model = "unknown"
+    cores = set()
+    physical_id = core_id = None
+    for line in (_read("/proc/cpuinfo") or "").splitlines():
+        key, _, value = (part.strip() for part in line.partition(":"))
+        if key == "model name":
+            model = value
+        elif key == "physical id":
+            physical_id = value
+        elif key == "core id":
+            core_id = value
+        elif not key:
+            if core_id is not None:
+                cores.add((physical_id, core_id))
+            physical_id = core_id = None
+    if core_id is not None:
+        cores.add((physical_id, core_id))
+    return model, logical, len(cores) or logical
+
+
+def _usable_cores(logical: int) -> int:
+    """CPU亲和性和cgroup CPU配额允许使用的核数"""
+    try:
+        usable = len(os.sched_getaffinity(0))
+    except AttributeError:
+        usable = logical
+    quota = _read("/sys/fs/cgroup/cpu.max")
+    if quota:
+        limit, _, period = quota.partition(" ")
+        if limit != "max":
+            usable = min(usable, max(1, math.ceil(int(limit) / int(period or 100000))))
+    else:
+        limit = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period = _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if limit and period and int(limit) > 0:
+            usable = min(usable, max(1, math.ceil(int(limit) / int(period))))
+    return usable
+
+
+def _cgroup_memory_limit() -> Optional[int]:
+    """cgroup内存上限，没有限制时返回None"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        value = _read(path)
+        if value and value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return None
+
+
+def _cgroup_memory_usage() -> Optional[int]:
+    for path in ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory/memory.usage_in_bytes"):
+        value = _read(path)
+        if value and value.isdigit():
+            return int(value)
+    return None
+
+
+def _memory():
+    """(总内存, 可用内存)，cgroup限制内存时以cgroup为准"""
+    info = _meminfo(_read("/proc/meminfo"))
+    total = info.get("MemTotal")
+    available = info.get("MemAvailable", info.get("MemFree"))
+    if total is None:
+        try:
+            page = os.sysconf("SC_PAGE_SIZE")
+            total = os.sysconf("SC_PHYS_PAGES") * page
+            available = os.sysconf("SC_AVPHYS_PAGES") * page
+        except (AttributeError, ValueError, OSError):
+            total = available = 0
+    limit = _cgroup_memory_limit()
+    if limit is not None and limit < total:
+        usage = _cgroup_memory_usage() or 0
+        total, available = limit, min(available, max(limit - usage, 0))
+    return total, available
+
+
+def available_memory() -> int:
+    """当前可用内存（字节），准入检查时实时读取"""
+    return _memory()[1]
+
+
+def _numa_nodes() -> List[NumaNode]:
+    nodes = []
+    root = Path("/sys/devices/system/node")
+    for path in sorted(root.glob("node[0-9]*"), key=lambda p: int(p.name[4:])):
+        info = _meminfo(_read(str(path / "meminfo")))
+        nodes.append(NumaNode(
+            node=int(path.name[4:]),
+            cpus=_parse_cpulist(_read(str(path / "cpulist")) or ""),
+            memory_total=info.get("MemTotal", 0),
+            memory_free=info.get("MemFree", 0),
+        ))
+    return nodes
+
+
+def _gpus() -> List[Dict[str, Any]]:
+    """通过nvidia-smi查询NVIDIA GPU；没有驱动时返回空列表"""
+    if shutil.which("nvidia-smi") is None:
+        return []
+    try:
+        output = subprocess.run(
+            ["nvidia-smi", "--query-gpu=name,memory.total,memory.free", "--format=csv,noheader,nounits"],
+            capture_output=True, text=True, timeout=10, check=True,
+        ).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"⚠️  nvidia-smi查询失败: {e}")
+        return []
+    gpus = []
+    for line in output.strip().splitlines():
+        try:
+            name, total, free = (part.strip() for part in line.split(","))
+        except ValueError:
+            logger.warning(f"⚠️  无法解析nvidia-smi输出: {line}")
+            continue
+        gpus.append({"name": name, "memory_total": _mebibytes(total), "memory_free": _mebibytes(free)})
+    return gpus
+
+
+def _mebibytes(value: str) -> int:
+    """nvidia-smi的显存（MiB）；MIG等不报告显存的GPU输出 [N/A]，记为0"""
+    try:
+        return int(value) << 20
+    except ValueError:
+        return 0
+
+
+def probe() -> HardwareProfile:
+    """测量本机硬件（不含基准测试）"""
+    model, logical, physical = _cpu_info()
+    total, available = _memory()
+    return HardwareProfile(
+        host=socket.gethostname(),
+        cpu_model=model,
+        logical_cores=logical,
+        physical_cores=physical,
+        usable_cores=_usable_cores(logical),
+        memory_total=total,
+        memory_available=available,
+        numa_nodes=_numa_nodes(),
+        gpus=_gpus(),
+    )
+
+
+def _benchmark_path(profile: HardwareProfile) -> Path:
+    return settings.BASE_DIR / settings.ASSET_CACHE_DIR / "hardware" / f"{profile.host}-{profile.fingerprint}.json"
+
+
+def _load_benchmark(profile: HardwareProfile) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(_benchmark_path(profile).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _save_benchmark(profile: HardwareProfile):
+    path = _benchmark_path(profile)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as fh:
+            json.dump(profile.benchmark, fh, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _measure_benchmark(profile: HardwareProfile) -> Optional[Dict[str, Any]]:
+    """
+    运行基准测试并缓存结果
+
+    同一台机器上同时启动的进程只有一个在测量（文件锁），其余等它写好缓存后直接读取，
+    测得的单进程吞吐量不会受到其他进程同时测量的干扰。
+    """
+    path = _benchmark_path(profile)
+    with FileLock(path.with_name(f".{path.name}.lock")):
+        benchmark = _load_benchmark(profile)
+        if benchmark is None:
+            logger.info("⏱️  首次在本机启动，运行渲染基准测试...")
+            profile.benchmark = benchmark = _run_benchmark()
+            _save_benchmark(profile)
+    return benchmark
+
+
+def _run_benchmark() -> Dict[str, Any]:
+    """在单独的子进程里运行基准测试，环境与渲染工作进程相同"""
+    with ProcessPoolExecutor(max_workers=1, initializer=init_worker) as executor:
+        result = executor.submit(benchmark_worker, BENCHMARK_SECONDS).result()
+    result["measured_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return result
+
+
+_profile: Optional[HardwareProfile] = None
+
+
+def hardware_profile() -> HardwareProfile:
+    """当前硬件测量结果；启动初始化之前调用时先做一次不含基准的探测"""
+    global _profile
+    if _profile is None:
+        _profile = probe()
+    return _profile
+
+
+def render_workers() -> int:
+    """渲染进程数：配置值，但不超过实际可用的核数"""
+    return max(1, min(settings.RENDER_THREADS, hardware_profile().usable_cores))
+
+
+def simulation_budget() -> int:
+    """
+    单个模拟任务可用的内存（字节）
+
+    配置的每进程预算、总内存按渲染进程数平分的份额和当前实际可用内存三者取最小。
+    """
+    profile = hardware_profile()
+    return int(min(
+        settings.SIMULATION_MEMORY_GB * GIB,
+        profile.memory_total / render_workers(),
+        available_memory(),
+    ))
+
+
+def describe(profile: HardwareProfile) -> Dict[str, Any]:
+    """测量结果的JSON形式"""
+    data = asdict(profile)
+    data["fingerprint"] = profile.fingerprint
+    return data
+
+
+async def init_hardware() -> HardwareProfile:
+    """启动时探测硬件；本机没有缓存的基准结果时运行一次基准测试"""
+    global _profile
+    profile = await asyncio.to_thread(probe)
+    profile.benchmark = await asyncio.to_thread(_load_benchmark, profile)
+    if profile.benchmark is None:
+        try:
+            profile.benchmark = await asyncio.to_thread(_measure_benchmark, profile)
+        except Exception as e:
+            logger.warning(f"⚠️  渲染基准测试失败: {e}")
+    _profile = profile
+
+    gpus = ", ".join(gpu["name"] for gpu in profile.gpus) or "无"
+    logger.info(
+        f"🖥️  {profile.cpu_model}: {profile.usable_cores}/{profile.logical_cores}核可用, "
+        f"{len(profile.numa_nodes) or 1}个NUMA节点, "
+        f"内存 {profile.memory_available / GIB:.1f}/{profile.memory_total / GIB:.1f} GB, GPU: {gpus}"
+    )
+    return profile
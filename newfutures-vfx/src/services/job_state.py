@@ -0,0 +1,133 @@
+"""
+渲染任务状态镜像
+
+把渲染队列里的任务状态写到Redis（render:job:<task_id> 哈希），供其他API实例和
+外部工具读取。tile完成的频率很高，这里不逐次写入：变化的任务先登记，后台按
+FLUSH_INTERVAL 把所有变化合并成一个pipeline写出，一次往返占用一个连接。
+
+status 字段只通过原子的状态迁移修改（queued -> rendering -> 结束状态），
+已经被其他实例改成结束状态的任务不会被进度写入覆盖回去：迁移被拒绝后本实例
+不再镜像这个任务。
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from core.redis_client import get_redis
+
+JOB_KEY = "render:job:{task_id}"
+
+# 任务状态在Redis中保留的时间（秒）
+JOB_TTL = 7 * 24 * 3600
+
+# 合并写入的间隔（秒）
+FLUSH_INTERVAL = 0.5
+
+# 状态迁移：新状态 -> 允许的旧状态（空串表示任务还没有写过状态）
+# 重启后恢复的任务会从 rendering 回到 queued
+TRANSITIONS: Dict[str, Tuple[str, ...]] = {
+    "queued": ("", "queued", "rendering"),
+    "rendering": ("", "queued", "rendering"),
+    "completed": ("", "queued", "rendering"),
+    "failed": ("", "queued", "rendering"),
+    "cancelled": ("", "queued", "rendering"),
+}
+
+
+def job_key(task_id: str) -> str:
+    return JOB_KEY.format(task_id=task_id)
+
+
+class JobStateWriter:
+    """合并任务状态变化并批量写入Redis"""
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        # task_id -> 任务对象，写出时再取快照，同一任务的多次变化只写一次
+        self._dirty: Dict[str, Any] = {}
+        # 上次写出的状态，状态变化时走迁移脚本
+        self._status: Dict[str, str] = {}
+        # 状态迁移被拒绝（已被其他实例结束）的任务，不再写出
+        self._detached: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, job):
+        """登记任务状态变化"""
+        if job.task_id in self._detached:
+            # 本地任务也结束后不会再有变化，不再需要记住它
+            if not job.is_active:
+                self._detached.discard(job.task_id)
+            return
+        self._dirty[job.task_id] = job
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台写入，并把剩余的变化写出"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"⚠️  任务状态写入Redis失败: {e}")
+
+    async def flush(self):
+        """把登记的变化写出：状态迁移逐个原子执行，其余字段合并为一个pipeline"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        store = get_redis()
+        updates: Dict[str, Dict[str, Any]] = {}
+        transitions: List[Tuple[str, str, Dict[str, Any]]] = []
+        for task_id, job in dirty.items():
+            data = job.progress_data(error=job.error)
+            status = data.pop("status")
+            data.pop("task_id")
+            data["priority"] = job.priority
+            data["updated_at"] = round(time.time(), 3)
+            if self._status.get(task_id) != status:
+                transitions.append((task_id, status, data))
+            else:
+                updates[job_key(task_id)] = data
+
+        try:
+            for task_id, status, data in transitions:
+                applied = await store.transition(
+                    job_key(task_id), "status", TRANSITIONS[status], status, data, ttl=JOB_TTL
+                )
+                if not applied:
+                    logger.warning(f"⚠️  渲染任务 {task_id} 已被其他实例结束，忽略状态 {status}")
+                    self._status.pop(task_id, None)
+                    self._detached.add(task_id)
+                elif status in ("queued", "rendering"):
+                    self._status[task_id] = status
+                else:
+                    self._status.pop(task_id, None)
+            await store.hset_many(updates, ttl=JOB_TTL)
+        except Exception:
+            # 写入失败时保留变化，下次重试（期间的新变化优先）
+            self._dirty = {**dirty, **self._dirty}
+            raise
+
+
+async def load_job_state(task_id: str) -> Dict[str, str]:
+    """读取Redis中的任务状态"""
+    return await get_redis().hgetall(job_key(task_id))
+
+
+job_state = JobStateWriter()
@@ -0,0 +1,104 @@
+"""
+Prometheus指标
+
+- HTTP：按路由模板和方法统计的请求延迟直方图、请求计数（含状态码）和处理中的请求数
+- 渲染队列：各状态的任务数、进程池大小和忙碌的进程数（利用率 = busy / workers）
+- 渲染引擎：按引擎统计的tile、帧和像素采样计数，帧率和采样率用 rate() 计算
+
+指标保存在API进程的默认注册表中。渲染队列运行在API进程内，服务器只能以单个
+工作进程运行（WORKERS > 1 时 run_server 拒绝启动），因此不使用prometheus_client的
+多进程模式；渲染农场节点是独立的进程，它们的渲染量在API进程合并结果时计入。
+
+请求路径上只做一次字典查找和几次计数器自增；路由模板按endpoint缓存。
+"""
+
+import time
+from typing import Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests", ["method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response is complete",
+    ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being handled"
+)
+
+RENDER_JOBS = Gauge(
+    "render_queue_jobs", "Render jobs in the queue", ["status"]
+)
+RENDER_JOBS_FINISHED = Counter(
+    "render_jobs_finished_total", "Finished render jobs", ["status"]
+)
+RENDER_WORKERS = Gauge(
+    "render_pool_workers", "Render worker processes"
+)
+RENDER_BUSY = Gauge(
+    "render_pool_busy_workers", "Render worker processes running a tile or simulation chunk"
+)
+RENDER_TILES = Counter("render_tiles_total", "Rendered tiles", ["engine"])
+RENDER_FRAMES = Counter("render_frames_total", "Rendered frames", ["engine"])
+RENDER_SAMPLES = Counter("render_samples_total", "Rendered pixel samples", ["engine"])
+
+
+def render_metrics() -> bytes:
+    """API进程的指标，Prometheus文本格式"""
+    return generate_latest(REGISTRY)
+
+
+class MetricsMiddleware:
+    """记录请求延迟和计数的ASGI中间件"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Optional[Dict[object, str]] = None
+
+    def _route_label(self, scope) -> str:
+        route = scope.get("route")
+        if route is not None and hasattr(route, "path_format"):
+            return route.path_format
+        if self._routes is None:
+            # FastAPI把include_router的路由展开在app.routes里，按endpoint映射到路由模板；
+            # Mount（静态资源等）匹配后endpoint为挂载的应用，按挂载点计
+            self._routes = {}
+            for candidate in scope["app"].routes:
+                endpoint = getattr(candidate, "endpoint", None)
+                if endpoint is not None:
+                    self._routes.setdefault(endpoint, candidate.path_format)
+                elif hasattr(candidate, "app") and hasattr(candidate, "path"):
+                    self._routes.setdefault(candidate.app, candidate.path)
+        return self._routes.get(scope.get("endpoint"), "<unmatched>")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            method = scope["method"]
+            route = self._route_label(scope)
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+
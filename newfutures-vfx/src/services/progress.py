@@ -0,0 +1,121 @@
+"""
+渲染进度推送
+
+每个任务一个共享频道：事件在发布时只序列化一次，订阅者各自记录读到的序号，
+发布操作只唤醒一个共享的Event，与订阅人数无关。没有订阅者的任务不产生任何事件。
+"""
+
+import asyncio
+import json
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+# 每个频道保留的最近事件数，跟不上的订阅者会跳过更早的事件
+CHANNEL_HISTORY = 64
+
+# SSE保活间隔（秒）
+KEEPALIVE_INTERVAL = 15.0
+
+
+class ProgressEvent:
+    """预先序列化好的进度事件，供所有订阅者共享"""
+
+    __slots__ = ("kind", "data", "text", "sse")
+
+    def __init__(self, kind: str, data: Dict[str, Any]):
+        self.kind = kind
+        self.data = data
+        self.text = json.dumps({"event": kind, **data}, ensure_ascii=False)
+        self.sse = f"event: {kind}\ndata: {self.text}\n\n".encode("utf-8")
+
+
+class JobChannel:
+    """单个任务的进度频道"""
+
+    def __init__(self):
+        self.subscribers = 0
+        self.closed = False
+        self._seq = 0
+        self._events: Deque[Tuple[int, ProgressEvent]] = deque(maxlen=CHANNEL_HISTORY)
+        self._changed = asyncio.Event()
+
+    @property
+    def latest_seq(self) -> int:
+        return self._seq
+
+    def publish(self, event: ProgressEvent, final: bool = False):
+        self._seq += 1
+        self._events.append((self._seq, event))
+        if final:
+            self.closed = True
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def listen(
+        self, since: int = 0, keepalive: Optional[float] = None
+    ) -> AsyncIterator[Optional[ProgressEvent]]:
+        """
+        逐个产出 since 之后的事件；频道关闭后结束
+
+        设置keepalive时，空闲超过该秒数会产出一个None，调用方据此发送保活数据。
+        """
+        while True:
+            changed = self._changed
+            for seq, event in list(self._events):
+                if seq > since:
+                    since = seq
+                    yield event
+            if self.closed:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class ProgressBroker:
+    """按任务ID管理进度频道"""
+
+    def __init__(self):
+        self._channels: Dict[str, JobChannel] = {}
+
+    def has_subscribers(self, task_id: str) -> bool:
+        return task_id in self._channels
+
+    def publish(self, task_id: str, kind: str, data: Dict[str, Any], final: bool = False):
+        """发布事件；没有订阅者时直接忽略"""
+        channel = self._channels.get(task_id)
+        if channel is not None:
+            channel.publish(ProgressEvent(kind, data), final=final)
+
+    async def subscribe(
+        self, task_id: str, snapshot: Callable[[], Tuple[ProgressEvent, bool]],
+        keepalive: Optional[float] = None,
+    ) -> AsyncIterator[Optional[ProgressEvent]]:
+        """
+        订阅任务进度
+
+        snapshot 返回 (当前状态快照, 任务是否已经结束)。先登记频道再取快照，两者之间没有
+        await：快照之后发布的事件（包括结束事件）都会进入频道，不会在发送快照期间丢失。
+        先产出快照，任务已经结束时到此为止，否则继续产出后续事件。
+        """
+        channel = self._channels.get(task_id)
+        if channel is None or channel.closed:
+            channel = self._channels[task_id] = JobChannel()
+        channel.subscribers += 1
+        since = channel.latest_seq
+        event, final = snapshot()
+        try:
+            yield event
+            if final:
+                return
+            async for event in channel.listen(since=since, keepalive=keepalive):
+                yield event
+        finally:
+            channel.subscribers -= 1
+            if channel.subscribers == 0 and self._channels.get(task_id) is channel:
+                del self._channels[task_id]
+
+
+# 全局进度广播实例
+progress_broker = ProgressBroker()
@@ -0,0 +1,141 @@
+"""
+渲染结果缓存
+
+渲染输出按内容寻址：去掉帧范围后的完整渲染配置，加上场景引用资源的内容哈希，
+得到任务键；每帧存放在 RENDER_OUTPUT_DIR/frames/<键前两位>/<键>/frame_NNNN.<ext>，
+视频任务由帧编码出的视频为同一目录下的 video_NNNN-NNNN.<ext>（首帧-末帧）。
+重复提交直接复用已有帧，只改帧范围时也能复用之前渲染过的帧；总大小超过上限时按LRU淘汰。
+"""
+
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+from assets.storage import asset_path
+from core.config import settings
+from utils.hashing import canonical_digest, file_digest
+
+# 渲染器输出发生变化时递增，使旧缓存全部失效
+CACHE_VERSION = 1
+
+# 不影响像素的配置字段：帧范围，以及已经展开成engine/samples的预设选择。
+# fps决定模拟任务的时间步长，保留在键里
+NON_PIXEL_KEYS = ("frame_start", "frame_end", "duration", "preset", "quality")
+
+
+class RenderCache:
+    """按任务键+帧号寻址的帧缓存，带大小上限的LRU淘汰"""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[Path, int]" = OrderedDict()
+        self._pinned: Dict[str, int] = {}
+
+    def load(self):
+        """扫描已有的缓存帧，按修改时间恢复LRU顺序"""
+        self._entries.clear()
+        self.total_bytes = 0
+        if not self.root.exists():
+            return
+        found = []
+        for pattern in ("*/*/frame_*", "*/*/video_*"):
+            for path in self.root.glob(pattern):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+            self.total_bytes += size
+        logger.info(
+            f"🗃️  渲染缓存: {len(self._entries)} 帧, {self.total_bytes / (1 << 30):.2f} GB"
+        )
+        self._evict()
+
+    def job_key(self, config: Dict[str, Any]) -> str:
+        """渲染配置+场景资源内容的规范哈希"""
+        canonical = {k: v for k, v in config.items() if k not in NON_PIXEL_KEYS}
+        assets = {}
+        for mesh in (config.get("scene") or {}).get("meshes", []):
+            assets[mesh["path"]] = file_digest(asset_path(mesh["path"]))
+        return canonical_digest({"version": CACHE_VERSION, "config": canonical, "assets": assets})
+
+    def frame_path(self, job_key: str, frame: int, extension: str) -> Path:
+        return self.root / job_key[:2] / job_key / f"frame_{frame:04d}.{extension}"
+
+    def video_path(self, job_key: str, first: int, last: int, extension: str) -> Path:
+        return self.root / job_key[:2] / job_key / f"video_{first:04d}-{last:04d}.{extension}"
+
+    def content_tag(self, path: Path) -> str:
+        """
+        缓存文件的内容标识，用作下载的强ETag
+
+        路径由任务键（渲染配置和场景资源内容的哈希）和帧号决定，同一路径的内容不会变化，
+        不需要读取文件。
+        """
+        return canonical_digest(Path(path).resolve().relative_to(self.root.resolve()).as_posix())
+
+    def lookup(self, job_key: str, frame: int, extension: str) -> Optional[Path]:
+        """命中时刷新LRU位置并返回帧路径"""
+        return self.lookup_path(self.frame_path(job_key, frame, extension))
+
+    def lookup_path(self, path: Path) -> Optional[Path]:
+        """按完整路径查找缓存项（帧或视频）"""
+        if path not in self._entries:
+            return None
+        if not path.exists():
+            self.total_bytes -= self._entries.pop(path)
+            return None
+        self._entries.move_to_end(path)
+        os.utime(path)
+        return path
+
+    def add(self, path: Path):
+        """登记新写入的帧并按需淘汰"""
+        size = path.stat().st_size
+        self.total_bytes += size - self._entries.pop(path, 0)
+        self._entries[path] = size
+        self._evict()
+
+    def pin(self, job_key: str):
+        """活动任务的帧不参与淘汰"""
+        self._pinned[job_key] = self._pinned.get(job_key, 0) + 1
+
+    def unpin(self, job_key: str):
+        count = self._pinned.get(job_key, 0) - 1
+        if count > 0:
+            self._pinned[job_key] = count
+        else:
+            self._pinned.pop(job_key, None)
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for path in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if path.parent.name in self._pinned:
+                continue
+            size = self._entries.pop(path)
+            self.total_bytes -= size
+            try:
+                path.unlink()
+                for directory in (path.parent, path.parent.parent):
+                    if any(directory.iterdir()):
+                        break
+                    directory.rmdir()
+            except OSError as e:
+                logger.warning(f"⚠️  无法删除缓存帧 {path}: {e}")
+
+
+# 全局渲染缓存实例
+render_cache = RenderCache(
+    root=settings.BASE_DIR / settings.RENDER_OUTPUT_DIR / "frames",
+    max_bytes=int(settings.RENDER_CACHE_MAX_GB * (1 << 30)),
+)
@@ -0,0 +1,234 @@
+"""
+渲染历史
+
+结束的渲染任务写入 render_history 表。写入先在内存中排队，后台每 FLUSH_INTERVAL
+或攒够 BATCH_SIZE 行时用一条多行INSERT写出，不在任务结束的回调里逐行访问数据库。
+
+列表按 (timestamp, id) 倒序做keyset分页：游标记录上一页最后一行的 (timestamp, id)，
+下一页只查比它更早的行，配合 (status, timestamp, id) 索引，翻到多深都只扫描一页的行，
+不会像OFFSET那样越翻越慢。
+
+SQLAlchemy导入较慢，数据库作为按需加载的子系统在启动后于后台连接（database），
+写入和查询在首次使用时等待连接完成。
+"""
+
+import asyncio
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from utils.lazy import LazySubsystem
+
+# 每批最多写入的行数
+BATCH_SIZE = 500
+
+# 批量写入的间隔（秒）
+FLUSH_INTERVAL = 1.0
+
+MAX_PAGE_SIZE = 200
+
+# 字符串列的宽度，与 core.database.render_history 一致（这里不导入SQLAlchemy）
+COLUMN_LENGTHS = {
+    "task_id": 64, "status": 16, "resolution": 16, "quality": 16, "engine": 32, "effect": 32,
+}
+
+database = LazySubsystem("core.database", init="init_db", close="close_db")
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    data = json.dumps([timestamp.isoformat(), row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析分页游标，格式错误时抛出ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _fit(row: Dict[str, Any]) -> Dict[str, Any]:
+    """配置里的字段是任意值，转成字符串并截断到列宽，超长的值不会让整批写入失败"""
+    for column, length in COLUMN_LENGTHS.items():
+        value = row[column]
+        if value is not None:
+            row[column] = str(value)[:length]
+    return row
+
+
+def _is_rejected(error: Exception) -> bool:
+    """数据库拒绝的是行本身（数据超长、约束冲突、类型不符），重试也不会成功"""
+    from sqlalchemy.exc import DBAPIError, DataError, IntegrityError, StatementError
+
+    if isinstance(error, (DataError, IntegrityError)):
+        return True
+    # 参数在发给数据库之前的类型转换失败
+    return isinstance(error, StatementError) and not isinstance(error, DBAPIError)
+
+
+def _history_row(job) -> Dict[str, Any]:
+    """结束的渲染任务 -> 历史记录行"""
+    config = job.config
+    duration = 0.0
+    if job.started_at is not None and job.finished_at is not None:
+        duration = job.finished_at - job.started_at
+    return _fit({
+        "task_id": job.task_id,
+        "timestamp": datetime.fromtimestamp(job.finished_at or job.submitted_at, tz=timezone.utc),
+        "status": job.status.value,
+        "resolution": config.get("resolution"),
+        "quality": config.get("quality"),
+        "engine": config.get("engine"),
+        "effect": config.get("effect"),
+        "frames": len(job.completed_frames),
+        "duration_seconds": round(duration, 3),
+        "output_file": job.output_files[0] if job.output_files else None,
+        "error": job.error,
+    })
+
+
+class HistoryWriter:
+    """批量写入渲染历史"""
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows: List[Dict[str, Any]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, job):
+        """登记一个结束的任务"""
+        self._rows.append(_history_row(job))
+        if len(self._rows) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台写入，并把剩余的行写出"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"⚠️  渲染历史写入失败，稍后重试: {e}")
+
+    async def flush(self):
+        """
+        把排队的行分批写出，每批一条多行INSERT
+
+        连接等暂时性错误时批次留在队列里下次重试；数据库拒绝了批次里的某一行时改为
+        逐行写入，丢弃被拒绝的行，不让一行坏数据堵住后面所有的记录。
+        """
+        if not self._rows:
+            return
+        from sqlalchemy import insert
+
+        db = await database.get()
+        while self._rows:
+            batch = self._rows[:self.batch_size]
+            try:
+                async with db.get_engine().begin() as conn:
+                    await conn.execute(insert(db.render_history), batch)
+            except Exception as e:
+                if not _is_rejected(e):
+                    raise
+                await self._insert_each(db, len(batch))
+                continue
+            # 写入成功后再出队，失败的批次留到下次重试
+            del self._rows[:len(batch)]
+
+    async def _insert_each(self, db, count: int):
+        """逐行写入队首的count行，写入成功或被拒绝的行出队"""
+        from sqlalchemy import insert
+
+        for _ in range(count):
+            row = self._rows[0]
+            try:
+                async with db.get_engine().begin() as conn:
+                    await conn.execute(insert(db.render_history), [row])
+            except Exception as e:
+                if not _is_rejected(e):
+                    raise
+                logger.error(f"❌ 渲染历史记录 {row['task_id']} 被数据库拒绝，已丢弃: {e}")
+            del self._rows[0]
+
+
+def _serialize(row) -> Dict[str, Any]:
+    timestamp = row.timestamp
+    if timestamp.tzinfo is None:
+        # SQLite不保存时区，写入的都是UTC
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return {
+        "task_id": row.task_id,
+        "timestamp": timestamp.isoformat().replace("+00:00", "Z"),
+        "resolution": row.resolution,
+        "quality": row.quality,
+        "engine": row.engine,
+        "effect": row.effect,
+        "status": row.status,
+        "frames": row.frames,
+        "duration": f"{row.duration_seconds:.1f} seconds",
+        "output_file": row.output_file,
+        "error": row.error,
+    }
+
+
+async def list_history(
+    status: Optional[str] = None, limit: int = 20, cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    按结束时间倒序列出渲染历史
+
+    返回本页记录和下一页的游标（没有更多记录时为None）。
+    """
+    from sqlalchemy import literal, select, tuple_
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    db = await database.get()
+    table = db.render_history
+    query = select(table).order_by(table.c.timestamp.desc(), table.c.id.desc()).limit(limit + 1)
+    if status is not None:
+        query = query.where(table.c.status == status)
+    if cursor is not None:
+        timestamp, row_id = decode_cursor(cursor)
+        # 参数带上列类型，SQLite按与存储相同的格式比较时间
+        query = query.where(tuple_(table.c.timestamp, table.c.id) < tuple_(
+            literal(timestamp, table.c.timestamp.type), literal(row_id, table.c.id.type)
+        ))
+
+    async with db.get_engine().connect() as conn:
+        rows = (await conn.execute(query)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return {"renders": [_serialize(row) for row in rows], "next_cursor": next_cursor}
+
+
+history_writer = HistoryWriter()
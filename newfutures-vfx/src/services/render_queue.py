@@ -0,0 +1,1051 @@
+"""
+渲染任务队列
+
+POST /render/start 提交的任务在这里排队，按预设档位的优先级把每帧切成tile分发到进程池，
+CPU密集的渲染工作不会占用uvicorn的事件循环。
+
+带 effect 字段的任务是模拟任务：帧与帧之间有状态依赖，按帧段顺序调度，
+每段在工作进程中连续推进，段与段之间通过检查点文件衔接。
+
+配置了 RENDER_FARM_URL 时，非模拟任务发布到渲染农场（见 services.farm）由各节点渲染，
+本机只负责汇总结果；模拟任务仍在本机进程池中执行。
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from enum import Enum
+from functools import partial
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from core.config import settings
+from services import framebuffer
+from services.job_state import job_state
+from services.metrics import (
+    RENDER_BUSY, RENDER_FRAMES, RENDER_JOBS, RENDER_JOBS_FINISHED, RENDER_SAMPLES, RENDER_TILES,
+    RENDER_WORKERS
+)
+from services.farm import WHOLE_FRAME, connect_broker, serve_local_broker
+from services.render_history import history_writer
+from services.hardware import hardware_profile, render_workers
+from services.progress import progress_broker
+from services.render_cache import RenderCache, render_cache
+from services.render_tasks import (
+    DEFAULT_TILE_SIZE, ENGINE_FALLBACKS, SIMULATION_CHUNK, frame_extension, init_worker,
+    encode_video, is_simulation, parse_resolution, plan_tiles, render_tile_to_buffer, save_frame,
+    simulate_frames, video_extension
+)
+from utils.file_lock import FileLock
+
+# 内存中保留的已结束任务数量
+MAX_FINISHED_JOBS = 1000
+
+# 从渲染农场取回完成条目的间隔（秒）
+FARM_COLLECT_INTERVAL = 0.5
+
+
+class JobStatus(str, Enum):
+    """渲染任务状态"""
+
+    QUEUED = "queued"
+    RENDERING = "rendering"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+ACTIVE_STATUSES = (JobStatus.QUEUED, JobStatus.RENDERING)
+
+
+@dataclass
+class RenderJob:
+    """渲染任务"""
+
+    task_id: str
+    config: Dict[str, Any]
+    priority: int
+    frames: List[int]
+    status: JobStatus = JobStatus.QUEUED
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    completed_frames: List[int] = field(default_factory=list)
+    output_files: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+    cache_key: Optional[str] = None
+    cached_frames: int = 0
+    simulated_frame: int = 0
+    tiles: List[Tuple[int, int, int, int]] = field(default_factory=list, repr=False)
+    completed_tiles: int = field(default=0, repr=False)
+    pending: Deque[Tuple[int, int]] = field(default_factory=deque, repr=False)
+    in_flight: int = field(default=0, repr=False)
+    frame_tiles: Dict[int, Set[int]] = field(default_factory=dict, repr=False)
+    remote: Set[Tuple[int, int]] = field(default_factory=set, repr=False)
+    render_seconds: float = field(default=0.0, repr=False)
+    sampled_pixels: int = field(default=0, repr=False)
+    samples_spent: int = field(default=0, repr=False)
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+    @property
+    def is_simulation(self) -> bool:
+        return is_simulation(self.config)
+
+    @property
+    def engine(self) -> str:
+        """指标中的引擎名：特效任务为特效ID，其余为实际执行的渲染引擎"""
+        if "effect" in self.config:
+            return self.config["effect"]
+        name = self.config.get("engine", "Cycles")
+        return ENGINE_FALLBACKS.get(name, name)
+
+    @property
+    def done_tiles(self) -> int:
+        """已完成的tile数：完成的帧加上渲染中的帧里已写入帧缓冲的tile"""
+        return len(self.completed_frames) * len(self.tiles) + sum(
+            len(tiles) for tiles in self.frame_tiles.values()
+        )
+
+    @property
+    def progress(self) -> float:
+        """完成百分比（按tile计）"""
+        total = len(self.frames) * len(self.tiles)
+        if not total:
+            return 100.0
+        return round(100.0 * min(self.done_tiles, total) / total, 2)
+
+    @property
+    def average_samples(self) -> Optional[float]:
+        """已渲染像素实际花费的平均采样数；自适应采样时低于配置的上限"""
+        if not self.sampled_pixels:
+            return None
+        return round(self.samples_spent / self.sampled_pixels, 2)
+
+    def progress_data(self, **extra) -> Dict[str, Any]:
+        """进度事件内容：完成情况、吞吐量、平均采样数和预计剩余时间"""
+        total_tiles = len(self.frames) * len(self.tiles)
+        done_tiles = self.done_tiles
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        tiles_per_second = self.completed_tiles / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.is_active and tiles_per_second > 0:
+            eta = round(max(total_tiles - done_tiles, 0) / tiles_per_second, 1)
+        return {
+            "task_id": self.task_id,
+            "status": self.status.value,
+            "progress": self.progress,
+            "completed_frames": len(self.completed_frames),
+            "total_frames": len(self.frames),
+            "cached_frames": self.cached_frames,
+            "completed_tiles": done_tiles,
+            "total_tiles": total_tiles,
+            "elapsed_seconds": round(elapsed, 2),
+            "tiles_per_second": round(tiles_per_second, 2),
+            "average_samples": self.average_samples,
+            "eta_seconds": eta,
+            **extra,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化为可持久化的字典"""
+        return {
+            "task_id": self.task_id,
+            "config": self.config,
+            "priority": self.priority,
+            "frames": self.frames,
+            "status": self.status.value,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "completed_frames": self.completed_frames,
+            "output_files": self.output_files,
+            "error": self.error,
+            "cache_key": self.cache_key,
+            "cached_frames": self.cached_frames,
+            "simulated_frame": self.simulated_frame,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RenderJob":
+        """从持久化字典恢复"""
+        job = cls(
+            task_id=data["task_id"],
+            config=data["config"],
+            priority=data["priority"],
+            frames=data["frames"],
+            status=JobStatus(data["status"]),
+            submitted_at=data["submitted_at"],
+            started_at=data.get("started_at"),
+            finished_at=data.get("finished_at"),
+            completed_frames=data.get("completed_frames", []),
+            output_files=data.get("output_files", []),
+            error=data.get("error"),
+            cache_key=data.get("cache_key"),
+            cached_frames=data.get("cached_frames", 0),
+            simulated_frame=data.get("simulated_frame", 0),
+        )
+        return job
+
+
+def new_task_id() -> str:
+    """生成不会冲突的任务ID"""
+    return f"render_task_{uuid.uuid4().hex}"
+
+
+class RenderQueue:
+    """
+    渲染任务优先级队列
+
+    priority数值越小越先调度；同一优先级按提交顺序。调度粒度是tile，
+    高优先级任务提交后会在下一个空闲进程槽位上抢先执行。工作进程把tile直接写入该帧的
+    内存映射帧缓冲（见 services.framebuffer），一帧的tile全部完成后在线程中逐tile编码写出；
+    重启后已写入帧缓冲的tile不再重新渲染。
+
+    帧输出写入内容寻址的渲染缓存：已经渲染过的帧直接复用，配置完全相同的活动任务
+    只保留一个。
+
+    任务只存在于运行队列的进程中，同一个状态目录只允许一个进程启动队列（文件锁），
+    否则各进程的状态文件会互相覆盖、重启后重复渲染同一批任务。
+    """
+
+    def __init__(self, max_workers: int, state_file: Path, cache: RenderCache):
+        self.max_workers = max(1, max_workers)
+        self.state_file = Path(state_file)
+        self.checkpoint_dir = self.state_file.parent / "simulations"
+        self.framebuffer_root = self.state_file.parent / "framebuffers"
+        self.cancel_root = self.state_file.parent / "cancelled"
+        self.cache = cache
+        self._lock = FileLock(self.state_file.with_suffix(".lock"))
+        self._jobs: Dict[str, RenderJob] = {}
+        self._inflight: Dict[Tuple[str, Tuple[int, ...]], str] = {}
+        self._finished: Deque[str] = deque()
+        self._ready: List[Tuple[int, int, str]] = []
+        self._seq = itertools.count()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._scheduler: Optional[asyncio.Task] = None
+        self.farm = None
+        self._farm_server = None
+        self._collector: Optional[asyncio.Task] = None
+        # 帧编码、农场发布和撤回等后台任务；事件循环只弱引用任务，这里持有引用直到完成
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def running(self) -> bool:
+        return self._scheduler is not None and not self._scheduler.done()
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """启动后台任务并持有引用，结束时记录未处理的异常"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+        return task
+
+    def _on_task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            name = task.get_coro().__qualname__
+            logger.opt(exception=error).error(f"❌ 渲染队列后台任务 {name} 出错: {error}")
+
+    async def start(self):
+        """启动进程池和调度循环"""
+        if self.running:
+            return
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError(
+                f"Render queue state {self.state_file} is in use by another process; "
+                "run the API with a single worker per render output directory"
+            )
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers, initializer=init_worker
+        )
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._wakeup = asyncio.Event()
+        await asyncio.to_thread(self.cache.load)
+        # 上次运行遗留的取消标记（对应的任务都已结束）
+        await asyncio.to_thread(shutil.rmtree, self.cancel_root, True)
+        if settings.RENDER_FARM_URL:
+            await self._connect_farm(settings.RENDER_FARM_URL)
+        self._restore()
+        self._scheduler = asyncio.create_task(self._schedule())
+        job_state.start()
+        history_writer.start()
+        RENDER_WORKERS.set(self.max_workers)
+        logger.info(f"🎬 渲染队列已启动，进程池大小: {self.max_workers}")
+
+    async def _connect_farm(self, url: str):
+        """连接渲染农场代理（local:// 时由本进程提供代理）；连不上时在本机渲染"""
+        scheme = url.partition("://")[0]
+        try:
+            self._farm_server = await asyncio.to_thread(serve_local_broker, url)
+            farm = await asyncio.to_thread(connect_broker, url)
+            await asyncio.to_thread(farm.ping)
+        except Exception as e:
+            logger.warning(f"⚠️  无法连接渲染农场代理 {scheme}: {e}，在本机渲染")
+            if self._farm_server is not None:
+                self._farm_server.shutdown()
+                self._farm_server = None
+            return
+        self.farm = farm
+        self._collector = asyncio.create_task(self._collect())
+        logger.info(f"🖥️  渲染农场已连接: {scheme}，单元大小 {settings.FARM_UNIT_SIZE}")
+
+    async def stop(self):
+        """停止调度；未完成的任务保留在状态文件中，下次启动时继续"""
+        for task in (self._scheduler, self._collector):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._scheduler = self._collector = None
+        self.farm = None
+        if self._farm_server is not None:
+            self._farm_server.shutdown()
+            self._farm_server = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        RENDER_WORKERS.set(0)
+        RENDER_BUSY.set(0)
+        self._persist()
+        self._lock.release()
+        await job_state.stop()
+        await history_writer.stop()
+
+    def submit(
+        self, config: Dict[str, Any], priority: int, frames: List[int], cache_key: str
+    ) -> RenderJob:
+        """提交渲染任务；cache_key 由 RenderCache.job_key 计算"""
+        job = RenderJob(
+            task_id=new_task_id(),
+            config=config,
+            priority=priority,
+            frames=frames,
+            cache_key=cache_key,
+        )
+        self._jobs[job.task_id] = job
+        self._enqueue(job)
+        self._persist()
+        return job
+
+    def find_active(self, cache_key: str, frames: List[int]) -> Optional[RenderJob]:
+        """查找配置和帧范围完全相同、仍在进行中的任务"""
+        task_id = self._inflight.get((cache_key, tuple(frames)))
+        return self._jobs.get(task_id) if task_id else None
+
+    def get(self, task_id: str) -> Optional[RenderJob]:
+        """按ID查询任务"""
+        return self._jobs.get(task_id)
+
+    def queue_position(self, task_id: str) -> Optional[int]:
+        """任务在等待队列中的位置（0表示下一个被调度）"""
+        ordered = sorted(self._ready)
+        for position, (_, _, queued_id) in enumerate(ordered):
+            if queued_id == task_id:
+                return position
+        return None
+
+    def checkpoint_path(self, job: RenderJob) -> Path:
+        """模拟任务的状态检查点文件"""
+        return self.checkpoint_dir / f"{job.task_id}.npz"
+
+    def framebuffer_path(self, job: RenderJob, frame: int) -> Path:
+        """渲染中的帧的帧缓冲文件"""
+        return self.framebuffer_root / job.task_id / f"frame_{frame:06d}.nfb"
+
+    def cancel_token_path(self, job: RenderJob) -> Path:
+        """取消标记文件，工作进程和农场节点据此中止正在渲染的tile（见 render_tasks.CancelToken）"""
+        return self.cancel_root / job.task_id
+
+    def _resume_tiles(self, job: RenderJob, frame: int) -> Set[int]:
+        """读取上次运行已写入帧缓冲的tile；格式或尺寸不符的帧缓冲丢弃"""
+        path = self.framebuffer_path(job, frame)
+        try:
+            header = framebuffer.read_header(path)
+            width, height = parse_resolution(job.config["resolution"])
+            tile_size = int(job.config.get("tile_size", DEFAULT_TILE_SIZE))
+            if (header.width, header.height, header.tile_size) == (width, height, tile_size):
+                return framebuffer.completed_tiles(path)
+        except FileNotFoundError:
+            return set()
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️  丢弃无法使用的帧缓冲 {path.name}: {e}")
+        path.unlink(missing_ok=True)
+        return set()
+
+    def _enqueue(self, job: RenderJob):
+        if job.is_simulation:
+            # 模拟帧整帧渲染，进度按帧计
+            width, height = parse_resolution(job.config["resolution"])
+            job.tiles = [(0, 0, width, height)]
+        else:
+            job.tiles = plan_tiles(job.config)
+        self.cache.pin(job.cache_key)
+        self._inflight[(job.cache_key, tuple(job.frames))] = job.task_id
+        job_state.record(job)
+        self._update_gauges()
+
+        # 命中缓存的帧直接完成，不再调度tile
+        extension = frame_extension(job.config)
+        done = set(job.completed_frames)
+        for frame in job.frames:
+            if frame in done:
+                continue
+            cached = self.cache.lookup(job.cache_key, frame, extension)
+            if cached is not None:
+                job.completed_frames.append(frame)
+                job.output_files.append(str(cached))
+                job.cached_frames += 1
+                done.add(frame)
+        if job.is_simulation:
+            job.pending = self._plan_chunks(job, done)
+        elif self.farm is not None:
+            job.pending = deque()
+            self._dispatch_remote(job, done)
+        else:
+            job.pending = deque()
+            for frame in job.frames:
+                if frame in done:
+                    continue
+                rendered = self._resume_tiles(job, frame)
+                if rendered:
+                    job.frame_tiles[frame] = rendered
+                if len(rendered) == len(job.tiles):
+                    job.in_flight += 1
+                    self._spawn(self._write_frame(job, frame))
+                job.pending.extend(
+                    (frame, index) for index in range(len(job.tiles)) if index not in rendered
+                )
+        if not job.pending:
+            if not job.in_flight and not job.remote:
+                self._complete(job)
+            return
+        heapq.heappush(self._ready, (job.priority, next(self._seq), job.task_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _dispatch_remote(self, job: RenderJob, done: Set[int]):
+        """
+        把未完成的帧发布到渲染农场
+
+        多帧任务按 FARM_UNIT_SIZE 帧一段切分；只剩一帧时按tile切分，各节点把tile写入
+        共享的帧缓冲，全部完成后由本机编码输出。帧缓冲的读取和创建在线程中进行，
+        准备期间算作一个进行中的单元，任务不会提前结束。
+        """
+        remaining = [frame for frame in job.frames if frame not in done]
+        if not remaining:
+            return
+        job.in_flight += 1
+        self._spawn(self._publish(job, remaining))
+
+    def _open_framebuffer(self, job: RenderJob, frame: int) -> Tuple[Path, Set[int]]:
+        """单帧任务的共享帧缓冲：沿用上次运行已写入的tile，没有时创建空的帧缓冲"""
+        path = self.framebuffer_path(job, frame)
+        rendered = self._resume_tiles(job, frame)
+        if not path.exists():
+            width, height = parse_resolution(job.config["resolution"])
+            framebuffer.create(
+                path, width, height, int(job.config.get("tile_size", DEFAULT_TILE_SIZE)),
+                dtype=settings.FRAMEBUFFER_DTYPE,
+            )
+        return path, rendered
+
+    async def _publish(self, job: RenderJob, remaining: List[int]):
+        spec = {
+            "config": job.config, "cache_key": job.cache_key, "framebuffer": "",
+            "cancel_token": str(self.cancel_token_path(job)),
+        }
+        if len(remaining) == 1:
+            frame = remaining[0]
+            try:
+                path, rendered = await asyncio.to_thread(self._open_framebuffer, job, frame)
+            except Exception as e:
+                job.in_flight -= 1
+                if job.is_active:
+                    self._fail(job, f"第{frame}帧创建帧缓冲", e)
+                else:
+                    self._release_cancelled(job)
+                return
+            if not job.is_active:
+                # 准备期间任务已经结束，帧缓冲目录已被清理，删掉刚创建的文件
+                path.unlink(missing_ok=True)
+                job.in_flight -= 1
+                self._release_cancelled(job)
+                return
+            job.frame_tiles[frame] = rendered
+            if len(rendered) == len(job.tiles):
+                # 进行中的计数交给编码
+                await self._write_frame(job, frame)
+                return
+            spec["framebuffer"] = str(path)
+            items = [[frame, index] for index in range(len(job.tiles)) if index not in rendered]
+        else:
+            items = [[frame, WHOLE_FRAME] for frame in remaining]
+        job.remote = {tuple(item) for item in items}
+        job.in_flight -= 1
+        size = max(1, settings.FARM_UNIT_SIZE)
+        chunks = [items[start:start + size] for start in range(0, len(items), size)]
+        try:
+            await asyncio.to_thread(self.farm.submit, job.task_id, job.priority, spec, chunks)
+        except Exception as e:
+            if job.is_active:
+                self._fail(job, "发布到渲染农场", e)
+            return
+        # 发布期间任务已经结束（失败或被取消），撤下刚发布的单元
+        if not job.is_active:
+            await self._withdraw(job.task_id)
+
+    async def _withdraw(self, task_id: str):
+        """撤下任务在渲染农场上还没完成的单元"""
+        try:
+            await asyncio.to_thread(self.farm.cancel, task_id)
+        except Exception as e:
+            logger.warning(f"⚠️  撤下渲染任务 {task_id} 的农场单元失败: {e}")
+
+    def _plan_chunks(self, job: RenderJob, done) -> Deque[Tuple[int, int]]:
+        """
+        模拟任务的帧段 (first, last)
+
+        状态从第1帧开始演化，起始帧之前的帧也要推进；有检查点时从检查点之后继续。
+        """
+        remaining = [frame for frame in job.frames if frame not in done]
+        if not remaining:
+            return deque()
+        if job.simulated_frame and not self.checkpoint_path(job).exists():
+            job.simulated_frame = 0
+        first = job.simulated_frame + 1
+        if first > min(remaining):
+            first = job.simulated_frame = 1
+        last = max(remaining)
+        return deque(
+            (start, min(start + SIMULATION_CHUNK - 1, last))
+            for start in range(first, last + 1, SIMULATION_CHUNK)
+        )
+
+    async def _next_job(self) -> RenderJob:
+        """取出当前优先级最高、仍有待渲染tile的任务"""
+        while True:
+            while not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            job = self._jobs.get(self._ready[0][2])
+            if job is None or not job.is_active or not job.pending:
+                heapq.heappop(self._ready)
+                continue
+            return job
+
+    async def _schedule(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                job = await self._next_job()
+            except BaseException:
+                self._slots.release()
+                raise
+
+            unit = job.pending.popleft()
+            RENDER_BUSY.inc()
+            # 模拟任务同一时间只有一个帧段在执行，执行完再重新入队
+            if not job.pending or job.is_simulation:
+                heapq.heappop(self._ready)
+            self._mark_rendering(job)
+
+            job.in_flight += 1
+            try:
+                dispatched = await self._dispatch(job, unit)
+            except asyncio.CancelledError:
+                self._undispatch(job)
+                raise
+            except BrokenProcessPool as e:
+                # 进程池里有进程被杀掉（通常是OOM），这个单元还没有开始执行，放回队列
+                logger.error(f"❌ 渲染进程池已损坏: {e}，重建进程池")
+                self._undispatch(job)
+                self._restart_executor()
+                if job.is_active:
+                    # 取出单元时任务离开了就绪堆（没有剩余单元或是模拟任务），重新放回
+                    if not job.pending or job.is_simulation:
+                        heapq.heappush(self._ready, (job.priority, next(self._seq), job.task_id))
+                    job.pending.appendleft(unit)
+                    self._wakeup.set()
+                continue
+            except Exception as e:
+                self._undispatch(job)
+                if job.is_active:
+                    self._fail(job, "调度", e)
+                continue
+            if not dispatched:
+                self._undispatch(job)
+                self._release_cancelled(job)
+
+    async def _dispatch(self, job: RenderJob, unit: Tuple[int, int]) -> bool:
+        """把一个调度单元提交到进程池；等待期间任务已结束时返回False"""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        cancel_token = str(self.cancel_token_path(job))
+        if job.is_simulation:
+            first, last = unit
+            extension = frame_extension(job.config)
+            wanted = set(job.frames) - set(job.completed_frames)
+            outputs = {
+                frame: str(self.cache.frame_path(job.cache_key, frame, extension))
+                for frame in range(first, last + 1)
+                if frame in wanted
+            }
+            future = loop.run_in_executor(
+                self._executor, simulate_frames, job.config, first, last,
+                str(self.checkpoint_path(job)), outputs, cancel_token,
+            )
+            future.add_done_callback(partial(self._on_chunk_done, job, first, last, started))
+            return True
+
+        frame, index = unit
+        path = self.framebuffer_path(job, frame)
+        if frame not in job.frame_tiles:
+            width, height = parse_resolution(job.config["resolution"])
+            # 创建帧缓冲会分配整帧大小的文件，放到线程里
+            await asyncio.to_thread(
+                framebuffer.create, path, width, height,
+                int(job.config.get("tile_size", DEFAULT_TILE_SIZE)),
+                dtype=settings.FRAMEBUFFER_DTYPE,
+            )
+            if not job.is_active:
+                path.unlink(missing_ok=True)
+                return False
+            job.frame_tiles[frame] = set()
+        future = loop.run_in_executor(
+            self._executor, render_tile_to_buffer, job.config, frame,
+            job.tiles[index], str(path), cancel_token,
+        )
+        future.add_done_callback(partial(self._on_tile_done, job, frame, index, started))
+        return True
+
+    def _undispatch(self, job: RenderJob):
+        """单元没有提交到进程池：归还进程槽位"""
+        self._slots.release()
+        RENDER_BUSY.dec()
+        job.in_flight -= 1
+
+    def _restart_executor(self):
+        """丢弃损坏的进程池并新建一个；仍在旧进程池上的单元由回调按失败处理"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker)
+
+    def _mark_rendering(self, job: RenderJob):
+        """第一个tile开始渲染时任务进入rendering状态"""
+        if job.status is not JobStatus.QUEUED:
+            return
+        job.status = JobStatus.RENDERING
+        job.started_at = time.time()
+        self._persist()
+        job_state.record(job)
+        self._update_gauges()
+        progress_broker.publish(job.task_id, "status", job.progress_data())
+
+    def _count_tiles(
+        self, job: RenderJob, tiles: List[Tuple[int, int, int, int]], samples: Optional[int]
+    ):
+        """tile数和实际花费的采样数（未知时按配置的采样数计）：计入指标和任务的平均采样数"""
+        pixels = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in tiles)
+        if samples is None:
+            samples = pixels * max(1, int(job.config.get("samples", 16)))
+        job.sampled_pixels += pixels
+        job.samples_spent += samples
+        RENDER_TILES.labels(job.engine).inc(len(tiles))
+        RENDER_SAMPLES.labels(job.engine).inc(samples)
+
+    def _on_tile_done(self, job: RenderJob, frame: int, index: int, started: float, future: Future):
+        self._slots.release()
+        RENDER_BUSY.dec()
+        job.in_flight -= 1
+        if future.cancelled():
+            return
+        error = future.exception()
+        if not job.is_active:
+            self._release_cancelled(job)
+            return
+
+        if error is not None:
+            self._fail(job, f"第{frame}帧tile {index}", error)
+            return
+
+        rendered = job.frame_tiles[frame]
+        rendered.add(index)
+        job.completed_tiles += 1
+        job.render_seconds += time.perf_counter() - started
+        job_state.record(job)
+        self._count_tiles(job, [job.tiles[index]], future.result())
+        if progress_broker.has_subscribers(job.task_id):
+            progress_broker.publish(
+                job.task_id, "tile", job.progress_data(frame=frame, tile=list(job.tiles[index]))
+            )
+        if len(rendered) == len(job.tiles):
+            job.in_flight += 1
+            self._spawn(self._write_frame(job, frame))
+
+    def _on_chunk_done(self, job: RenderJob, first: int, last: int, started: float, future: Future):
+        self._slots.release()
+        RENDER_BUSY.dec()
+        job.in_flight -= 1
+        if future.cancelled():
+            return
+        error = future.exception()
+        if not job.is_active:
+            # 取消之前刚好完成的帧段会重新写出检查点
+            self.checkpoint_path(job).unlink(missing_ok=True)
+            self._release_cancelled(job)
+            return
+
+        if error is not None:
+            self._fail(job, f"第{first}-{last}帧模拟", error)
+            return
+
+        job.simulated_frame = last
+        job.completed_tiles += last - first + 1
+        job.render_seconds += time.perf_counter() - started
+        job_state.record(job)
+        RENDER_FRAMES.labels(job.engine).inc(last - first + 1)
+        for frame, output_file in sorted(future.result().items()):
+            self.cache.add(Path(output_file))
+            job.completed_frames.append(frame)
+            job.output_files.append(output_file)
+            if progress_broker.has_subscribers(job.task_id):
+                progress_broker.publish(
+                    job.task_id, "frame", job.progress_data(frame=frame, output_file=output_file)
+                )
+        if not job.pending:
+            self._complete(job)
+            return
+        self._persist()
+        heapq.heappush(self._ready, (job.priority, next(self._seq), job.task_id))
+        self._wakeup.set()
+
+    async def _collect(self):
+        """定期取回渲染农场节点完成的条目，所有活动任务合并为一次请求"""
+        while True:
+            await asyncio.sleep(FARM_COLLECT_INTERVAL)
+            jobs = [job for job in self._jobs.values() if job.is_active and job.remote]
+            if not jobs:
+                continue
+            try:
+                results = await asyncio.to_thread(
+                    self.farm.collect, [job.task_id for job in jobs]
+                )
+            except Exception as e:
+                logger.warning(f"⚠️  读取渲染农场结果失败: {e}")
+                continue
+            for job in jobs:
+                items, error = results.get(job.task_id, ([], None))
+                # 单个任务的结果无法合并（条目格式不对、写入缓存失败）时只让这个任务失败
+                try:
+                    self._on_remote_done(job, items, error)
+                except Exception as e:
+                    if job.is_active:
+                        self._fail(job, "合并渲染农场结果", e)
+
+    def _on_remote_done(self, job: RenderJob, items: List[List[int]], error: Optional[str]):
+        """
+        合并节点完成的整帧或tile，条目为 [帧, tile序号, 实际花费的像素采样数]
+
+        升级前发布的单元汇报的条目没有采样数，按配置的采样数计。
+        """
+        if not job.is_active:
+            return
+        if error:
+            self._fail(job, "在渲染农场", RuntimeError(error))
+            return
+        if not items:
+            return
+
+        self._mark_rendering(job)
+        extension = frame_extension(job.config)
+        for frame, index, *spent in items:
+            samples = spent[0] if spent else None
+            # 租约到期被其他节点重做的条目可能汇报两次
+            if (frame, index) not in job.remote:
+                continue
+            job.remote.discard((frame, index))
+            if index == WHOLE_FRAME:
+                output_file = str(self.cache.frame_path(job.cache_key, frame, extension))
+                self.cache.add(Path(output_file))
+                job.completed_frames.append(frame)
+                job.output_files.append(output_file)
+                job.completed_tiles += len(job.tiles)
+                self._count_tiles(job, job.tiles, samples)
+                RENDER_FRAMES.labels(job.engine).inc()
+                if progress_broker.has_subscribers(job.task_id):
+                    progress_broker.publish(
+                        job.task_id, "frame", job.progress_data(frame=frame, output_file=output_file)
+                    )
+                continue
+
+            rendered = job.frame_tiles[frame]
+            rendered.add(index)
+            job.completed_tiles += 1
+            self._count_tiles(job, [job.tiles[index]], samples)
+            if progress_broker.has_subscribers(job.task_id):
+                progress_broker.publish(
+                    job.task_id, "tile", job.progress_data(frame=frame, tile=list(job.tiles[index]))
+                )
+            if len(rendered) == len(job.tiles):
+                job.in_flight += 1
+                self._spawn(self._write_frame(job, frame))
+        job_state.record(job)
+        if not job.remote and not job.in_flight:
+            self._complete(job)
+
+    async def _write_frame(self, job: RenderJob, frame: int):
+        """从帧缓冲编码整帧输出到渲染缓存，编码在线程中进行"""
+        path = self.cache.frame_path(job.cache_key, frame, frame_extension(job.config))
+        buffer_path = self.framebuffer_path(job, frame)
+        try:
+            output_file = await asyncio.to_thread(save_frame, path, job.config, buffer_path)
+            self.cache.add(path)
+            job.frame_tiles.pop(frame, None)
+            buffer_path.unlink(missing_ok=True)
+        except Exception as e:
+            job.in_flight -= 1
+            if job.is_active:
+                self._fail(job, f"第{frame}帧写出", e)
+            else:
+                self._release_cancelled(job)
+            return
+
+        job.in_flight -= 1
+        if not job.is_active:
+            self._release_cancelled(job)
+            return
+        job.completed_frames.append(frame)
+        job.output_files.append(output_file)
+        job_state.record(job)
+        RENDER_FRAMES.labels(job.engine).inc()
+        if progress_broker.has_subscribers(job.task_id):
+            progress_broker.publish(
+                job.task_id, "frame", job.progress_data(frame=frame, output_file=output_file)
+            )
+        if not job.pending and job.in_flight == 0 and not job.remote:
+            self._complete(job)
+
+    def _complete(self, job: RenderJob):
+        """所有帧都已输出：视频任务先把帧编码成视频再结束"""
+        extension = video_extension(job.config)
+        if extension is None:
+            self._finish(job, JobStatus.COMPLETED)
+            return
+        job.in_flight += 1
+        self._spawn(self._write_video(job, extension))
+
+    async def _write_video(self, job: RenderJob, extension: str):
+        """按帧号顺序把缓存中的png帧编码成视频，输出文件换成视频；相同帧范围的视频直接复用"""
+        frames = sorted(job.frames)
+        path = self.cache.video_path(job.cache_key, frames[0], frames[-1], extension)
+        try:
+            if self.cache.lookup_path(path) is None:
+                frame_files = [
+                    str(self.cache.frame_path(job.cache_key, frame, frame_extension(job.config)))
+                    for frame in frames
+                ]
+                await asyncio.to_thread(encode_video, path, job.config, frame_files)
+                self.cache.add(path)
+        except Exception as e:
+            job.in_flight -= 1
+            if job.is_active:
+                self._fail(job, "视频编码", e)
+            else:
+                self._release_cancelled(job)
+            return
+
+        job.in_flight -= 1
+        if not job.is_active:
+            self._release_cancelled(job)
+            return
+        job.output_files = [str(path)]
+        self._finish(job, JobStatus.COMPLETED)
+
+    async def cancel(self, job: RenderJob) -> Dict[str, Any]:
+        """
+        取消任务，返回取消报告
+
+        等待中的tile不再调度；进程池中正在渲染的tile和帧段在下一个采样批次（模拟任务为
+        下一个子步）检查到取消标记后中止并释放进程槽位；渲染农场上的单元撤下，节点上
+        正在渲染的条目同样通过取消标记中止。帧缓冲和模拟检查点随任务结束删除。
+        """
+        progress = job.progress
+        remaining_tiles = max(len(job.frames) * len(job.tiles) - job.done_tiles, 0)
+        reclaimed = self._estimate_cpu_seconds(job, remaining_tiles)
+        aborted = job.in_flight
+        remote = bool(job.remote)
+
+        token = self.cancel_token_path(job)
+        token.parent.mkdir(parents=True, exist_ok=True)
+        token.touch()
+        job.pending.clear()
+        job.remote.clear()
+        job.frame_tiles.clear()
+        self._finish(job, JobStatus.CANCELLED)
+
+        withdrawn = 0
+        if remote:
+            try:
+                withdrawn = await asyncio.to_thread(self.farm.cancel, job.task_id)
+            except Exception as e:
+                logger.warning(f"⚠️  撤下渲染任务 {job.task_id} 的农场单元失败: {e}")
+            # 节点上正在渲染的条目要看到标记才会中止，租约期满之后再删除
+            asyncio.get_running_loop().call_later(
+                settings.FARM_LEASE_SECONDS, partial(token.unlink, missing_ok=True)
+            )
+        else:
+            self._release_cancelled(job)
+
+        return {
+            "progress": progress,
+            "remaining_tiles": remaining_tiles,
+            "aborted_tiles": aborted,
+            "withdrawn_farm_units": withdrawn,
+            "reclaimed_cpu_seconds": round(reclaimed, 1) if reclaimed is not None else None,
+        }
+
+    def _release_cancelled(self, job: RenderJob):
+        """已取消任务在进程池中的tile全部中止后删除取消标记"""
+        if job.status is JobStatus.CANCELLED and job.in_flight == 0:
+            self.cancel_token_path(job).unlink(missing_ok=True)
+
+    def _estimate_cpu_seconds(self, job: RenderJob, tiles: int) -> Optional[float]:
+        """
+        渲染tiles个tile预计的CPU时间
+
+        工作进程都是单线程，按本任务在本机已完成单元的平均耗时估计；还没有完成的单元
+        （或tile在渲染农场上渲染）时按本机基准测试的路径追踪吞吐量估计，采样数优先用
+        已渲染像素的平均值（自适应采样时低于上限）。
+        """
+        if job.render_seconds > 0 and job.completed_tiles:
+            return tiles * job.render_seconds / job.completed_tiles
+        rate = (hardware_profile().benchmark or {}).get("path_samples_per_second")
+        if "effect" in job.config or not rate or not job.tiles:
+            return None
+        width, height = parse_resolution(job.config["resolution"])
+        samples = job.average_samples or max(1, int(job.config.get("samples", 16)))
+        return tiles * width * height / len(job.tiles) * samples / rate
+
+    def _fail(self, job: RenderJob, stage: str, error: BaseException):
+        logger.error(f"❌ 渲染任务 {job.task_id} {stage}失败: {error}")
+        job.error = str(error)
+        job.pending.clear()
+        job.frame_tiles.clear()
+        self._finish(job, JobStatus.FAILED)
+
+    def _finish(self, job: RenderJob, status: JobStatus):
+        job.status = status
+        if job.remote:
+            job.remote.clear()
+            self._spawn(self._withdraw(job.task_id))
+        job.finished_at = time.time()
+        job.completed_frames.sort()
+        job.output_files.sort()
+        self.cache.unpin(job.cache_key)
+        if job.is_simulation:
+            self.checkpoint_path(job).unlink(missing_ok=True)
+        else:
+            shutil.rmtree(self.framebuffer_root / job.task_id, ignore_errors=True)
+        inflight_key = (job.cache_key, tuple(job.frames))
+        if self._inflight.get(inflight_key) == job.task_id:
+            del self._inflight[inflight_key]
+        self._finished.append(job.task_id)
+        while len(self._finished) > MAX_FINISHED_JOBS:
+            self._jobs.pop(self._finished.popleft(), None)
+        self._persist()
+        job_state.record(job)
+        history_writer.record(job)
+        RENDER_JOBS_FINISHED.labels(status.value).inc()
+        self._update_gauges()
+        progress_broker.publish(
+            job.task_id, "status", job.progress_data(error=job.error), final=True
+        )
+        logger.info(f"🏁 渲染任务 {job.task_id} 结束: {status.value}")
+
+    def _update_gauges(self):
+        """按状态统计队列中的任务数，只在任务状态变化时调用"""
+        counts = {status: 0 for status in ACTIVE_STATUSES}
+        for job in self._jobs.values():
+            if job.is_active:
+                counts[job.status] += 1
+        for status, count in counts.items():
+            RENDER_JOBS.labels(status.value).set(count)
+
+    def _persist(self):
+        """把未结束的任务原子地写入状态文件"""
+        active = [job.to_dict() for job in self._jobs.values() if job.is_active]
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=self.state_file.parent, prefix=f".{self.state_file.name}.")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(active, fh, ensure_ascii=False)
+            os.replace(tmp_file, self.state_file)
+        except BaseException:
+            os.unlink(tmp_file)
+            raise
+
+    def _restore(self):
+        """重启后恢复未完成的任务"""
+        if not self.state_file.exists():
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as fh:
+                saved = json.load(fh)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️  无法读取渲染队列状态文件: {e}")
+            return
+
+        for data in saved:
+            if data["task_id"] in self._jobs:
+                continue
+            job = RenderJob.from_dict(data)
+            job.status = JobStatus.QUEUED
+            self._jobs[job.task_id] = job
+            self._enqueue(job)
+        if saved:
+            logger.info(f"♻️  恢复了 {len(saved)} 个未完成的渲染任务")
+
+
+# 全局渲染队列实例
+render_queue = RenderQueue(
+    max_workers=settings.RENDER_THREADS,
+    state_file=settings.BASE_DIR / settings.RENDER_OUTPUT_DIR / "render_queue.json",
+    cache=render_cache,
+)
+
+
+async def init_render_queue():
+    """启动渲染队列，进程数按本机实际可用的核数确定"""
+    render_queue.max_workers = render_workers()
+    await render_queue.start()
+    return True
+
+
+async def shutdown_render_queue():
+    """关闭渲染队列"""
+    await render_queue.stop()
@@ -0,0 +1,548 @@
+"""
+渲染进程池任务
+
+这里的函数运行在渲染进程池的子进程中，必须是模块级函数并且参数可pickle。
+渲染引擎在子进程里按需导入，API进程不需要加载NumPy。
+"""
+
+import io
+import json
+import os
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.framebuffer import FrameBuffer
+from utils.hashing import canonical_digest
+
+Tile = Tuple[int, int, int, int]
+
+DEFAULT_TILE_SIZE = 64
+DEFAULT_BOUNCES = 8
+DEFAULT_FPS = 24
+
+# 自适应采样：默认噪声阈值（像素亮度的相对标准误差）和每个像素的最少采样数
+DEFAULT_NOISE_THRESHOLD = 0.01
+DEFAULT_MIN_SAMPLES = 16
+
+# 模拟任务每个调度单元连续推进的帧数，单元之间通过状态检查点衔接
+SIMULATION_CHUNK = 24
+
+# 色调映射后写出的8位图片格式
+IMAGE_FORMATS = {"png": "PNG", "jpg": "JPEG", "jpeg": "JPEG"}
+# 不做色调映射、保留线性HDR范围的half浮点格式
+HDR_FORMATS = {"exr"}
+# 视频格式：逐帧先输出png，全部帧完成后编码成一个视频文件
+VIDEO_FORMATS = {"mp4", "mov", "avi"}
+OUTPUT_FORMATS = set(IMAGE_FORMATS) | HDR_FORMATS | VIDEO_FORMATS
+
+# 工作进程内的场景缓存，同一任务的tile复用已解析的场景
+_SCENE_CACHE: Dict[int, Any] = {}
+# 工作进程内缓存逐帧特效的渲染器，同一任务的后续tile复用已构建的数据（如体积brick、透射率缓存）
+_EFFECT_CACHE: Dict[str, Any] = {}
+
+# 两次检查取消标记之间的最短间隔（秒）
+CANCEL_CHECK_INTERVAL = 0.05
+
+
+class RenderCancelled(Exception):
+    """渲染任务已被取消，工作进程中止当前的tile或帧段"""
+
+
+class CancelToken:
+    """
+    取消令牌
+
+    API进程取消任务时创建标记文件（见 RenderQueue.cancel_token_path），工作进程在tile之间、
+    采样批次之间和模拟帧之间调用令牌检查；检查是一次stat，并且限制频率。
+    渲染农场的节点通过共享的 RENDER_OUTPUT_DIR 看到同一个标记文件。
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._checked = 0.0
+
+    def __call__(self):
+        """任务已取消时抛出 RenderCancelled"""
+        if self.path is None:
+            return
+        now = time.monotonic()
+        if now - self._checked < CANCEL_CHECK_INTERVAL:
+            return
+        self._checked = now
+        if os.path.exists(self.path):
+            raise RenderCancelled(f"Render task cancelled ({Path(self.path).name})")
+
+
+def init_worker():
+    """
+    进程池初始化
+
+    每个进程只用一个计算线程，并行度完全由进程数决定，避免BLAS线程和进程池叠加超订。
+    """
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = "1"
+
+
+def parse_resolution(resolution: str) -> Tuple[int, int]:
+    """解析 "1920x1080" 形式的分辨率"""
+    width, height = (int(part) for part in str(resolution).lower().split("x"))
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid resolution: {resolution}")
+    return width, height
+
+
+def sampling_settings(config: Dict[str, Any]) -> Tuple[int, float, int]:
+    """
+    解析采样设置，返回 (采样上限, 噪声阈值, 最少采样数)
+
+    adaptive_sampling 为真时 samples 是每个像素的上限，达到 noise_threshold 的像素提前停止；
+    否则（或上限不足两个采样、无法估计噪声时）噪声阈值为0，每个像素固定采样 samples 次。
+    """
+    samples = max(1, int(config.get("samples", 16)))
+    if not config.get("adaptive_sampling"):
+        return samples, 0.0, samples
+    threshold = float(config.get("noise_threshold", DEFAULT_NOISE_THRESHOLD))
+    if not threshold > 0:
+        raise ValueError(f"noise_threshold must be positive, got {threshold}")
+    if samples < 2:
+        return samples, 0.0, samples
+    min_samples = max(1, int(config.get("min_samples", DEFAULT_MIN_SAMPLES)))
+    return samples, threshold, min(min_samples, samples)
+
+
+def plan_tiles(config: Dict[str, Any]) -> List[Tile]:
+    """把一帧切分成tile（bucket）"""
+    width, height = parse_resolution(config["resolution"])
+    size = int(config.get("tile_size", DEFAULT_TILE_SIZE))
+    return [
+        (x, y, min(x + size, width), min(y + size, height))
+        for y in range(0, height, size)
+        for x in range(0, width, size)
+    ]
+
+
+def _load_scene(config: Dict[str, Any]):
+    from effects.path_tracer import DEFAULT_SCENE, Scene
+
+    scene_data = config.get("scene") or DEFAULT_SCENE
+    key = zlib.crc32(json.dumps(scene_data, sort_keys=True).encode("utf-8"))
+    scene = _SCENE_CACHE.get(key)
+    if scene is None:
+        _SCENE_CACHE.clear()
+        scene = _SCENE_CACHE[key] = Scene(scene_data)
+    return scene
+
+
+def _path_trace(
+    config: Dict[str, Any], frame: int, tile: Tile, max_bounces: int = 32,
+    cancel: Optional[Callable[[], None]] = None,
+):
+    import numpy as np
+
+    from effects.path_tracer import render_tile as trace_tile
+
+    width, height = parse_resolution(config["resolution"])
+    samples, noise_threshold, min_samples = sampling_settings(config)
+    bounces = min(max(1, int(config.get("bounces", DEFAULT_BOUNCES))), max_bounces)
+
+    scene = _load_scene(config)
+    # 每个tile使用固定种子，重复渲染得到完全相同的结果
+    rng = np.random.default_rng([int(config.get("seed", 0)), frame, tile[0], tile[1]])
+    return trace_tile(
+        scene, scene.camera_for_frame(frame), width, height, tile, samples, bounces, rng,
+        cancel=cancel, noise_threshold=noise_threshold, min_samples=min_samples,
+    )
+
+
+def _preview_trace(
+    config: Dict[str, Any], frame: int, tile: Tile, cancel: Optional[Callable[[], None]] = None
+):
+    """Eevee预览：同一个路径追踪器，最多两次弹射"""
+    return _path_trace(config, frame, tile, max_bounces=2, cancel=cancel)
+
+
+# 渲染引擎注册表：引擎名 -> 渲染单个tile的函数，返回 (像素, 实际花费的像素采样数)
+RENDER_ENGINES: Dict[str, Callable[..., Any]] = {
+    "Cycles": _path_trace,
+    "Eevee": _preview_trace,
+}
+
+# 当前节点不可用的引擎回退到CPU实现
+ENGINE_FALLBACKS: Dict[str, str] = {
+    "OptiX": "Cycles",
+}
+
+
+def resolve_engine(name: str) -> str:
+    """返回实际执行的引擎名"""
+    name = ENGINE_FALLBACKS.get(name, name)
+    if name not in RENDER_ENGINES:
+        raise ValueError(f"Render engine {name} is not available")
+    return name
+
+
+def render_tile(
+    config: Dict[str, Any], frame: int, tile: Tile, cancel: Optional[Callable[[], None]] = None
+):
+    """
+    在工作进程中渲染单个tile，返回 (像素, 实际花费的像素采样数)
+
+    cancel 在采样批次之间调用，抛出异常即中止。
+    """
+    if "effect" in config:
+        return _effect_tile(config, frame, tile, cancel=cancel)
+    engine = RENDER_ENGINES[resolve_engine(config.get("engine", "Cycles"))]
+    return engine(config, frame, tile, cancel=cancel)
+
+
+def render_tile_to_buffer(
+    config: Dict[str, Any], frame: int, tile: Tile, framebuffer_path: str,
+    cancel_token: Optional[str] = None,
+) -> int:
+    """
+    在工作进程中渲染单个tile并直接写入帧缓冲文件，返回实际花费的像素采样数
+
+    cancel_token 为取消标记文件：开始前和每个采样批次之间检查，任务取消后抛出
+    RenderCancelled，进程槽位在一个采样批次内释放。
+    """
+    cancel = CancelToken(cancel_token)
+    cancel()
+    pixels, samples = render_tile(config, frame, tile, cancel=cancel)
+    buffer = FrameBuffer(Path(framebuffer_path), writable=True)
+    buffer.write_tile(buffer.header.tile_index(tile), pixels)
+    return samples
+
+
+# 基准测试：默认场景上的一个tile
+BENCHMARK_CONFIG: Dict[str, Any] = {"resolution": "256x256", "samples": 4, "bounces": 4, "engine": "Cycles"}
+BENCHMARK_TILE: Tile = (96, 96, 160, 160)
+
+
+def benchmark_worker(duration: float) -> Dict[str, Any]:
+    """
+    在工作进程中测量单进程吞吐量，两项各占一半时长
+
+    - 向量化内核：float32数组乘加（光线求交的主要运算形式），GFLOP/s
+    - 路径追踪：默认场景上每秒完成的像素采样数
+    """
+    import time
+
+    import numpy as np
+
+    size = 1 << 20
+    rng = np.random.default_rng(0)
+    a, b, c = rng.random((3, size), dtype=np.float32)
+    out = np.empty_like(a)
+    iterations = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration / 2:
+        np.multiply(a, b, out=out)
+        np.add(out, c, out=out)
+        iterations += 1
+    kernel_seconds = time.perf_counter() - start
+
+    x0, y0, x1, y1 = BENCHMARK_TILE
+    samples_per_tile = (x1 - x0) * (y1 - y0) * BENCHMARK_CONFIG["samples"]
+    # 第一次渲染包含场景解析，不计入
+    render_tile(BENCHMARK_CONFIG, 1, BENCHMARK_TILE)
+    tiles = 0
+    start = time.perf_counter()
+    while tiles == 0 or time.perf_counter() - start < duration / 2:
+        render_tile(BENCHMARK_CONFIG, 1, BENCHMARK_TILE)
+        tiles += 1
+    trace_seconds = time.perf_counter() - start
+
+    return {
+        "kernel_gflops": round(2 * size * iterations / kernel_seconds / 1e9, 3),
+        "path_samples_per_second": round(samples_per_tile * tiles / trace_seconds),
+        "duration_seconds": round(kernel_seconds + trace_seconds, 3),
+    }
+
+
+def _particle_system(parameters: Dict[str, Any], seed: int):
+    from effects.particles import ParticleSystem
+
+    return ParticleSystem.from_parameters(parameters, seed=seed)
+
+
+def _particle_memory(parameters: Dict[str, Any]) -> int:
+    from effects.particles import estimate_memory
+
+    return estimate_memory(parameters.get("count", 10000))
+
+
+def _fluid_solver(parameters: Dict[str, Any], seed: int):
+    from effects.fluid import FluidSolver
+
+    return FluidSolver.from_parameters(parameters, seed=seed)
+
+
+def _fluid_memory(parameters: Dict[str, Any]) -> int:
+    from effects.fluid import estimate_memory
+
+    return estimate_memory(parameters.get("resolution", 128), parameters.get("dimensions", 2))
+
+
+def _rigid_body_world(parameters: Dict[str, Any], seed: int):
+    from effects.rigid_body import RigidBodyWorld
+
+    return RigidBodyWorld.from_parameters(parameters, seed=seed)
+
+
+def _rigid_body_memory(parameters: Dict[str, Any]) -> int:
+    from effects.rigid_body import estimate_memory
+
+    return estimate_memory(parameters.get("count", 1000))
+
+
+def _volume_renderer(parameters: Dict[str, Any], seed: int):
+    from effects.volumetric import VolumeRenderer
+
+    return VolumeRenderer.from_parameters(parameters, seed=seed)
+
+
+def _volume_memory(parameters: Dict[str, Any]) -> int:
+    from effects.volumetric import estimate_memory
+
+    return estimate_memory(parameters.get("resolution", 128))
+
+
+# 模拟特效注册表：特效ID -> (按参数创建模拟器的函数, 按参数预估内存的函数)
+# 模拟器需提供 step(dt)、render(width, height)、state_dict() 和 load_state(state)
+SIMULATIONS: Dict[str, Tuple[Callable[[Dict[str, Any], int], Any], Callable[[Dict[str, Any]], int]]] = {
+    "particles": (_particle_system, _particle_memory),
+    "fluid": (_fluid_solver, _fluid_memory),
+    "physics": (_rigid_body_world, _rigid_body_memory),
+}
+
+# 逐帧特效注册表：每帧只取决于时间、不依赖前一帧状态的特效，和渲染引擎一样按tile调度，
+# 各帧各tile在进程池和渲染农场上并行。渲染器需提供 time 属性和 render_tile(width, height, tile, cancel)
+FRAME_EFFECTS: Dict[str, Tuple[Callable[[Dict[str, Any], int], Any], Callable[[Dict[str, Any]], int]]] = {
+    "volumetric": (_volume_renderer, _volume_memory),
+}
+
+
+def resolve_simulation(effect: str) -> str:
+    """校验特效ID（模拟特效或逐帧特效）"""
+    if effect not in SIMULATIONS and effect not in FRAME_EFFECTS:
+        raise ValueError(f"Simulation effect {effect} is not available")
+    return effect
+
+
+def is_simulation(config: Dict[str, Any]) -> bool:
+    """是否为需要按帧顺序推进的模拟任务"""
+    return config.get("effect") in SIMULATIONS
+
+
+def simulation_memory(config: Dict[str, Any]) -> int:
+    """特效任务在单个工作进程中的预估内存（字节）"""
+    effect = resolve_simulation(config["effect"])
+    _, estimate = SIMULATIONS[effect] if effect in SIMULATIONS else FRAME_EFFECTS[effect]
+    return estimate(config.get("parameters") or {})
+
+
+def _effect_tile(
+    config: Dict[str, Any], frame: int, tile: Tile, cancel: Optional[Callable[[], None]] = None
+):
+    """渲染逐帧特效的一个tile，返回 (像素, 像素数)；第frame帧的时间为 frame / fps"""
+    create, _ = FRAME_EFFECTS[config["effect"]]
+    parameters = config.get("parameters") or {}
+    seed = int(config.get("seed", 0))
+    # 键是参数的完整哈希：不同参数碰撞会用错体积数据和光照
+    key = canonical_digest([config["effect"], parameters, seed])
+    renderer = _EFFECT_CACHE.get(key)
+    if renderer is None:
+        _EFFECT_CACHE.clear()
+        renderer = _EFFECT_CACHE[key] = create(parameters, seed)
+    renderer.time = frame / float(config.get("fps", DEFAULT_FPS))
+    width, height = parse_resolution(config["resolution"])
+    pixels = renderer.render_tile(width, height, tile, cancel=cancel)
+    return pixels, (tile[2] - tile[0]) * (tile[3] - tile[1])
+
+
+def simulate_frames(
+    config: Dict[str, Any], first: int, last: int, state_path: str, outputs: Dict[int, str],
+    cancel_token: Optional[str] = None,
+) -> Dict[int, str]:
+    """
+    在工作进程中连续推进第first到last帧的模拟
+
+    first大于1时从state_path的检查点继续；outputs中列出的帧渲染并写出，
+    其余帧（起始帧之前的预热帧、已缓存的帧）只推进不渲染。结束时写回检查点。
+    每个子步之前检查取消标记，任务取消时不写检查点直接中止。
+    """
+    cancel = CancelToken(cancel_token)
+    import numpy as np
+
+    create, _ = SIMULATIONS[resolve_simulation(config["effect"])]
+    simulation = create(config.get("parameters") or {}, int(config.get("seed", 0)))
+    state_file = Path(state_path)
+    if first > 1:
+        with np.load(state_file) as state:
+            if int(state["frame"]) != first - 1:
+                raise RuntimeError(
+                    f"Checkpoint is at frame {int(state['frame'])}, expected {first - 1}"
+                )
+            simulation.load_state(state)
+
+    width, height = parse_resolution(config["resolution"])
+    substeps = max(1, int(config.get("substeps", 1)))
+    dt = 1.0 / float(config.get("fps", DEFAULT_FPS)) / substeps
+    written = {}
+    for frame in range(first, last + 1):
+        for _ in range(substeps):
+            cancel()
+            simulation.step(dt)
+        if frame in outputs:
+            written[frame] = write_image(Path(outputs[frame]), config, simulation.render(width, height))
+
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=state_file.parent, prefix=f".{state_file.name}.")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            np.savez(fh, frame=last, **simulation.state_dict())
+        os.replace(tmp_path, state_file)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return written
+
+
+def output_format(config: Dict[str, Any]) -> str:
+    """校验并返回输出格式"""
+    name = str(config.get("output_format", "png")).lower()
+    if name not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {name}")
+    if name in VIDEO_FORMATS:
+        width, height = parse_resolution(config["resolution"])
+        # yuv420p 的色度按2x2采样，宽高必须是偶数
+        if width % 2 or height % 2:
+            raise ValueError(f"Video output requires even width and height, got {width}x{height}")
+    return name
+
+
+def frame_extension(config: Dict[str, Any]) -> str:
+    """输出帧的文件扩展名；视频任务的帧为png"""
+    extension = str(config.get("output_format", "png")).lower()
+    return extension if extension in IMAGE_FORMATS or extension in HDR_FORMATS else "png"
+
+
+def video_extension(config: Dict[str, Any]) -> Optional[str]:
+    """视频任务的视频文件扩展名，其余任务为None"""
+    extension = str(config.get("output_format", "png")).lower()
+    return extension if extension in VIDEO_FORMATS else None
+
+
+def _tone_map_buffer(buffer: FrameBuffer, config: Dict[str, Any]):
+    """逐tile从映射视图色调映射成8位图像，未完成的tile为黑色"""
+    import numpy as np
+
+    from effects.path_tracer import tone_map
+
+    header = buffer.header
+    image = np.zeros((header.height, header.width, 3), dtype=np.uint8)
+    exposure = float(config.get("exposure", 1.0))
+    gamma = float(config.get("gamma", 2.2))
+    for (x0, y0, x1, y1), pixels in buffer.iter_tiles():
+        image[y0:y1, x0:x1] = tone_map(pixels, exposure=exposure, gamma=gamma)
+    return image
+
+
+def save_frame(path: Path, config: Dict[str, Any], framebuffer_path: Path) -> str:
+    """从帧缓冲逐tile编码整帧，不拼合浮点整帧"""
+    buffer = FrameBuffer(framebuffer_path)
+    if not buffer.is_complete:
+        raise RuntimeError(f"Frame buffer {Path(framebuffer_path).name} is incomplete")
+    if path.suffix[1:] in HDR_FORMATS:
+        header = buffer.header
+        return _write_exr(path, header.width, header.height, header.tile_size, buffer.iter_tiles())
+    return _write_encoded(path, _tone_map_buffer(buffer, config))
+
+
+def preview_frame(config: Dict[str, Any], framebuffer_path: Path) -> bytes:
+    """渲染中的帧的PNG预览，只包含已完成的tile"""
+    from PIL import Image
+
+    image = _tone_map_buffer(FrameBuffer(framebuffer_path), config)
+    out = io.BytesIO()
+    Image.fromarray(image).save(out, "PNG", compress_level=1)
+    return out.getvalue()
+
+
+def write_image(path: Path, config: Dict[str, Any], pixels) -> str:
+    """色调映射线性图像并原子地写出；exr直接写出线性像素"""
+    from effects.path_tracer import tone_map
+
+    if path.suffix[1:] in HDR_FORMATS:
+        from utils.exr import iter_array_tiles
+
+        height, width = pixels.shape[:2]
+        size = int(config.get("tile_size", DEFAULT_TILE_SIZE))
+        return _write_exr(path, width, height, size, iter_array_tiles(pixels, size))
+    image = tone_map(
+        pixels,
+        exposure=float(config.get("exposure", 1.0)),
+        gamma=float(config.get("gamma", 2.2)),
+    )
+    return _write_encoded(path, image)
+
+
+def _write_encoded(path: Path, image) -> str:
+    """按扩展名编码8位图像；先写临时文件再原子替换，重叠帧范围的任务可能同时写同一帧"""
+    from PIL import Image
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            Image.fromarray(image).save(fh, IMAGE_FORMATS.get(path.suffix[1:], "PNG"))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return str(path)
+
+
+def _write_exr(path: Path, width: int, height: int, tile_size: int, tiles) -> str:
+    """逐tile写出half浮点EXR，原子替换"""
+    from utils.exr import write_tiled
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            write_tiled(fh, width, height, tile_size, tiles)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return str(path)
+
+
+def encode_video(path: Path, config: Dict[str, Any], frame_files: List[str]) -> str:
+    """把按帧号排好的png帧编码成视频，先写临时文件再原子替换"""
+    import numpy as np
+    from PIL import Image
+
+    from effects.video_effects import VideoEncoder, VideoInfo
+
+    width, height = parse_resolution(config["resolution"])
+    info = VideoInfo(width, height, float(config.get("fps", DEFAULT_FPS)), frames=len(frame_files))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # ffmpeg按扩展名选择容器，临时文件保留原扩展名
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}.", suffix=path.suffix)
+    os.close(fd)
+    encoder = VideoEncoder(Path(tmp_path), info)
+    try:
+        for frame_file in frame_files:
+            with Image.open(frame_file) as image:
+                encoder.write(np.asarray(image.convert("RGB")))
+        encoder.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        encoder.abort()
+        raise
+    return str(path)
@@ -0,0 +1,261 @@
+"""
+静态资源构建与服务
+
+构建：把 public/ 下的文件按内容哈希重命名（app.js -> app.3f2a9c1d0b7e.js），
+可压缩的文件预先生成gzip和brotli版本，入口页面（index.html）里的引用改写为
+带指纹的地址。结果写在 ASSET_CACHE_DIR/static 下，内容没变的文件不会重新压缩，
+构建可以在镜像构建时（python src/main.py build-static）或启动时进行。
+
+服务：带指纹的地址内容永远不变，以 immutable 长期缓存；入口页面和原始地址
+（兼容直接引用 /static/js/app.js 的页面）每次用ETag重新验证。按 Accept-Encoding
+选择预压缩版本，请求路径上不做任何压缩。
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import Dict, Optional, Set
+
+import anyio
+from loguru import logger
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from core.config import settings
+from utils.file_lock import FileLock
+from utils.file_response import RangeFileResponse
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，缺少时只生成gzip版本
+    brotli = None
+
+# 不加指纹、每次都重新验证的入口文件
+ENTRY_POINTS = {"index.html"}
+
+COMPRESSIBLE = {".html", ".js", ".css", ".svg", ".json", ".map", ".txt"}
+# 小于这个大小的文件压缩收益不抵额外的请求头
+MIN_COMPRESS_SIZE = 1024
+
+# 协商顺序：优先brotli
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, no-cache"
+
+MANIFEST = "manifest.json"
+
+
+def _write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        # mkstemp创建的文件只有属主可读，静态资源需要能被前置的web服务器读取
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _emit(target: Path, data: bytes) -> Set[Path]:
+    """写出文件及其压缩版本，返回写出的全部路径；内容没变时跳过"""
+    written = {target}
+    compressible = target.suffix in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE
+    unchanged = target.exists() and target.read_bytes() == data
+    if not unchanged:
+        _write_atomic(target, data)
+
+    for encoding, suffix in ENCODINGS:
+        variant = target.with_name(target.name + suffix)
+        if not compressible or (encoding == "br" and brotli is None):
+            variant.unlink(missing_ok=True)
+            continue
+        if unchanged and variant.exists():
+            written.add(variant)
+            continue
+        compressed = _compress(data, encoding)
+        # 压缩后没有变小就只保留原文件
+        if len(compressed) < len(data):
+            _write_atomic(variant, compressed)
+            written.add(variant)
+        else:
+            variant.unlink(missing_ok=True)
+    return written
+
+
+def build_static(source: Path, dest: Path) -> Dict[str, str]:
+    """
+    构建静态资源，返回清单：原始相对路径 -> 带指纹的相对路径
+
+    清单同时写入 dest/manifest.json；上一次构建留下的过期文件会被删除。
+    同一个目标目录同一时间只有一个进程在构建（文件锁在目录旁边，不会被清理掉），
+    其他进程等它完成后按未变的内容直接复用。
+    """
+    source, dest = Path(source), Path(dest)
+    with FileLock(dest.with_name(f".{dest.name}.lock")):
+        return _build_static(source, dest)
+
+
+def _build_static(source: Path, dest: Path) -> Dict[str, str]:
+    manifest: Dict[str, str] = {}
+    written: Set[Path] = set()
+    entries = []
+
+    for path in sorted(source.rglob("*")):
+        if not path.is_file():
+            continue
+        name = path.relative_to(source).as_posix()
+        if name in ENTRY_POINTS:
+            entries.append(name)
+            continue
+        data = path.read_bytes()
+        relative = PurePosixPath(name)
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        fingerprinted = relative.with_name(f"{relative.stem}.{digest}{relative.suffix}").as_posix()
+        written |= _emit(dest / fingerprinted, data)
+        manifest[name] = fingerprinted
+
+    # 长路径先替换，避免 a.js 的替换破坏 a.js.map 之类的引用
+    replacements = sorted(manifest.items(), key=lambda item: len(item[0]), reverse=True)
+    for name in entries:
+        html = (source / name).read_text(encoding="utf-8")
+        for original, fingerprinted in replacements:
+            html = html.replace(f"/static/{original}", f"/static/{fingerprinted}")
+        written |= _emit(dest / name, html.encode("utf-8"))
+
+    _write_atomic(dest / MANIFEST, json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    written.add(dest / MANIFEST)
+    for path in dest.rglob("*"):
+        # 以点开头的是 _write_atomic 的临时文件
+        if path.is_file() and path not in written and not path.name.startswith("."):
+            path.unlink(missing_ok=True)
+    return manifest
+
+
+@dataclass
+class StaticAsset:
+    """一个可服务的资源：原文件及其预压缩版本"""
+
+    path: Path
+    media_type: str
+    digest: str
+    cache_control: str
+    # 编码 -> (文件, 大小)；identity为原文件
+    variants: Dict[str, tuple] = field(default_factory=dict)
+
+
+def _accepted_encodings(header: Optional[str]) -> Set[str]:
+    """解析Accept-Encoding，忽略q=0的编码"""
+    accepted = set()
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticAssets(StaticFiles):
+    """
+    提供预构建静态资源的ASGI应用，接口与 StaticFiles 相同
+
+    第一次请求前（或显式调用 load 时）完成构建。
+    """
+
+    def __init__(self, source: Path, build_dir: Path):
+        super().__init__(directory=build_dir, check_dir=False)
+        self.source = Path(source)
+        self.build_dir = Path(build_dir)
+        self.assets: Dict[str, StaticAsset] = {}
+
+    def load(self):
+        """构建并加载资源表"""
+        manifest = build_static(self.source, self.build_dir)
+        assets: Dict[str, StaticAsset] = {}
+        for original, fingerprinted in manifest.items():
+            asset = self._asset(fingerprinted, IMMUTABLE)
+            assets[fingerprinted] = asset
+            assets[original] = StaticAsset(
+                asset.path, asset.media_type, asset.digest, REVALIDATE, asset.variants
+            )
+        for name in ENTRY_POINTS:
+            if (self.build_dir / name).is_file():
+                assets[name] = self._asset(name, REVALIDATE)
+        self.assets = assets
+        compressed = sum(1 for name in manifest.values() if len(assets[name].variants) > 1)
+        logger.info(f"📦 静态资源构建完成: {len(manifest)}个文件, {compressed}个预压缩")
+
+    def _asset(self, name: str, cache_control: str) -> StaticAsset:
+        path = self.build_dir / name
+        variants = {"identity": (path, path.stat().st_size)}
+        for encoding, suffix in ENCODINGS:
+            variant = path.with_name(path.name + suffix)
+            if variant.is_file():
+                variants[encoding] = (variant, variant.stat().st_size)
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        return StaticAsset(path, media_type, digest, cache_control, variants)
+
+    async def check_config(self):
+        if not self.assets:
+            await anyio.to_thread.run_sync(self.load)
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        asset = self.assets.get(PurePosixPath(*Path(path).parts).as_posix())
+        if asset is None:
+            raise HTTPException(status_code=404)
+
+        request_headers = Headers(scope=scope)
+        accepted = _accepted_encodings(request_headers.get("accept-encoding"))
+        encoding = next(
+            (coding for coding, _ in ENCODINGS if coding in asset.variants and coding in accepted),
+            "identity",
+        )
+        file, size = asset.variants[encoding]
+        etag = f'"{asset.digest}"' if encoding == "identity" else f'"{asset.digest}-{encoding}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": asset.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+
+        if_none_match = request_headers.get("if-none-match", "")
+        if etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+
+        headers["Content-Length"] = str(size)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return RangeFileResponse(
+            file, 200, headers, (0, size), scope["method"] != "HEAD", asset.media_type
+        )
+
+
+static_assets = StaticAssets(
+    source=settings.BASE_DIR / settings.STATIC_DIR,
+    build_dir=settings.BASE_DIR / settings.ASSET_CACHE_DIR / "static",
+)
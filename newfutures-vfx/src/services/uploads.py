@@ -0,0 +1,357 @@
+"""
+分块可续传上传
+
+客户端先创建上传会话（文件名、总大小、可选的sha256），再用若干个
+PATCH 请求按偏移顺序发送文件内容。请求体边接收边写入 UPLOAD_DIR/.partial 下的
+临时文件，不在内存或临时目录中整体缓存：
+
+- 按扩展名确定类型（视频/音频）和大小上限，创建时和接收时都检查，
+  超出声明大小的第一个分块即拒绝
+- 收到文件头的前几个字节时按魔数校验格式，不符立即拒绝
+- 写盘的同时计算sha256，完成时与客户端声明的值比对
+- 已提交偏移和会话信息持久化到磁盘，连接中断或服务重启后从已提交偏移继续
+
+被拒绝的上传连同已写入的数据一起删除。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiofiles
+from loguru import logger
+
+from core.config import settings
+
+# 攒够这么多字节写一次盘并提交偏移
+FLUSH_BYTES = 4 << 20
+# 格式校验需要的文件头长度
+SNIFF_BYTES = 12
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+_UNSAFE_CHARS = re.compile(r"[^\w.\-]")
+
+
+class UploadError(Exception):
+    """上传请求被拒绝；offset为服务端已提交的偏移（上传被删除时为None）"""
+
+    def __init__(self, message: str, offset: Optional[int] = None):
+        super().__init__(message)
+        self.offset = offset
+
+
+def _sniff(extension: str, head: bytes) -> bool:
+    """按文件头魔数检查内容是否与扩展名相符"""
+    if extension in ("mp4", "mov"):
+        return head[4:8] in (b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip")
+    if extension == "avi":
+        return head[:4] == b"RIFF" and head[8:12] == b"AVI "
+    if extension in ("mkv", "webm"):
+        return head[:4] == b"\x1a\x45\xdf\xa3"
+    if extension == "wav":
+        return head[:4] == b"RIFF" and head[8:12] == b"WAVE"
+    if extension == "mp3":
+        return head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0)
+    if extension == "aac":
+        return head[:4] == b"ADIF" or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xF6 == 0xF0)
+    if extension == "flac":
+        return head[:4] == b"fLaC"
+    if extension == "ogg":
+        return head[:4] == b"OggS"
+    return False
+
+
+def classify(filename: str) -> Optional[str]:
+    """按扩展名返回 "video"/"audio"，不支持的格式返回None"""
+    extension = Path(filename).suffix.lower().lstrip(".")
+    if extension in settings.SUPPORTED_VIDEO_FORMATS:
+        return "video"
+    if extension in settings.SUPPORTED_AUDIO_FORMATS:
+        return "audio"
+    return None
+
+
+def size_limit(kind: str) -> int:
+    """按类型返回大小上限（字节）"""
+    megabytes = settings.MAX_VIDEO_SIZE_MB if kind == "video" else settings.MAX_AUDIO_SIZE_MB
+    return megabytes << 20
+
+
+@dataclass
+class UploadSession:
+    """上传会话"""
+
+    upload_id: str
+    filename: str
+    kind: str
+    size: int
+    offset: int = 0
+    expected_sha256: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    path: Optional[str] = None
+    sha256: Optional[str] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+    head: bytes = field(default=b"", repr=False)
+    hasher: Any = field(default=None, repr=False)
+
+    @property
+    def complete(self) -> bool:
+        return self.path is not None
+
+    @property
+    def extension(self) -> str:
+        return Path(self.filename).suffix.lower().lstrip(".")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """持久化内容"""
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "kind": self.kind,
+            "size": self.size,
+            "offset": self.offset,
+            "expected_sha256": self.expected_sha256,
+            "created_at": self.created_at,
+            "path": self.path,
+            "sha256": self.sha256,
+        }
+
+    def status(self) -> Dict[str, Any]:
+        """API返回的会话状态"""
+        data = {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "kind": self.kind,
+            "size": self.size,
+            "offset": self.offset,
+            "complete": self.complete,
+            "upload_url": f"/api/v1/upload/{self.upload_id}",
+        }
+        if self.complete:
+            data["path"] = self.path
+            data["sha256"] = self.sha256
+        return data
+
+
+class UploadManager:
+    """管理上传会话和落盘的分块数据"""
+
+    def __init__(self, root: Path, ttl_seconds: float):
+        self.root = Path(root)
+        self.partial_dir = self.root / ".partial"
+        self.ttl_seconds = ttl_seconds
+        self._sessions: Dict[str, UploadSession] = {}
+
+    def _part_path(self, upload_id: str) -> Path:
+        return self.partial_dir / f"{upload_id}.part"
+
+    def _meta_path(self, upload_id: str) -> Path:
+        return self.partial_dir / f"{upload_id}.json"
+
+    async def create(
+        self, filename: str, size: int, sha256: Optional[str] = None
+    ) -> UploadSession:
+        """创建上传会话；格式或声明大小不符时抛出UploadError"""
+        name = _UNSAFE_CHARS.sub("_", Path(str(filename)).name)
+        kind = classify(name)
+        if kind is None:
+            raise UploadError(f"Unsupported file format: {filename}")
+        size = int(size)
+        if size <= 0:
+            raise UploadError("Upload size must be positive")
+        if size > size_limit(kind):
+            raise UploadError(
+                f"{filename} is {size / (1 << 20):.1f} MB, exceeding the "
+                f"{size_limit(kind) >> 20} MB limit for {kind} files"
+            )
+        if sha256 is not None and not re.fullmatch(r"[0-9a-fA-F]{64}", str(sha256)):
+            raise UploadError("sha256 must be 64 hex characters")
+
+        await asyncio.to_thread(self._expire)
+        session = UploadSession(
+            upload_id=uuid.uuid4().hex,
+            filename=name,
+            kind=kind,
+            size=size,
+            expected_sha256=sha256.lower() if sha256 else None,
+        )
+        session.hasher = hashlib.sha256()
+        self.partial_dir.mkdir(parents=True, exist_ok=True)
+        async with aiofiles.open(self._part_path(session.upload_id), "wb"):
+            pass
+        await self._save(session)
+        self._sessions[session.upload_id] = session
+        return session
+
+    async def get(self, upload_id: str) -> Optional[UploadSession]:
+        """查询会话；不在内存中时从磁盘恢复（服务重启后续传）"""
+        if not _UPLOAD_ID.match(upload_id):
+            return None
+        session = self._sessions.get(upload_id)
+        if session is not None:
+            return session
+        meta = self._meta_path(upload_id)
+        try:
+            async with aiofiles.open(meta, "r", encoding="utf-8") as fh:
+                data = json.loads(await fh.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️  无法读取上传会话 {upload_id}: {e}")
+            return None
+        session = UploadSession(**data)
+        if not session.complete:
+            try:
+                await asyncio.to_thread(self._recover, session)
+            except FileNotFoundError:
+                return None
+        return self._sessions.setdefault(upload_id, session)
+
+    def _recover(self, session: UploadSession):
+        """
+        对齐临时文件和已提交偏移，并重建哈希状态
+
+        进程在写盘之后、提交偏移之前退出时，文件里会多出未提交的数据，截断即可；
+        文件比偏移短时以文件为准。
+        """
+        part = self._part_path(session.upload_id)
+        with open(part, "r+b") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size > session.offset:
+                fh.truncate(session.offset)
+            session.offset = min(size, session.offset)
+            hasher = hashlib.sha256()
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                hasher.update(chunk)
+            fh.seek(0)
+            session.head = fh.read(SNIFF_BYTES)
+        session.hasher = hasher
+
+    async def append(self, session: UploadSession, offset: int, stream: AsyncIterator[bytes]):
+        """
+        从offset处追加请求体
+
+        offset必须等于已提交偏移。连接中断时已收到的数据照常提交，客户端查询偏移后续传；
+        大小或格式不符时删除整个上传并抛出UploadError。
+        """
+        if session.complete:
+            raise UploadError("Upload is already complete", session.offset)
+        if session.lock.locked():
+            raise UploadError("Another request is writing to this upload", session.offset)
+        async with session.lock:
+            if offset != session.offset:
+                raise UploadError(
+                    f"Offset mismatch: expected {session.offset}, got {offset}", session.offset
+                )
+            try:
+                await self._receive(session, stream)
+            except UploadError:
+                await self._discard(session)
+                raise
+            finally:
+                if self._part_path(session.upload_id).exists():
+                    await self._save(session)
+            if session.offset == session.size:
+                await self._finish(session)
+
+    async def _receive(self, session: UploadSession, stream: AsyncIterator[bytes]):
+        buffer = bytearray()
+        async with aiofiles.open(self._part_path(session.upload_id), "r+b") as fh:
+            await fh.seek(session.offset)
+            try:
+                async for chunk in stream:
+                    if not chunk:
+                        continue
+                    received = session.offset + len(buffer) + len(chunk)
+                    if received > session.size:
+                        raise UploadError(
+                            f"Received {received} bytes, exceeding the declared size {session.size}"
+                        )
+                    if len(session.head) < SNIFF_BYTES:
+                        session.head += chunk[:SNIFF_BYTES - len(session.head)]
+                        if len(session.head) == SNIFF_BYTES or received == session.size:
+                            if not _sniff(session.extension, session.head):
+                                raise UploadError(
+                                    f"Content does not look like a .{session.extension} file"
+                                )
+                    buffer += chunk
+                    if len(buffer) >= FLUSH_BYTES:
+                        await self._commit(fh, session, buffer)
+            finally:
+                # 连接中断时同样提交已收到的数据；被拒绝的上传随后整体删除
+                if buffer:
+                    await self._commit(fh, session, buffer)
+
+    async def _commit(self, fh, session: UploadSession, buffer: bytearray):
+        """写盘、更新哈希和已提交偏移"""
+        await fh.write(bytes(buffer))
+        await fh.flush()
+        session.hasher.update(buffer)
+        session.offset += len(buffer)
+        buffer.clear()
+
+    async def _finish(self, session: UploadSession):
+        """校验哈希并把文件移到上传目录，文件名带内容哈希前缀"""
+        digest = session.hasher.hexdigest()
+        if session.expected_sha256 and digest != session.expected_sha256:
+            await self._discard(session)
+            raise UploadError(f"sha256 mismatch: expected {session.expected_sha256}, got {digest}")
+        name = f"{digest[:16]}_{session.filename}"
+        await asyncio.to_thread(os.replace, self._part_path(session.upload_id), self.root / name)
+        session.path = name
+        session.sha256 = digest
+        session.hasher = None
+        await self._save(session)
+        self._sessions.pop(session.upload_id, None)
+        logger.info(f"📥 上传完成: {name} ({session.size / (1 << 20):.1f} MB)")
+
+    async def abort(self, session: UploadSession):
+        """取消上传并删除已写入的数据"""
+        async with session.lock:
+            await self._discard(session)
+
+    async def _discard(self, session: UploadSession):
+        self._sessions.pop(session.upload_id, None)
+        for path in (self._part_path(session.upload_id), self._meta_path(session.upload_id)):
+            await asyncio.to_thread(path.unlink, missing_ok=True)
+
+    async def _save(self, session: UploadSession):
+        """原子地写入会话信息"""
+        meta = self._meta_path(session.upload_id)
+        tmp = meta.with_suffix(".tmp")
+        async with aiofiles.open(tmp, "w", encoding="utf-8") as fh:
+            await fh.write(json.dumps(session.to_dict(), ensure_ascii=False))
+        await asyncio.to_thread(os.replace, tmp, meta)
+
+    def _expire(self):
+        """删除超过保留时间的会话和未完成的数据"""
+        if not self.partial_dir.exists():
+            return
+        deadline = time.time() - self.ttl_seconds
+        for meta in self.partial_dir.glob("*.json"):
+            try:
+                if meta.stat().st_mtime >= deadline:
+                    continue
+            except OSError:
+                continue
+            upload_id = meta.stem
+            session = self._sessions.get(upload_id)
+            if session is not None and session.lock.locked():
+                continue
+            self._sessions.pop(upload_id, None)
+            self._part_path(upload_id).unlink(missing_ok=True)
+            meta.unlink(missing_ok=True)
+
+
+# 全局上传管理器
+upload_manager = UploadManager(
+    root=settings.UPLOAD_DIR,
+    ttl_seconds=settings.UPLOAD_SESSION_TTL_HOURS * 3600,
+)
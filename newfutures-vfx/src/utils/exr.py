@@ -0,0 +1,102 @@
+"""
+OpenEXR写出
+
+只实现渲染输出需要的子集：单部分、分块（tiled）、单一分辨率层级、不压缩、
+RGB三个half通道。分块边长与帧缓冲的tile一致，像素逐tile写出，不拼合整帧；
+不压缩时每个tile的字节数可以预先算出，偏移表先于像素数据顺序写出，不需要回写。
+"""
+
+import struct
+from typing import BinaryIO, Iterable, Tuple
+
+import numpy as np
+
+MAGIC = 20000630
+# 版本2，第9位表示单部分分块文件
+VERSION = 2 | 0x200
+
+HALF = 1
+NO_COMPRESSION = 0
+INCREASING_Y = 0
+ONE_LEVEL = 0
+
+# 通道按名称字母序存放
+CHANNELS = ("B", "G", "R")
+# RGB通道序号，与 CHANNELS 对应
+_CHANNEL_INDEX = (2, 1, 0)
+
+# half能表示的最大有限值，更亮的像素截断而不是变成inf
+HALF_MAX = 65504.0
+
+Tile = Tuple[int, int, int, int]
+
+
+def _attribute(name: str, kind: str, value: bytes) -> bytes:
+    return name.encode("ascii") + b"\0" + kind.encode("ascii") + b"\0" + struct.pack("<i", len(value)) + value
+
+
+def _header(width: int, height: int, tile_size: int) -> bytes:
+    channels = b"".join(
+        name.encode("ascii") + b"\0" + struct.pack("<iB3xii", HALF, 0, 1, 1) for name in CHANNELS
+    ) + b"\0"
+    window = struct.pack("<iiii", 0, 0, width - 1, height - 1)
+    return b"".join((
+        struct.pack("<ii", MAGIC, VERSION),
+        _attribute("channels", "chlist", channels),
+        _attribute("compression", "compression", bytes([NO_COMPRESSION])),
+        _attribute("dataWindow", "box2i", window),
+        _attribute("displayWindow", "box2i", window),
+        _attribute("lineOrder", "lineOrder", bytes([INCREASING_Y])),
+        _attribute("pixelAspectRatio", "float", struct.pack("<f", 1.0)),
+        _attribute("screenWindowCenter", "v2f", struct.pack("<ff", 0.0, 0.0)),
+        _attribute("screenWindowWidth", "float", struct.pack("<f", 1.0)),
+        _attribute("tiles", "tiledesc", struct.pack("<IIB", tile_size, tile_size, ONE_LEVEL)),
+        b"\0",
+    ))
+
+
+def write_tiled(
+    fh: BinaryIO, width: int, height: int, tile_size: int, tiles: Iterable[Tuple[Tile, np.ndarray]]
+):
+    """
+    写出分块EXR
+
+    tiles 按行优先顺序产出全部 ((x0, y0, x1, y1), 线性RGB像素)，与 FrameBuffer.iter_tiles 相同。
+    """
+    tiles_x = -(-width // tile_size)
+    tiles_y = -(-height // tile_size)
+    header = _header(width, height, tile_size)
+
+    # 不压缩：每个tile是 5个int32的块头 + 像素数，偏移可以直接算出
+    offsets = []
+    offset = len(header) + 8 * tiles_x * tiles_y
+    for ty in range(tiles_y):
+        for tx in range(tiles_x):
+            offsets.append(offset)
+            w = min(tile_size, width - tx * tile_size)
+            h = min(tile_size, height - ty * tile_size)
+            offset += 20 + w * h * len(CHANNELS) * 2
+
+    fh.write(header)
+    fh.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+    written = 0
+    for (x0, y0, x1, y1), pixels in tiles:
+        if (x0, y0) != ((written % tiles_x) * tile_size, (written // tiles_x) * tile_size):
+            raise ValueError(f"Tile {(x0, y0, x1, y1)} is out of order")
+        half = np.clip(pixels[..., :3], -HALF_MAX, HALF_MAX).astype("<f2")
+        # 每条扫描线依次存放各通道：(h, 通道, w)
+        data = np.ascontiguousarray(half[..., _CHANNEL_INDEX].transpose(0, 2, 1))
+        fh.write(struct.pack("<iiiii", x0 // tile_size, y0 // tile_size, 0, 0, data.nbytes))
+        fh.write(data)
+        written += 1
+    if written != tiles_x * tiles_y:
+        raise ValueError(f"Expected {tiles_x * tiles_y} tiles, got {written}")
+
+
+def iter_array_tiles(pixels: np.ndarray, tile_size: int):
+    """把整帧数组按行优先切成tile，供 write_tiled 使用"""
+    height, width = pixels.shape[:2]
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            x1, y1 = min(x0 + tile_size, width), min(y0 + tile_size, height)
+            yield (x0, y0, x1, y1), pixels[y0:y1, x0:x1]
@@ -0,0 +1,57 @@
+"""
+进程间文件锁
+
+基于 fcntl.flock：锁跟随打开的文件描述符，持有锁的进程退出（包括崩溃）时由内核释放，
+不会留下需要手工清理的锁文件状态。用于同一台机器上的多个进程协调只应由一个进程
+做的工作（运行渲染队列、构建静态资源、测量硬件吞吐量）。
+"""
+
+import fcntl
+import os
+from pathlib import Path
+from typing import Optional
+
+
+class FileLock:
+    """排他文件锁，可用作上下文管理器（阻塞获取）"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._fd: Optional[int] = None
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """获取锁；非阻塞模式下锁被其他进程持有时返回False"""
+        if self._fd is not None:
+            return True
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,157 @@
+"""
+大文件下载响应
+
+支持单区间Range请求、基于内容哈希的强ETag和条件请求（304）。按内容寻址的文件
+（渲染缓存）由调用方传入内容标识作为ETag，不需要读取文件。
+服务器支持ASGI zero-copy send扩展时由内核sendfile直接发送文件区间，
+否则在线程中按块pread发送，不会把整个文件读进内存。
+"""
+
+import mimetypes
+import os
+from email.utils import formatdate
+from pathlib import Path
+from typing import Mapping, Optional, Tuple
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from utils.hashing import file_digest
+
+# 回退路径每次读取的块大小
+CHUNK_SIZE = 1 << 20
+
+ZERO_COPY_EXTENSION = "http.response.zerocopysend"
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单个字节区间，返回 [start, end)
+
+    没有Range头、语法无效或多区间时返回None（按整个文件响应）；
+    区间不可满足时抛出ValueError。
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[6:].strip().partition("-")
+    try:
+        if not first:
+            # 后缀区间：最后N个字节
+            length = int(last)
+            if length <= 0:
+                raise ValueError("Empty suffix range")
+            return max(size - length, 0), size
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start >= size or end <= start:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, min(end, size)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match 的弱比较"""
+    if header.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in header.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+class RangeFileResponse(Response):
+    """按区间发送文件的响应"""
+
+    def __init__(
+        self,
+        path: Path,
+        status_code: int,
+        headers: Mapping[str, str],
+        span: Tuple[int, int] = (0, 0),
+        send_body: bool = True,
+        media_type: Optional[str] = None,
+    ):
+        self.path = Path(path)
+        self.status_code = status_code
+        self.span = span
+        self.send_body = send_body
+        self.media_type = media_type
+        self.background = None
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        start, end = self.span
+        if not self.send_body or end <= start:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        with open(self.path, "rb") as fh:
+            if ZERO_COPY_EXTENSION in scope.get("extensions", {}):
+                await send({
+                    "type": ZERO_COPY_EXTENSION,
+                    "file": fh,
+                    "offset": start,
+                    "count": end - start,
+                    "more_body": False,
+                })
+                return
+            fd = fh.fileno()
+            offset = start
+            while offset < end:
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, min(CHUNK_SIZE, end - offset), offset)
+                if not chunk:
+                    raise RuntimeError(f"{self.path.name} was truncated while sending")
+                offset += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": offset < end})
+
+
+async def file_response(
+    request: Request, path: Path, cache_control: str, digest: Optional[str] = None
+) -> Response:
+    """
+    为文件生成带ETag、支持Range和条件请求的响应
+
+    digest 为文件内容的标识（如渲染缓存的内容地址），同一标识的文件内容必须相同；
+    不提供时计算文件内容的sha256（同一进程内按大小和修改时间缓存），文件不变时
+    重复请求不会再读取文件内容，直接返回304。
+    """
+    stat = await anyio.to_thread.run_sync(os.stat, path)
+    if digest is None:
+        digest = await anyio.to_thread.run_sync(file_digest, path)
+    etag = f'"{digest[:32]}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    send_body = request.method != "HEAD"
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    size = stat.st_size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        range_header = None
+    try:
+        span = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if span is None:
+        headers["Content-Length"] = str(size)
+        return RangeFileResponse(path, 200, headers, (0, size), send_body, media_type)
+    start, end = span
+    headers["Content-Length"] = str(end - start)
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    return RangeFileResponse(path, 206, headers, span, send_body, media_type)
@@ -0,0 +1,44 @@
+"""
+内容哈希工具
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Tuple
+
+# 进程内最多缓存的文件哈希数，超出时淘汰最久未用的
+DIGEST_CACHE_SIZE = 4096
+
+# (路径, 大小, 修改时间) -> 内容哈希，避免同一进程里重复读大文件；会在多个线程中调用
+_DIGEST_CACHE: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_DIGEST_LOCK = threading.Lock()
+
+
+def file_digest(path: Path) -> str:
+    """文件内容的sha256"""
+    stat = Path(path).stat()
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    with _DIGEST_LOCK:
+        digest = _DIGEST_CACHE.get(key)
+        if digest is not None:
+            _DIGEST_CACHE.move_to_end(key)
+            return digest
+    hasher = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    with _DIGEST_LOCK:
+        _DIGEST_CACHE[key] = digest
+        while len(_DIGEST_CACHE) > DIGEST_CACHE_SIZE:
+            _DIGEST_CACHE.popitem(last=False)
+    return digest
+
+
+def canonical_digest(data: Any) -> str:
+    """JSON可序列化对象的规范化sha256（键排序、无多余空白）"""
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
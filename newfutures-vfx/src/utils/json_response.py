@@ -0,0 +1,25 @@
+"""
+基于orjson的JSON响应
+
+orjson直接输出UTF-8字节，比标准库json快一个数量级，同时支持非字符串键、
+datetime和NumPy数组，作为应用的默认响应类。
+"""
+
+from typing import Any
+
+import orjson
+from starlette.responses import JSONResponse
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def dumps(content: Any) -> bytes:
+    """序列化为紧凑的UTF-8 JSON字节"""
+    return orjson.dumps(content, option=OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """用orjson编码的JSONResponse"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,58 @@
+"""
+按需加载的子系统
+
+导入很慢的依赖（SQLAlchemy等）不放在应用启动路径上：start() 在后台线程中导入
+子系统模块并执行它的初始化协程，服务不必等待即可就绪；首次使用时 get() 等待
+初始化完成。导入在线程中进行，期间事件循环照常处理请求。
+"""
+
+import asyncio
+import importlib
+from types import ModuleType
+from typing import Optional
+
+from loguru import logger
+
+
+class LazySubsystem:
+    """后台导入并初始化的模块"""
+
+    def __init__(self, module: str, init: str, close: str):
+        self.module = module
+        self.init = init
+        self.close_name = close
+        self._task: Optional[asyncio.Task] = None
+
+    async def _load(self) -> ModuleType:
+        module = await asyncio.to_thread(importlib.import_module, self.module)
+        try:
+            await getattr(module, self.init)()
+        except Exception as e:
+            logger.error(f"❌ {self.module} 初始化失败: {e}")
+            raise
+        return module
+
+    def start(self):
+        """开始在后台加载（重复调用无效）"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._load())
+            # 失败在 get() 时抛出，这里只避免未取回异常的警告
+            self._task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    async def get(self) -> ModuleType:
+        """等待加载完成并返回模块"""
+        self.start()
+        return await asyncio.shield(self._task)
+
+    async def close(self):
+        """停止加载；已经初始化完成的模块执行关闭协程"""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        if not task.done():
+            task.cancel()
+        try:
+            module = await task
+        except (asyncio.CancelledError, Exception):
+            return
+        await getattr(module, self.close_name)()
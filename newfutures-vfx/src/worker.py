@@ -0,0 +1,213 @@
+"""
+渲染农场节点
+
+`python src/main.py worker` 启动一个节点：按本机可用核数开若干槽位进程，每个槽位
+独立地从代理（RENDER_FARM_URL）领取工作单元，没有排队的单元时从其他节点窃取。
+条目逐个渲染，每完成一个向代理汇报，后台线程定期心跳续约。节点被终止时手上的单元
+在租约到期后由其他节点接手；代理暂时无法访问、或者只和本节点有关的故障（磁盘、共享目录、
+内存）也一样放弃单元等租约到期，只有换个节点也会重现的错误（配置、场景）才让任务失败。
+分发协议见 services.farm。
+"""
+
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from loguru import logger
+
+from core.config import settings
+from services import framebuffer
+from services.farm import WHOLE_FRAME, connect_broker
+from services.hardware import render_workers
+from services.render_cache import render_cache
+from services.render_tasks import (
+    DEFAULT_TILE_SIZE, RenderCancelled, frame_extension, init_worker, parse_resolution,
+    plan_tiles, render_tile_to_buffer, save_frame
+)
+from utils.logger import setup_logger
+
+# 没有可领取的单元时的轮询间隔（秒）
+IDLE_INTERVAL = 0.5
+
+# 连接代理失败后的重试间隔（秒）
+RETRY_INTERVAL = 5.0
+
+# 只和本节点有关的渲染错误：单元交给其他节点重做，不让任务失败
+NODE_ERRORS = (OSError, MemoryError)
+
+
+def _node_name(pid: int) -> str:
+    return f"{socket.gethostname()}-{pid}"
+
+
+def _scratch_path(pid: int) -> Path:
+    """槽位进程渲染整帧用的本地帧缓冲"""
+    return settings.TEMP_DIR / "farm" / f"{_node_name(pid)}.nfb"
+
+
+class Heartbeat(threading.Thread):
+    """渲染单个条目期间定期续约；单元不再属于本节点时置位 lost"""
+
+    def __init__(self, broker, node: str, unit_id: str, lease: float):
+        super().__init__(daemon=True)
+        self.broker = broker
+        self.node = node
+        self.unit_id = unit_id
+        self.lease = lease
+        self.lost = threading.Event()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.lease / 3):
+            try:
+                if self.broker.heartbeat(self.node, self.unit_id, self.lease) is None:
+                    self.lost.set()
+                    return
+            except Exception as e:
+                logger.warning(f"⚠️  单元 {self.unit_id} 心跳失败: {e}")
+
+    def stop(self):
+        self._stopped.set()
+
+
+def _render_frame(unit: Dict[str, Any], frame: int, scratch: Path) -> int:
+    """整帧渲染到本地帧缓冲，再编码写入共享的渲染缓存，返回实际花费的像素采样数"""
+    config = unit["config"]
+    width, height = parse_resolution(config["resolution"])
+    framebuffer.create(
+        scratch, width, height, int(config.get("tile_size", DEFAULT_TILE_SIZE)),
+        dtype=settings.FRAMEBUFFER_DTYPE,
+    )
+    samples = sum(
+        render_tile_to_buffer(config, frame, tile, str(scratch), unit["cancel_token"])
+        for tile in plan_tiles(config)
+    )
+    path = render_cache.frame_path(unit["cache_key"], frame, frame_extension(config))
+    save_frame(path, config, scratch)
+    return samples
+
+
+def _render_item(unit: Dict[str, Any], frame: int, index: int, scratch: Path) -> int:
+    """渲染一个条目，返回实际花费的像素采样数"""
+    if index == WHOLE_FRAME:
+        return _render_frame(unit, frame, scratch)
+    tile = plan_tiles(unit["config"])[index]
+    return render_tile_to_buffer(unit["config"], frame, tile, unit["framebuffer"], unit["cancel_token"])
+
+
+def _run_unit(broker, node: str, unit: Dict[str, Any], scratch: Path):
+    """
+    逐个渲染单元的条目；单元被拆分时在新的末位置停下，不再属于本节点时放弃
+
+    只有渲染本身出错且不是本节点的故障时才让任务失败；访问代理出错时停止续约，
+    单元在租约到期后由其他节点从未完成的位置继续。
+    """
+    lease = settings.FARM_LEASE_SECONDS
+    unit_id = unit["unit_id"]
+    heartbeat = Heartbeat(broker, node, unit_id, lease)
+    heartbeat.start()
+    try:
+        position, last = unit["next"], unit["last"]
+        while position <= last:
+            if heartbeat.lost.is_set():
+                return
+            frame, index = unit["items"][position]
+            try:
+                samples = _render_item(unit, frame, index, scratch)
+            except RenderCancelled:
+                logger.info(f"🛑 单元 {unit_id} 所属的任务已取消，中止渲染")
+                return
+            except NODE_ERRORS as e:
+                logger.warning(f"⚠️  单元 {unit_id} 在本节点渲染失败: {e}，租约到期后由其他节点接手")
+                return
+            except Exception as e:
+                logger.error(f"❌ 单元 {unit_id} 渲染失败: {e}")
+                broker.fail(node, unit_id, unit["task_id"], f"{node}: {e}")
+                return
+            last = broker.report(node, unit_id, position, lease, samples)
+            if last is None:
+                logger.info(f"♻️  单元 {unit_id} 已被接管或取消，放弃剩余条目")
+                return
+            position += 1
+        broker.release(node, unit_id)
+    except Exception as e:
+        # 代理或连接暂时不可用（Redis、管理器），任务本身没有问题
+        logger.warning(f"⚠️  单元 {unit_id} 无法访问渲染农场代理: {e}，租约到期后由其他节点接手")
+    finally:
+        heartbeat.stop()
+        scratch.unlink(missing_ok=True)
+
+
+def run_slot(url: str):
+    """槽位进程：循环领取（或窃取）并渲染工作单元"""
+    # Ctrl+C 由父进程统一处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_worker()
+    node = _node_name(os.getpid())
+    scratch = _scratch_path(os.getpid())
+    lease = settings.FARM_LEASE_SECONDS
+
+    broker = None
+    while True:
+        try:
+            if broker is None:
+                broker = connect_broker(url)
+            unit = broker.claim(node, lease)
+            if unit is None:
+                unit = broker.steal(node, lease)
+                if unit is not None:
+                    logger.info(f"🤝 从其他节点分担了 {unit['last'] - unit['next'] + 1} 个条目")
+        except Exception as e:
+            logger.warning(f"⚠️  无法访问渲染农场代理: {e}，{RETRY_INTERVAL:.0f}秒后重试")
+            broker = None
+            time.sleep(RETRY_INTERVAL)
+            continue
+        if unit is None:
+            time.sleep(IDLE_INTERVAL)
+            continue
+        _run_unit(broker, node, unit, scratch)
+
+
+def run_worker(slots: int = 0):
+    """启动渲染农场节点，slots 默认为本机可用核数；槽位进程意外退出时重新启动"""
+    setup_logger()
+    url = settings.RENDER_FARM_URL
+    if not url:
+        logger.error("❌ 未配置 RENDER_FARM_URL，无法启动渲染农场节点")
+        sys.exit(1)
+    slots = slots or render_workers()
+    context = multiprocessing.get_context("spawn")
+
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    processes = [None] * slots
+    logger.info(f"🖥️  渲染农场节点启动: {slots} 个槽位，代理 {url.partition('://')[0]}")
+    while not stopping.is_set():
+        for index, process in enumerate(processes):
+            if process is not None and process.is_alive():
+                continue
+            if process is not None:
+                logger.warning(f"⚠️  槽位 {index} 进程退出 (退出码 {process.exitcode})，重新启动")
+                _scratch_path(process.pid).unlink(missing_ok=True)
+            processes[index] = context.Process(target=run_slot, args=(url,), daemon=True)
+            processes[index].start()
+        stopping.wait(1.0)
+
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+        _scratch_path(process.pid).unlink(missing_ok=True)
+    logger.info("👋 渲染农场节点已停止")
@@ -85,8 +85,9 @@ class WebInterfaceTest:
                     ("<!DOCTYPE html>", "HTML文档类型"),
                     ("<title>NewFutures VFX", "页面标题"),
                     ("three.js", "Three.js库"),
-                    ("css/styles.css", "样式表"),
-                    ("js/app.js", "应用脚本")
+                    # 静态资源带内容指纹（styles.<hash>.css）
+                    ("css/styles.", "样式表"),
+                    ("js/app.", "应用脚本")
                 ]
                 
                 all_passed = True
@@ -168,38 +169,19 @@ class WebInterfaceTest:
             self.log_test("CORS配置", False, f"测试失败: {str(e)}")
     
     def test_performance(self):
-        """测试性能指标"""
-        # 测试并发请求
+        """测试性能指标：开环压测 /health 和特效目录，按p99判定"""
         try:
-            import threading
+            import asyncio
+            from benchmark_load import run_load
             
-            results = []
-            def make_request():
-                start_time = time.time()
-                response = self.session.get(urljoin(self.base_url, "/health"))
-                end_time = time.time()
-                results.append(end_time - start_time)
-            
-            # 发送10个并发请求
-            threads = []
-            for _ in range(10):
-                thread = threading.Thread(target=make_request)
-                threads.append(thread)
-                thread.start()
-            
-            for thread in threads:
-                thread.join()
-            
-            if results:
-                avg_response_time = sum(results) / len(results)
-                max_response_time = max(results)
-                
-                if avg_response_time < 0.5:  # 平均响应时间小于500ms
-                    self.log_test("并发性能", True, f"平均响应时间: {avg_response_time:.3f}s", avg_response_time)
-                else:
-                    self.log_test("并发性能", False, f"响应时间过慢: {avg_response_time:.3f}s", avg_response_time)
-            else:
-                self.log_test("并发性能", False, "无法获取性能数据")
+            results = asyncio.run(run_load(self.base_url, ["health", "catalog"], duration=3.0))
+            for name, result in results.items():
+                p99 = result["p99_ms"] / 1000
+                message = (f"p50 {result['p50_ms']:.1f}ms, p99 {result['p99_ms']:.1f}ms, "
+                           f"{result['throughput_rps']:.0f} req/s, 错误 {result['errors']}")
+                # p99小于500ms且没有失败的请求
+                success = result["errors"] == 0 and p99 < 0.5
+                self.log_test(f"并发性能 ({name})", success, message, p99)
         except Exception as e:
             self.log_test("并发性能", False, f"性能测试失败: {str(e)}")
     